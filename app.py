@@ -1,3 +1,4 @@
+import hashlib
 import random
 from typing import List
 
@@ -5,8 +6,20 @@ import streamlit as st
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 from streamlit_js_eval import streamlit_js_eval
 
-from chatbot.chatbot import Chatbot, ChunkEvent, Message, Role, SourcesEvent, create_history
+from data_ingestor.backends import BACKEND_MODULES, create_backend
+from chatbot.chatbot import (
+    Chatbot,
+    ChunkEvent,
+    FinalAnswerEvent,
+    InstrumentationEvent,
+    Message,
+    Role,
+    SourcesEvent,
+    answer_messages,
+    create_history,
+)
 from file_loader.file_loader import load_uploaded_file
+from model_registry.model_registry import start_warmup
 
 
 LOADING_MESSAGES = [
@@ -36,6 +49,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
+start_warmup()
+
 st.header("IntelliRAG: AI Assistant for Document Analysis and web scraping")
 st.subheader("Private intelligence for your thoughts and files")
 
@@ -43,7 +58,7 @@ def show_uploaded_documents() -> List[UploadedFile]:
     holder = st.empty()
     with holder.container():
         # dropdown to select inmemeory and vector db option
-        db_option = st.selectbox("Select Vector store Option", ["InMemory", "Pinecone"])
+        db_option = st.selectbox("Select Vector store Option", list(BACKEND_MODULES))
         st.session_state["db_option"] = db_option
 
         uploaded_files = st.file_uploader(
@@ -59,13 +74,38 @@ def show_uploaded_documents() -> List[UploadedFile]:
         holder.empty()
         return uploaded_files
 
-@st.cache_resource(show_spinner=False)
-def create_chatbot(files: List[UploadedFile]):
-    files = [load_uploaded_file(file) for file in files]
-    return Chatbot(files)
+def upload_hash(uploaded_file: UploadedFile) -> str:
+    # Hashes the raw upload, so unchanged files are recognized on every rerun without extracting them
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+def sync_chatbot(uploaded_files: List[UploadedFile]) -> Chatbot:
+    # Only the files that changed since the last rerun are ingested or removed. A file uploaded again
+    # with other content replaces the indexed one of the same name. Switching the vector store
+    # re-ingests everything into the new backend.
+    backend_name = st.session_state["db_option"]
+    uploaded_hashes = {file.name: upload_hash(file) for file in uploaded_files}
+    if "chatbot" not in st.session_state or st.session_state.chatbot.backend.name != backend_name:
+        st.session_state.chatbot = Chatbot(
+            [load_uploaded_file(file) for file in uploaded_files], create_backend(backend_name)
+        )
+        st.session_state.file_hashes = uploaded_hashes
+        return st.session_state.chatbot
+    chatbot = st.session_state.chatbot
+    indexed_hashes = st.session_state.file_hashes
+    removed_names = [name for name in indexed_hashes if name not in uploaded_hashes]
+    added_files = [
+        load_uploaded_file(file) for file in uploaded_files if indexed_hashes.get(file.name) != uploaded_hashes[file.name]
+    ]
+    if removed_names:
+        chatbot.remove_files(removed_names)
+    if added_files:
+        # add_files replaces the chunks of a file already indexed under the same name
+        chatbot.add_files(added_files)
+    st.session_state.file_hashes = uploaded_hashes
+    return chatbot
     
 uploaded_files = show_uploaded_documents()
-chatbot = create_chatbot(uploaded_files)
+chatbot = sync_chatbot(uploaded_files)
 
 if "messages" not in st.session_state:
     st.session_state.messages = create_history(WELCOME_MESSAGE)
@@ -110,6 +150,7 @@ with st.sidebar:
     # Add additional sidebar information
     st.divider()
     st.caption("Supported formats: PDF, Markdown, TXT")
+    show_timings = st.toggle("Show stage timings", value=False)
     
     # Add a mini stats section 
     if chatbot.files:
@@ -138,7 +179,8 @@ if prompt := st.chat_input("Type your messages..."):
         full_response = ""
         message_placeholder = st.empty()
         message_placeholder.status(random.choice(LOADING_MESSAGES), state="running")
-        for event in chatbot.ask(prompt, st.session_state.messages):
+        # Coalesced chunks redraw the growing answer a few times a second instead of once per token
+        for event in chatbot.ask(prompt, st.session_state.messages, coalesce=True):
             if isinstance(event, SourcesEvent):
                 for i, doc in enumerate(event.content):
                     with st.expander(f"Source #{i+1}"):
@@ -147,3 +189,11 @@ if prompt := st.chat_input("Type your messages..."):
                 chunk = event.content
                 full_response += chunk
                 message_placeholder.markdown(full_response)
+            if isinstance(event, FinalAnswerEvent):
+                # Thinking without an opening tag is only removed from the final answer
+                if event.content != full_response.strip():
+                    message_placeholder.markdown(event.content)
+                st.session_state.messages.extend(answer_messages(prompt, event))
+            if isinstance(event, InstrumentationEvent) and show_timings:
+                with st.expander("Stage timings"):
+                    st.table([{"stage": s.name, "ms": s.duration_ms, **s.attributes} for s in event.spans])
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set, TextIO, Tuple
+
+from langchain_core.documents import Document
+from loguru import logger
+
+from chatbot.chatbot import Chatbot, remove_thinking
+from config.config import Config
+from data_ingestor.backends import BACKEND_MODULES, create_backend
+from data_ingestor.batch_retrieval import retrieve_batch
+from file_loader.file_loader import load_file
+from instrumentation.instrumentation import count_llm_tokens, export_metrics
+
+
+@dataclass
+class Question:
+    id: str
+    question: str
+
+
+def read_questions(path: Path) -> Iterator[Question]:
+    # One JSON object per line with a "question" and an optional "id", which defaults to the line number
+    with path.open(encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record.get("question"), str):
+                raise ValueError(f"Line {line_number} of {path} has no question")
+            yield Question(id=str(record.get("id", line_number)), question=record["question"])
+
+def load_checkpoint(path: Path) -> Set[str]:
+    # The output file is the checkpoint: every complete line is an answered question. A line cut off
+    # by an interruption is truncated away, so the next run appends from a clean line.
+    done: Set[str] = set()
+    if not path.exists():
+        return done
+    valid_bytes = 0
+    with path.open("rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (json.JSONDecodeError, KeyError, TypeError):
+                break
+            valid_bytes += len(line)
+    if valid_bytes < path.stat().st_size:
+        logger.warning(f"Truncating an incomplete answer at the end of {path}")
+        os.truncate(path, valid_bytes)
+    return done
+
+def _batches(questions: Iterable[Question], size: int) -> Iterator[List[Question]]:
+    iterator = iter(questions)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def _source(document: Document) -> dict:
+    return {
+        "source": document.metadata.get("source"),
+        "content": document.page_content,
+        "relevance_score": document.metadata.get("relevance_score"),
+    }
+
+
+class BatchAnswerer:
+    # Questions are retrieved a batch at a time and answered by `concurrency` workers. The queue between
+    # them holds one batch, so retrieving the next batch overlaps with answering the current one and
+    # memory stays bounded however long the question file is.
+    def __init__(self, chatbot: Chatbot, output: TextIO, batch_size: int, concurrency: int):
+        self.chatbot = chatbot
+        self.output = output
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.answered = 0
+        self.failed = 0
+
+    async def run(self, questions: Iterable[Question]) -> Dict[str, int]:
+        queue: "asyncio.Queue[Tuple[Question, List[Document], Dict[str, float]] | None]" = asyncio.Queue(self.batch_size)
+        workers = [asyncio.create_task(self._work(queue)) for _ in range(self.concurrency)]
+        try:
+            for batch in _batches(questions, self.batch_size):
+                retrieval = await asyncio.to_thread(
+                    retrieve_batch,
+                    self.chatbot.retriever,
+                    [question.question for question in batch],
+                    Config.BatchQA.RETRIEVAL_CONCURRENCY,
+                )
+                # Batched stages are reported per question, as the batch time divided by its size
+                timings = {f"{stage}_ms": round(seconds * 1000 / len(batch), 3) for stage, seconds in retrieval.seconds.items()}
+                for question, documents in zip(batch, retrieval.documents):
+                    await queue.put((question, documents, timings))
+                logger.info(f"Retrieved {len(batch)} questions, {self.answered} answered so far")
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        return {"answered": self.answered, "failed": self.failed}
+
+    async def _work(self, queue: asyncio.Queue):
+        while (item := await queue.get()) is not None:
+            question, documents, timings = item
+            try:
+                record = await self._answer(question, documents, timings)
+            except Exception as error:
+                # Not written, so the next run retries it
+                self.failed += 1
+                logger.warning(f"Could not answer question {question.id}: {error}")
+                continue
+            self.output.write(json.dumps(record) + "\n")
+            self.output.flush()
+            self.answered += 1
+
+    async def _answer(self, question: Question, documents: List[Document], timings: Dict[str, float]) -> dict:
+        start = time.perf_counter()
+        prompt = self.chatbot.prompt_assembler.assemble(question.question, [], documents)
+        assembled = time.perf_counter()
+        answer = await self.chatbot.llm.ainvoke(prompt.messages)
+        tokens = count_llm_tokens(answer.usage_metadata, Config.Model.NAME, "batch_generate")
+        return {
+            "id": question.id,
+            "question": question.question,
+            "answer": remove_thinking(answer.content),
+            "sources": [_source(document) for document in documents],
+            "timings": {
+                **timings,
+                "prompt_ms": round((assembled - start) * 1000, 3),
+                "generate_ms": round((time.perf_counter() - assembled) * 1000, 3),
+            },
+            **tokens,
+        }
+
+
+def answer_questions(
+    input_path: Path,
+    output_path: Path,
+    files: List[Path],
+    backend: str = "InMemory",
+    batch_size: int = Config.BatchQA.BATCH_SIZE,
+    concurrency: int = Config.BatchQA.CONCURRENCY,
+) -> Dict[str, int]:
+    done = load_checkpoint(output_path)
+    if done:
+        logger.info(f"Resuming after {len(done)} answered questions in {output_path}")
+    chatbot = Chatbot([load_file(path) for path in files], create_backend(backend))
+    questions = (question for question in read_questions(input_path) if question.id not in done)
+    with output_path.open("a", encoding="utf-8") as output:
+        stats = asyncio.run(BatchAnswerer(chatbot, output, batch_size, concurrency).run(questions))
+    export_metrics()
+    return {"skipped": len(done), **stats}
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions over a fixed set of files, resuming from the output file")
+    parser.add_argument("input", type=Path, help="JSONL with one {\"id\": ..., \"question\": ...} per line")
+    parser.add_argument("output", type=Path, help="JSONL answers; questions already in it are skipped")
+    parser.add_argument("--files", type=Path, nargs="+", required=True)
+    parser.add_argument("--backend", default="InMemory", choices=list(BACKEND_MODULES))
+    parser.add_argument("--batch-size", type=int, default=Config.BatchQA.BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=Config.BatchQA.CONCURRENCY)
+    args = parser.parse_args()
+    stats = answer_questions(args.input, args.output, args.files, args.backend, args.batch_size, args.concurrency)
+    logger.info(f"Batch finished: {stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.fake_models import DIMENSION, create_fake_embeddings
+from config.config import Config
+
+GENERATE_BATCH_ROWS = 100_000
+
+
+def _clustered_vectors(rng: np.random.Generator, centers: np.ndarray, n: int, spread: float) -> np.ndarray:
+    # Embeddings of real chunks bunch up by topic, unlike uniformly random vectors
+    vectors = np.empty((n, centers.shape[1]), dtype=np.float32)
+    for start in range(0, n, GENERATE_BATCH_ROWS):
+        end = min(start + GENERATE_BATCH_ROWS, n)
+        noise = rng.standard_normal((end - start, centers.shape[1]), dtype=np.float32) * spread
+        vectors[start:end] = centers[rng.integers(len(centers), size=end - start)] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def _documents(start: int, end: int) -> List[Document]:
+    return [Document(id=str(i), page_content=f"chunk-{i}") for i in range(start, end)]
+
+def _search(store, queries: np.ndarray, k: int):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = store.similarity_search_with_score_by_vector(query, k=k)
+        latencies.append(time.perf_counter() - start)
+        results.append({doc.id for doc, _ in hits})
+    return results, latencies
+
+def _recall(results, truth) -> float:
+    return round(float(np.mean([len(found & expected) / len(expected) for found, expected in zip(results, truth)])), 4)
+
+def _latency(latencies: List[float]) -> dict:
+    return {"p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2), "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2)}
+
+def run(n: int, n_queries: int, k: int, centers: int, spread: float, probes: List[int], refine_factors: List[int]) -> dict:
+    from data_ingestor.ivfpq_vector_store import IVFPQVectorStore
+    from data_ingestor.numpy_vector_store import NumpyVectorStore
+
+    rng = np.random.default_rng(Config.SEED)
+    center_vectors = rng.standard_normal((centers, DIMENSION), dtype=np.float32)
+    # A tenth of the vectors is inserted after the index is trained
+    n_initial = n - n // 10
+    vectors = _clustered_vectors(rng, center_vectors, n, spread)
+    queries = _clustered_vectors(rng, center_vectors, n_queries, spread)
+
+    exact = NumpyVectorStore(create_fake_embeddings())
+    exact.add_embeddings(_documents(0, n), vectors)
+    truth, exact_latencies = _search(exact, queries, k)
+
+    ann = IVFPQVectorStore(create_fake_embeddings())
+    start = time.perf_counter()
+    ann.add_embeddings(_documents(0, n_initial), vectors[:n_initial])
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    ann.add_embeddings(_documents(n_initial, n), vectors[n_initial:])
+    insert_seconds = time.perf_counter() - start
+    report = {
+        "vectors": n,
+        "queries": n_queries,
+        "k": k,
+        "lists": len(ann._centroids),
+        "subvectors": ann._codebooks.shape[0],
+        "build_seconds": round(build_seconds, 2),
+        "incremental_insert_seconds": round(insert_seconds, 2),
+        "incremental_rows": n - n_initial,
+        "code_mb": round(n * ann._codebooks.shape[0] / 1024 / 1024, 1),
+        "vector_mb": round(vectors.nbytes / 1024 / 1024, 1),
+        "exact": _latency(exact_latencies),
+        "ann": [],
+    }
+    for refine_factor in refine_factors:
+        for n_probes in probes:
+            ann.probes, ann.refine_factor = n_probes, refine_factor
+            results, latencies = _search(ann, queries, k)
+            report["ann"].append(
+                {"probes": n_probes, "refine_factor": refine_factor, f"recall@{k}": _recall(results, truth), **_latency(latencies)}
+            )
+    # The index comes back from disk with the exact same answers
+    ann.probes, ann.refine_factor = Config.ANN.PROBES, Config.ANN.REFINE_FACTOR
+    results, _ = _search(ann, queries, k)
+    with tempfile.TemporaryDirectory() as directory:
+        ann.save(Path(directory))
+        loaded = IVFPQVectorStore.load(Path(directory), create_fake_embeddings())
+        loaded_results, latencies = _search(loaded, queries, k)
+    report["loaded"] = {"same_results": loaded_results == results, f"recall@{k}": _recall(loaded_results, truth), **_latency(latencies)}
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k and latency of the IVF-PQ store against exact search")
+    parser.add_argument("--vectors", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--centers", type=int, default=2000, help="Topics the synthetic embeddings cluster around")
+    parser.add_argument("--spread", type=float, default=0.6, help="Spread of the embeddings around their topic")
+    parser.add_argument("--probes", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--refine-factors", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+    print(json.dumps(run(args.vectors, args.queries, args.k, args.centers, args.spread, args.probes, args.refine_factors), indent=2))
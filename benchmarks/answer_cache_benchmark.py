@@ -0,0 +1,89 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from benchmarks.corpus import create_corpus, synthetic_queries
+from benchmarks.fake_ollama import FakeOllamaServer
+
+FOLLOW_UP = "Tell me more about that."
+
+
+def _ask(bot, chatbot_module, question: str, history: List) -> float:
+    start = time.perf_counter()
+    for event in bot.ask(question, history):
+        if isinstance(event, chatbot_module.FinalAnswerEvent):
+            history.extend(chatbot_module.answer_messages(question, event))
+    return time.perf_counter() - start
+
+def _run(questions: int, response_tokens: int, results: "multiprocessing.Queue"):
+    # Runs in a fresh process, since chat model clients are shared per process and bound to one Ollama URL
+    ollama = FakeOllamaServer(response_tokens=response_tokens).start()
+    os.environ["OLLAMA_HOST"] = ollama.url
+    import chatbot.chatbot as chatbot_module
+    from benchmarks.fake_models import use_fake_models
+    from config.config import Config
+    from data_ingestor.backends import create_backend
+    from file_loader.file_loader import load_file
+
+    Config.Cache.ENABLED = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+    Config.Models.WARMUP = False
+    Config.Chatbot.PREFILL_WARMUP = False
+    Config.Chatbot.ANSWER_CACHE_ENABLED = True
+    Config.Chatbot.ANSWER_CACHE_PERSIST = False
+    backend = create_backend("InMemory")
+    use_fake_models(backend.module)
+    with tempfile.TemporaryDirectory() as directory:
+        bot = chatbot_module.Chatbot([load_file(path) for path in create_corpus(Path(directory), "small")], backend)
+    welcome = chatbot_module.Message(chatbot_module.Role.ASSISTANT, "Hello")
+
+    def new_conversation() -> List:
+        return chatbot_module.create_history(welcome)
+
+    report = {"questions": questions}
+    first = [_ask(bot, chatbot_module, question, new_conversation()) for question in synthetic_queries(questions)]
+    requests = ollama.stats.requests
+    repeated = [_ask(bot, chatbot_module, question, new_conversation()) for question in synthetic_queries(questions)]
+    report["opening_questions"] = {
+        "first_ask_ms": round(sum(first) / questions * 1000, 1),
+        "repeated_ask_ms": round(sum(repeated) / questions * 1000, 1),
+        "repeated_llm_requests": ollama.stats.requests - requests,
+    }
+    # The same follow-up after different questions must reach the model every time
+    follow_ups = []
+    for question in synthetic_queries(questions):
+        history = new_conversation()
+        _ask(bot, chatbot_module, question, history)
+        requests = ollama.stats.requests
+        _ask(bot, chatbot_module, FOLLOW_UP, history)
+        follow_ups.append(ollama.stats.requests - requests)
+    report["cross_conversation_follow_ups"] = {
+        "answered_by_model": sum(1 for requests in follow_ups if requests > 0),
+        "answered_from_cache": sum(1 for requests in follow_ups if requests == 0),
+    }
+    ollama.stop()
+    results.put(report)
+
+def run(questions: int, response_tokens: int) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run, args=(questions, response_tokens, results))
+    process.start()
+    report = results.get()
+    process.join()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency of repeated questions on the answer cache, and follow-ups that must not hit it")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--response-tokens", type=int, default=40)
+    args = parser.parse_args()
+    report = run(args.questions, args.response_tokens)
+    print(json.dumps(report, indent=2))
+    if report["cross_conversation_follow_ups"]["answered_from_cache"]:
+        raise SystemExit("A follow-up was answered from another conversation's cache entry")
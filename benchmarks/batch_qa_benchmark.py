@@ -0,0 +1,118 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from benchmarks.corpus import create_corpus, synthetic_queries
+from benchmarks.fake_ollama import FakeOllamaServer
+
+
+def _setup(ollama_url: str):
+    # Runs in a fresh process: the shared Ollama client is bound to the event loop it first ran on
+    os.environ["OLLAMA_HOST"] = ollama_url
+    from benchmarks.fake_models import use_fake_models
+    from config.config import Config
+    from data_ingestor.backends import create_backend
+
+    Config.Cache.ENABLED = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+    Config.Models.WARMUP = False
+    use_fake_models(create_backend("InMemory").module)
+
+def _run_sequential(ollama_url: str, paths: List[Path], questions: List[str], results: "multiprocessing.Queue"):
+    _setup(ollama_url)
+    from chatbot.chatbot import Chatbot
+    from data_ingestor.backends import create_backend
+    from data_ingestor.batch_retrieval import retrieve_batch
+    from file_loader.file_loader import load_file
+
+    bot = Chatbot([load_file(path) for path in paths], create_backend("InMemory"))
+    # Retrieval alone, one query at a time past the result cache, then as one batch
+    start = time.perf_counter()
+    single = [bot.retriever.retriever.invoke(question) for question in questions]
+    single_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = retrieve_batch(bot.retriever, questions)
+    batch_seconds = time.perf_counter() - start
+    same = sum(
+        {doc.page_content for doc in one} == {doc.page_content for doc in other}
+        for one, other in zip(single, batch.documents)
+    )
+    start = time.perf_counter()
+    for question in questions:
+        for _ in bot.ask(question, []):
+            pass
+    results.put(
+        {
+            "ask_seconds": round(time.perf_counter() - start, 2),
+            "retrieval": {
+                "single_ms_per_question": round(single_seconds * 1000 / len(questions), 3),
+                "batch_ms_per_question": round(batch_seconds * 1000 / len(questions), 3),
+                "batch_stage_ms": {stage: round(seconds * 1000, 1) for stage, seconds in batch.seconds.items()},
+                "same_context": round(same / len(questions), 3),
+            },
+        }
+    )
+
+def _run_batch(ollama_url: str, input_path: Path, output_path: Path, paths: List[Path], batch_size: int, concurrency: int, results: "multiprocessing.Queue"):
+    _setup(ollama_url)
+    from batch_qa.batch_qa import answer_questions
+
+    start = time.perf_counter()
+    stats = answer_questions(input_path, output_path, paths, batch_size=batch_size, concurrency=concurrency)
+    results.put({**stats, "seconds": round(time.perf_counter() - start, 2)})
+
+def _in_process(target, *args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def _write_questions(path: Path, questions: List[str]):
+    path.write_text("".join(json.dumps({"id": f"q{i}", "question": question}) + "\n" for i, question in enumerate(questions)))
+
+def run(n_questions: int, corpus: str, batch_size: int, concurrency: int) -> dict:
+    questions = synthetic_queries(n_questions)
+    ollama = FakeOllamaServer(response_tokens=20, tokens_per_second=400, num_parallel=concurrency).start()
+    report = {"questions": n_questions, "corpus": corpus, "batch_size": batch_size, "concurrency": concurrency}
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        paths = create_corpus(directory, corpus)
+
+        requests = ollama.stats.requests
+        report["sequential"] = _in_process(_run_sequential, ollama.url, paths, questions)
+        report["sequential"]["llm_requests"] = ollama.stats.requests - requests
+
+        input_path, output_path = directory / "questions.jsonl", directory / "answers.jsonl"
+        _write_questions(input_path, questions)
+        requests = ollama.stats.requests
+        report["batch"] = _in_process(_run_batch, ollama.url, input_path, output_path, paths, batch_size, concurrency)
+        report["batch"]["llm_requests"] = ollama.stats.requests - requests
+
+        # Interrupted run: half of the answers and a cut-off line, then a full run resumes
+        resumed_path = directory / "resumed.jsonl"
+        lines = output_path.read_text().splitlines(keepends=True)
+        resumed_path.write_text("".join(lines[: n_questions // 2]) + lines[n_questions // 2][:40])
+        requests = ollama.stats.requests
+        report["resume"] = _in_process(_run_batch, ollama.url, input_path, resumed_path, paths, batch_size, concurrency)
+        report["resume"]["llm_requests"] = ollama.stats.requests - requests
+        answers = [json.loads(line) for line in resumed_path.read_text().splitlines()]
+        report["resume"]["complete"] = sorted(answer["id"] for answer in answers) == sorted(f"q{i}" for i in range(n_questions))
+    ollama.stop()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a question set one ask at a time and with the batch CLI")
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--corpus", default="medium", choices=["small", "medium", "large"])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    print(json.dumps(run(args.questions, args.corpus, args.batch_size, args.concurrency), indent=2))
@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from langchain_core.documents import Document
+
+from benchmarks.corpus import CORPUS_SIZES, create_corpus
+from benchmarks.fake_ollama import FakeOllamaServer
+from config.config import Config
+from data_ingestor.chunker import split_file
+from data_ingestor.contextualizer import CONTEXT_STRATEGIES, contextualize_chunks
+from file_loader.file_loader import load_file
+
+
+def _measure(strategy: str, documents: List[Document], chunks: List[List[Document]], args: argparse.Namespace) -> dict:
+    # Every strategy gets a fresh server, so no KV cache carries over between them
+    with FakeOllamaServer(
+        prompt_tokens_per_second=args.llm_prompt_tokens_per_second,
+        tokens_per_second=args.llm_tokens_per_second,
+        response_tokens=args.llm_response_tokens,
+        num_parallel=args.num_parallel,
+        prefix_cache=True,
+    ) as server:
+        os.environ["OLLAMA_HOST"] = server.url
+        start = time.perf_counter()
+        contextualize_chunks(documents, chunks, on_progress=lambda done, total: None, strategy=strategy)
+        seconds = time.perf_counter() - start
+    return {
+        "strategy": strategy,
+        "seconds": round(seconds, 2),
+        "requests": server.stats.requests,
+        "prefilled_tokens": server.stats.prompt_tokens,
+        "cached_prompt_tokens": server.stats.cached_prompt_tokens,
+        "generated_tokens": server.stats.generated_tokens,
+    }
+
+def run(sizes: List[str], strategies: List[str], args: argparse.Namespace) -> dict:
+    report = {"settings": {key: value for key, value in vars(args).items() if key not in ("sizes", "strategies")}, "corpora": []}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            files = [load_file(path) for path in create_corpus(Path(directory), size)]
+        documents = [Document(file.content, metadata={"source": file.name}) for file in files]
+        chunks = [split_file(file) for file in files]
+        report["corpora"].append(
+            {
+                "corpus": size,
+                "documents": len(documents),
+                "chunks": sum(len(document_chunks) for document_chunks in chunks),
+                "strategies": [_measure(strategy, documents, chunks, args) for strategy in strategies],
+            }
+        )
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tokens prefilled and wall time of the contextualization strategies against a fake Ollama server with a prefix cache")
+    parser.add_argument("--sizes", nargs="+", choices=list(CORPUS_SIZES), default=["small"])
+    parser.add_argument("--strategies", nargs="+", choices=CONTEXT_STRATEGIES, default=list(CONTEXT_STRATEGIES))
+    parser.add_argument("--num-parallel", type=int, default=4)
+    parser.add_argument("--llm-prompt-tokens-per-second", type=float, default=5000)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200)
+    parser.add_argument("--llm-response-tokens", type=int, default=40)
+    args = parser.parse_args()
+    Config.Preprocessing.CONTEXT_CONCURRENCY = max(Config.Preprocessing.CONTEXT_CONCURRENCY, args.num_parallel)
+    Config.Preprocessing.CONTEXT_CACHE_SLOTS = args.num_parallel
+    print(json.dumps(run(args.sizes, args.strategies, args), indent=2))
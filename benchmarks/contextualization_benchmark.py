@@ -0,0 +1,60 @@
+import argparse
+import json
+import os
+import time
+from typing import List
+
+from langchain_core.documents import Document
+
+from benchmarks.fake_ollama import FakeOllamaServer
+from config.config import Config
+
+
+def _create_documents(n_documents: int, n_chunks: int) -> List[Document]:
+    paragraph = "The quarterly report covers revenue, operating costs and regional growth figures. " * 24
+    return [
+        Document(paragraph * n_chunks, metadata={"source": f"document-{i}.txt"})
+        for i in range(n_documents)
+    ]
+
+def _serial_contextualization(documents: List[Document], chunks: List[List[Document]]):
+    # Baseline: one client per document and one blocking call per chunk
+    from data_ingestor.contextualizer import CONTEXT_PROMPT, create_llm
+
+    for document, document_chunks in zip(documents, chunks):
+        llm = create_llm()
+        for chunk in document_chunks:
+            llm.invoke(CONTEXT_PROMPT.format_messages(document=document.page_content, chunk=chunk.page_content))
+
+def _concurrent_contextualization(documents: List[Document], chunks: List[List[Document]]):
+    from data_ingestor.contextualizer import contextualize_chunks
+
+    contextualize_chunks(documents, chunks, on_progress=lambda done, total: None)
+
+def run(n_documents: int, n_chunks: int, num_parallel: int) -> dict:
+    from data_ingestor.chunker import text_splitter
+
+    documents = _create_documents(n_documents, n_chunks)
+    chunks = [text_splitter.split_documents([document]) for document in documents]
+    results = {
+        "documents": n_documents,
+        "chunks": sum(len(document_chunks) for document_chunks in chunks),
+        "num_parallel": num_parallel,
+        "concurrency": Config.Preprocessing.CONTEXT_CONCURRENCY,
+    }
+    for name, contextualize in [("serial", _serial_contextualization), ("concurrent", _concurrent_contextualization)]:
+        with FakeOllamaServer(num_parallel=num_parallel) as server:
+            os.environ["OLLAMA_HOST"] = server.url
+            start = time.perf_counter()
+            contextualize(documents, chunks)
+            results[f"{name}_seconds"] = round(time.perf_counter() - start, 3)
+    results["speedup"] = round(results["serial_seconds"] / results["concurrent_seconds"], 2)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Contextualization throughput against a fake Ollama server")
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--chunks", type=int, default=16, help="Approximate chunks per document")
+    parser.add_argument("--num-parallel", type=int, default=4, help="Requests the fake server serves at once")
+    args = parser.parse_args()
+    print(json.dumps(run(args.documents, args.chunks, args.num_parallel), indent=2))
@@ -0,0 +1,81 @@
+import random
+from pathlib import Path
+from typing import Dict, List
+
+from config.config import Config
+
+# Files per type and pages (or page-sized sections for MD and TXT) per file
+CORPUS_SIZES: Dict[str, Dict[str, int]] = {
+    "small": {"files": 2, "pages": 4},
+    "medium": {"files": 4, "pages": 25},
+    "large": {"files": 8, "pages": 100},
+}
+WORDS_PER_PAGE = 350
+PDF_LINE_LENGTH = 90
+WORDS = (
+    "revenue cost margin growth region quarter forecast customer product market report analysis budget "
+    "policy contract supplier inventory shipment invoice payment account balance audit compliance risk "
+    "employee training safety incident review project milestone deadline scope requirement design test "
+    "release deployment server network storage backup latency throughput capacity license support ticket"
+).split()
+
+
+def synthetic_page(rng: random.Random, n_words: int = WORDS_PER_PAGE) -> str:
+    sentences = []
+    while n_words > 0:
+        length = min(n_words, rng.randint(8, 20))
+        sentences.append(" ".join(rng.choices(WORDS, k=length)).capitalize() + ".")
+        n_words -= length
+    return " ".join(sentences)
+
+def _synthetic_pages(rng: random.Random, n_pages: int) -> List[str]:
+    return [synthetic_page(rng) for _ in range(n_pages)]
+
+def synthetic_queries(n_queries: int) -> List[str]:
+    rng = random.Random(Config.SEED + 1)
+    return [f"What does the {' '.join(rng.choices(WORDS, k=3))} section say?" for _ in range(n_queries)]
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def create_pdf(pages: List[str]) -> bytes:
+    # Minimal PDF with one Helvetica text stream per page, so no PDF writer dependency is needed
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        lines = [text[start : start + PDF_LINE_LENGTH] for start in range(0, len(text), PDF_LINE_LENGTH)]
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({_pdf_escape(line)}) '" for line in lines) + " ET"
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, content in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{content}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return data
+
+def create_corpus(directory: Path, size: str) -> List[Path]:
+    # Deterministic for a given size, so results are comparable between releases
+    rng = random.Random(f"{Config.SEED}-{size}")
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(CORPUS_SIZES[size]["files"]):
+        n_pages = CORPUS_SIZES[size]["pages"]
+        pdf_path = directory / f"report-{i}.pdf"
+        pdf_path.write_bytes(create_pdf(_synthetic_pages(rng, n_pages)))
+        md_path = directory / f"notes-{i}.md"
+        md_path.write_text("\n\n".join(f"## Section {n + 1}\n\n{page}" for n, page in enumerate(_synthetic_pages(rng, n_pages))))
+        txt_path = directory / f"transcript-{i}.txt"
+        txt_path.write_text("\n\n".join(_synthetic_pages(rng, n_pages)))
+        paths.extend([pdf_path, md_path, txt_path])
+    return paths
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import random
+import time
+from typing import List
+
+from benchmarks.corpus import WORDS, synthetic_page, synthetic_queries
+from benchmarks.fake_models import DIMENSION, use_fake_models
+from benchmarks.fake_ollama import FakeOllamaServer
+from benchmarks.fake_pinecone import FakePineconeIndex
+from config.config import Config
+
+LEGAL_NOTICE = (
+    "Legal notice. This document is provided for information only and does not constitute an offer or a contract. "
+    "All figures are unaudited unless stated otherwise and may change without notice. Reproduction or distribution "
+    "of any part of this document without prior written consent is prohibited. The company accepts no liability for "
+    "decisions made on the basis of this document. Trademarks mentioned belong to their respective owners. "
+) * 4
+TOP_K = 10
+
+
+def _edit(rng: random.Random, text: str, n_words: int) -> str:
+    words = text.split(" ")
+    for _ in range(n_words):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return " ".join(words)
+
+def _create_files(n_manuals: int, versions: int, pages: int, edited_words: int):
+    # Manuals in several versions that differ in a few words per page, every page followed by the same
+    # legal notice, the way exported manuals and reports usually look
+    from file_loader.file_loader import File
+
+    rng = random.Random(Config.SEED)
+    files = []
+    for manual in range(n_manuals):
+        texts = [synthetic_page(rng, 300) for _ in range(pages)]
+        for version in range(versions):
+            if version:
+                texts = [_edit(rng, text, edited_words) for text in texts]
+            content = "\n\n".join(f"{text}\n\n{LEGAL_NOTICE}" for text in texts)
+            files.append(File.from_text(f"manual-{manual}-v{version + 1}.txt", content))
+    return files
+
+def _distinct_share(documents) -> float:
+    # Share of the top-k candidates that are not a near-duplicate of a higher ranked one
+    from data_ingestor.deduplicator import chunk_text, find_duplicates
+
+    canonical = find_duplicates(chunk_text(document) for document in documents)
+    return len(set(canonical)) / max(1, len(documents))
+
+def _run_local(files, queries: List[str], ollama: FakeOllamaServer) -> dict:
+    from data_ingestor.backends import create_backend
+
+    backend = create_backend("InMemory")
+    requests = ollama.stats.requests
+    start = time.perf_counter()
+    retriever = backend.ingest_files(files)
+    seconds = time.perf_counter() - start
+    semantic, bm25 = retriever.retriever.base_retriever.retrievers
+    vectorstore = semantic.vectorstore
+    candidates = [retriever.retriever.base_retriever.invoke(query)[:TOP_K] for query in queries]
+    report = {
+        "ingest_seconds": round(seconds, 2),
+        "llm_calls": ollama.stats.requests - requests,
+        "chunks": len(vectorstore),
+        "vector_bytes": int(vectorstore.vectors.nbytes),
+        "text_bytes": sum(len(doc.page_content.encode("utf-8")) for doc in vectorstore.documents),
+        "top_k_distinct": round(sum(map(_distinct_share, candidates)) / len(candidates), 3),
+    }
+    # Removing the first version keeps chunks the later versions share with it
+    backend.remove_files(retriever, [files[0].name])
+    report["chunks_after_removing_v1"] = len(vectorstore)
+    report["sources_left_consistent"] = all(
+        files[0].name not in doc.metadata.get("sources", [doc.metadata["source"]]) for doc in [*vectorstore.documents, *bm25.docs]
+    )
+    return report
+
+def _run_pinecone(files, ollama: FakeOllamaServer) -> dict:
+    from data_ingestor import pinecone_data_ingestor
+
+    index = FakePineconeIndex()
+    pinecone_data_ingestor._get_index = lambda: index
+    use_fake_models(pinecone_data_ingestor)
+    requests = ollama.stats.requests
+    retriever = pinecone_data_ingestor.ingest_files(files)
+    vectors = index.describe_index_stats()["total_vector_count"]
+    report = {
+        "llm_calls": ollama.stats.requests - requests,
+        "vectors": vectors,
+        "vector_bytes": vectors * DIMENSION * 4,
+    }
+    pinecone_data_ingestor.remove_files(retriever, [files[0].name])
+    report["vectors_after_removing_v1"] = index.describe_index_stats()["total_vector_count"]
+    return report
+
+def run(n_manuals: int, versions: int, pages: int, edited_words: int, n_queries: int) -> dict:
+    from data_ingestor.backends import create_backend
+
+    Config.Cache.ENABLED = False
+    Config.Models.WARMUP = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = True
+    ollama = FakeOllamaServer(response_tokens=30, tokens_per_second=2000, num_parallel=4).start()
+    os.environ["OLLAMA_HOST"] = ollama.url
+    use_fake_models(create_backend("InMemory").module)
+    files = _create_files(n_manuals, versions, pages, edited_words)
+    queries = synthetic_queries(n_queries)
+    report = {
+        "files": len(files),
+        "pages_per_file": pages,
+        "edited_words_per_page": edited_words,
+        "threshold": Config.Preprocessing.DEDUP_THRESHOLD,
+    }
+    for name, deduplicate in [("without_dedup", False), ("with_dedup", True)]:
+        Config.Preprocessing.DEDUPLICATE = deduplicate
+        report[name] = {"local": _run_local(files, queries, ollama), "pinecone": _run_pinecone(files, ollama)}
+    without, with_dedup = report["without_dedup"]["local"], report["with_dedup"]["local"]
+    report["saved"] = {
+        "chunks": without["chunks"] - with_dedup["chunks"],
+        "llm_calls": without["llm_calls"] - with_dedup["llm_calls"],
+        "index_bytes": without["vector_bytes"] + without["text_bytes"] - with_dedup["vector_bytes"] - with_dedup["text_bytes"],
+        "pinecone_vectors": report["without_dedup"]["pinecone"]["vectors"] - report["with_dedup"]["pinecone"]["vectors"],
+    }
+    ollama.stop()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest versioned manuals with boilerplate with and without near-duplicate elimination")
+    parser.add_argument("--manuals", type=int, default=2)
+    parser.add_argument("--versions", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--edited-words", type=int, default=3, help="Words changed per page from one version to the next")
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(run(args.manuals, args.versions, args.pages, args.edited_words, args.queries), indent=2))
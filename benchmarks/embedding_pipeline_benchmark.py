@@ -0,0 +1,83 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+from functools import partial
+from typing import List
+
+from langchain_core.documents import Document
+
+from benchmarks.fake_models import DIMENSION, BusyFakeEmbeddings
+
+
+def _documents(n: int) -> List[Document]:
+    return [Document(id=str(i), page_content=f"chunk {i} " * 20, metadata={"source": f"file-{i % 100}.pdf"}) for i in range(n)]
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _ingest(mode: str, n_chunks: int, workers: int, work: int, results: "multiprocessing.Queue"):
+    # Runs in a fresh process, so the peak RSS belongs to this ingest alone
+    from config.config import Config
+    from data_ingestor.embedding_pipeline import WorkerPoolEmbeddings, create_worker_pool, stream_embeddings
+    from data_ingestor.numpy_vector_store import NumpyVectorStore
+
+    embeddings = BusyFakeEmbeddings(size=DIMENSION, work=work)
+    if workers > 1:
+        create = partial(BusyFakeEmbeddings, size=DIMENSION, work=work)
+        executor = create_worker_pool(create, workers)
+        # Workers start up before the clock does, as the pool lives as long as the process
+        list(executor.map(abs, range(workers)))
+        embeddings = WorkerPoolEmbeddings(embeddings, executor, batch_size=Config.Preprocessing.EMBEDDING_BATCH_SIZE, workers=workers)
+    documents = _documents(n_chunks)
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    if mode == "materialized":
+        # The previous path: every vector of the corpus as a list of floats before the store sees any
+        store = NumpyVectorStore.from_documents(documents, embeddings)
+    else:
+        store = NumpyVectorStore(embeddings)
+        for batch, vectors in stream_embeddings(documents, embeddings):
+            store.add_embeddings(batch, vectors)
+    seconds = time.perf_counter() - start
+    results.put(
+        {
+            "seconds": round(seconds, 2),
+            "chunks_per_second": round(n_chunks / seconds, 1),
+            "peak_rss_growth_mb": round(_peak_rss_mb() - rss_before, 1),
+            "index_mb": round(store.vectors.nbytes / 1024 / 1024, 1),
+        }
+    )
+
+def _in_process(*args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_ingest, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def run(sizes: List[int], workers: List[int], work: int) -> dict:
+    from config.config import Config
+
+    report = {"cpus": os.cpu_count(), "batch_size": Config.Preprocessing.EMBEDDING_BATCH_SIZE, "work_per_chunk": work}
+    for n_chunks in sizes:
+        report[n_chunks] = {"materialized": _in_process("materialized", n_chunks, 1, work)}
+        for n_workers in workers:
+            report[n_chunks][f"streamed_{n_workers}_workers"] = _in_process("streamed", n_chunks, n_workers, work)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak memory and throughput of embedding a corpus at once or streamed through worker processes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 40_000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--work", type=int, default=20_000, help="Python loop iterations per chunk standing in for model inference")
+    args = parser.parse_args()
+    print(json.dumps(run(args.sizes, args.workers, args.work), indent=2))
@@ -0,0 +1,56 @@
+import time
+from types import SimpleNamespace
+from typing import List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+DIMENSION = 384                 # BAAI/bge-small-en-v1.5
+
+
+class _FakeTokenizer:
+    def encode_batch(self, pairs: List[Tuple[str, str]]) -> List[SimpleNamespace]:
+        # The single "token" is the number of query words in the passage, which the session turns into a logit
+        return [
+            SimpleNamespace(ids=[len(set(query.lower().split()) & set(passage.lower().split()))], attention_mask=[1], type_ids=[0])
+            for query, passage in pairs
+        ]
+
+
+class _FakeSession:
+    def __init__(self, seconds_per_token: float):
+        self.seconds_per_token = seconds_per_token
+
+    def run(self, output_names, inputs: dict) -> List[np.ndarray]:
+        time.sleep(self.seconds_per_token * inputs["input_ids"].size)
+        return [inputs["input_ids"][:, :1].astype(np.float32)]
+
+
+class FakeRanker:
+    # Stand-in for flashrank.Ranker with a cost per scored pair, for hosts without the ONNX model
+    def __init__(self, seconds_per_pair: float = 0.002):
+        self.tokenizer = _FakeTokenizer()
+        self.session = _FakeSession(seconds_per_pair)
+
+
+class BusyFakeEmbeddings(DeterministicFakeEmbedding):
+    # Spends `work` iterations of pure Python per text, the way tokenization and inference keep a core
+    # busy, so parallel embedding has something to scale. Picklable, so worker processes can build it.
+    work: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        for _ in texts:
+            sum(range(self.work))
+        return super().embed_documents(texts)
+
+
+def create_fake_embeddings() -> DeterministicFakeEmbedding:
+    return DeterministicFakeEmbedding(size=DIMENSION)
+
+def use_fake_models(*modules):
+    # Swaps FastEmbed and FlashRank for deterministic stand-ins in the given ingestor modules
+    from data_ingestor.reranker import get_reranker_service
+
+    for module in modules:
+        module.create_embeddings = create_fake_embeddings
+    get_reranker_service()._ranker = FakeRanker()
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class FakeOllamaStats:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    generated_tokens: int = 0
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+# Local stand-in for the Ollama /api/chat endpoint with a deterministic latency model: every request
+# waits for one of `num_parallel` slots (like OLLAMA_NUM_PARALLEL), pays a fixed `request_latency`,
+# prefills the prompt at `prompt_tokens_per_second` and streams `response_tokens` at `tokens_per_second`,
+# after `thinking_tokens` inside <think> tags like a reasoning model.
+# With `prefix_cache`, a request takes the free slot whose last prompt shares the longest prefix with
+# it and only prefills the rest, like Ollama's per-slot KV cache.
+class FakeOllamaServer:
+    def __init__(
+        self,
+        request_latency: float = 0.02,
+        prompt_tokens_per_second: float = 20_000,
+        tokens_per_second: float = 200,
+        response_tokens: int = 40,
+        num_parallel: int = 4,
+        prefix_cache: bool = False,
+        thinking_tokens: int = 0,
+    ):
+        self.request_latency = request_latency
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.prefix_cache = prefix_cache
+        self.thinking_tokens = thinking_tokens
+        self.stats = FakeOllamaStats()
+        self._slot_prompts = [""] * num_parallel
+        self._free_slots = list(range(num_parallel))
+        self._slots = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._create_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _acquire_slot(self, prompt: str) -> int:
+        with self._slots:
+            self._slots.wait_for(lambda: self._free_slots)
+            slot = max(self._free_slots, key=lambda slot: len(os.path.commonprefix([self._slot_prompts[slot], prompt])))
+            self._free_slots.remove(slot)
+            return slot
+
+    def _release_slot(self, slot: int, prompt: str):
+        with self._slots:
+            self._slot_prompts[slot] = prompt
+            self._free_slots.append(slot)
+            self._slots.notify()
+
+    def prefill_seconds(self, messages: list, cached_prefix: str = "") -> float:
+        prompt_tokens = sum(count_tokens(message.get("content", "")) for message in messages)
+        cached_tokens = min(len(cached_prefix) // CHARS_PER_TOKEN, prompt_tokens - 1)
+        with self._stats_lock:
+            self.stats.prompt_tokens += prompt_tokens - cached_tokens
+            self.stats.cached_prompt_tokens += cached_tokens
+        return (prompt_tokens - cached_tokens) / self.prompt_tokens_per_second
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if self.path != "/api/chat":
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                prompt = "\0".join(message.get("content", "") for message in request["messages"])
+                slot = server._acquire_slot(prompt)
+                try:
+                    cached_prefix = os.path.commonprefix([server._slot_prompts[slot], prompt]) if server.prefix_cache else ""
+                    time.sleep(server.request_latency + server.prefill_seconds(request["messages"], cached_prefix))
+                    self._stream_response(request)
+                finally:
+                    server._release_slot(slot, prompt)
+                with server._stats_lock:
+                    server.stats.requests += 1
+                    server.stats.generated_tokens += server.response_tokens + server.thinking_tokens
+
+            def _stream_response(self, request: dict):
+                stream = request.get("stream", True)
+                num_predict = (request.get("options") or {}).get("num_predict")
+                tokens = [f"token{i} " for i in range(min(server.response_tokens, num_predict or server.response_tokens))]
+                if server.thinking_tokens:
+                    thinking = [f"thought{i} " for i in range(server.thinking_tokens)]
+                    tokens = ["<think>", *thinking, "</think>", "\n\n", *tokens]
+                if stream:
+                    for token in tokens:
+                        time.sleep(1 / server.tokens_per_second)
+                        self._write(request, token, done=False)
+                else:
+                    time.sleep(len(tokens) / server.tokens_per_second)
+                self._write(request, "" if stream else "".join(tokens), done=True)
+
+            def _write(self, request: dict, content: str, done: bool):
+                response = {
+                    "model": request["model"],
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "message": {"role": "assistant", "content": content},
+                    "done": done,
+                }
+                if done:
+                    response.update(
+                        done_reason="stop",
+                        prompt_eval_count=sum(count_tokens(m.get("content", "")) for m in request["messages"]),
+                        eval_count=server.response_tokens + server.thinking_tokens,
+                    )
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+                self.wfile.flush()
+
+        return Handler
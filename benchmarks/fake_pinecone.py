@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+MAX_UPSERT_VECTORS = 1000           # Limits the hosted API enforces per upsert request
+MAX_UPSERT_BYTES = 2 * 1024 * 1024
+
+class _AsyncResult:
+    def __init__(self, value: Any):
+        self.value = value
+
+    def get(self) -> Any:
+        return self.value
+
+
+class FakePineconeIndex:
+    # In-process stand-in for `pinecone.Index` with the subset of the API the ingestor uses. Every
+    # request sleeps for `latency` seconds to model the network round trip to a hosted index.
+    # Like the hosted API, sparse-dense queries need an index with the dotproduct metric.
+    def __init__(self, latency: float = 0.0, metric: str = "cosine"):
+        self.latency = latency
+        self.metric = metric
+        self.requests = 0
+        self.upserted_vectors = 0
+        self._namespaces: Dict[str, Dict[str, Tuple[np.ndarray, dict, Optional[dict]]]] = {}
+        self._matrices: Dict[str, Tuple[List[str], np.ndarray, Dict[int, Tuple[np.ndarray, np.ndarray]]]] = {}
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _namespace(self, namespace: Optional[str]) -> Dict[str, Tuple[np.ndarray, dict, Optional[dict]]]:
+        self._matrices.pop(namespace or "", None)
+        return self._namespaces.setdefault(namespace or "", {})
+
+    def upsert(self, vectors, namespace: Optional[str] = None, async_req: bool = False, **kwargs: Any):
+        self._request()
+        vectors = [
+            (vector["id"], vector["values"], vector.get("metadata", {}), vector.get("sparse_values"))
+            if isinstance(vector, dict)
+            else (*vector, None)[:4]
+            for vector in vectors
+        ]
+        if len(vectors) > MAX_UPSERT_VECTORS:
+            raise ValueError(f"Upsert of {len(vectors)} vectors exceeds the limit of {MAX_UPSERT_VECTORS}")
+        n_bytes = sum(
+            len(id) + 12 * (len(values) + len(sparse["indices"] if sparse else [])) + len(json.dumps(metadata))
+            for id, values, metadata, sparse in vectors
+        )
+        if n_bytes > MAX_UPSERT_BYTES:
+            raise ValueError(f"Upsert request of {n_bytes} bytes exceeds the limit of {MAX_UPSERT_BYTES}")
+        if self.metric != "dotproduct" and any(sparse for *_, sparse in vectors):
+            raise ValueError("Sparse values are only supported by indexes with the dotproduct metric")
+        with self._lock:
+            self.upserted_vectors += len(vectors)
+            records = self._namespace(namespace)
+            for id, values, metadata, sparse in vectors:
+                records[id] = (np.asarray(values, dtype=np.float32), dict(metadata), sparse)
+        result = {"upserted_count": len(vectors)}
+        return _AsyncResult(result) if async_req else result
+
+    def _matrix(self, namespace: str) -> Tuple[List[str], np.ndarray, Dict[int, Tuple[np.ndarray, np.ndarray]]]:
+        # Dense rows plus, per sparse dimension, the rows that have it and their values
+        if namespace not in self._matrices:
+            records = self._namespaces.get(namespace, {})
+            ids = list(records)
+            matrix = np.empty((0, 0), dtype=np.float32)
+            postings: Dict[int, Tuple[List[int], List[float]]] = {}
+            if ids:
+                matrix = np.stack([records[id][0] for id in ids])
+                if self.metric == "cosine":
+                    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                for row, id in enumerate(ids):
+                    sparse = records[id][2]
+                    for index, value in zip(sparse["indices"], sparse["values"]) if sparse else ():
+                        rows, values = postings.setdefault(index, ([], []))
+                        rows.append(row)
+                        values.append(value)
+            self._matrices[namespace] = (
+                ids,
+                matrix,
+                {index: (np.asarray(rows), np.asarray(values, dtype=np.float32)) for index, (rows, values) in postings.items()},
+            )
+        return self._matrices[namespace]
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int = 10,
+        include_metadata: bool = False,
+        namespace: Optional[str] = None,
+        filter: Optional[dict] = None,
+        sparse_vector: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> dict:
+        self._request()
+        if sparse_vector and self.metric != "dotproduct":
+            raise ValueError("Sparse-dense queries are only supported by indexes with the dotproduct metric")
+        with self._lock:
+            ids, matrix, postings = self._matrix(namespace or "")
+            if not ids:
+                return {"matches": []}
+            query = np.asarray(vector, dtype=np.float32)
+            if self.metric == "cosine":
+                query = query / max(float(np.linalg.norm(query)), 1e-12)
+            scores = matrix @ query
+            for index, value in zip(sparse_vector["indices"], sparse_vector["values"]) if sparse_vector else ():
+                if index in postings:
+                    rows, values = postings[index]
+                    scores[rows] += value * values
+            top = np.argsort(-scores, kind="stable")[:top_k]
+            records = self._namespaces[namespace or ""]
+            return {
+                "matches": [
+                    {
+                        "id": ids[i],
+                        "score": float(scores[i]),
+                        "metadata": dict(records[ids[i]][1]) if include_metadata else {},
+                    }
+                    for i in top
+                ]
+            }
+
+    def list(self, prefix: str = "", namespace: Optional[str] = None, limit: int = 100) -> Iterator[List[str]]:
+        self._request()
+        with self._lock:
+            ids = [id for id in self._namespaces.get(namespace or "", {}) if id.startswith(prefix)]
+        for start in range(0, len(ids), limit):
+            yield ids[start : start + limit]
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None, **kwargs: Any) -> dict:
+        self._request()
+        with self._lock:
+            records = self._namespaces.get(namespace or "", {})
+            return {
+                "vectors": {
+                    id: {"id": id, "values": records[id][0].tolist(), "metadata": dict(records[id][1])}
+                    for id in ids
+                    if id in records
+                }
+            }
+
+    def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        delete_all: bool = False,
+        namespace: Optional[str] = None,
+        filter: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> dict:
+        self._request()
+        with self._lock:
+            records = self._namespace(namespace)
+            if delete_all:
+                records.clear()
+            for id in ids or []:
+                records.pop(id, None)
+        return {}
+
+    def describe_index_stats(self, **kwargs: Any) -> dict:
+        self._request()
+        with self._lock:
+            namespaces = {name: {"vector_count": len(records)} for name, records in self._namespaces.items()}
+        return {"namespaces": namespaces, "total_vector_count": sum(n["vector_count"] for n in namespaces.values())}
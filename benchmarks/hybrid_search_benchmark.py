@@ -0,0 +1,84 @@
+import argparse
+import json
+import random
+import time
+from typing import List
+
+import numpy as np
+
+from benchmarks.corpus import synthetic_page
+from benchmarks.fake_models import use_fake_models
+from benchmarks.fake_pinecone import FakePineconeIndex
+from config.config import Config
+from data_ingestor import pinecone_data_ingestor
+from file_loader.file_loader import File, Page
+
+PAGES_PER_FILE = 20
+
+
+def _files(n_files: int) -> List[File]:
+    # Every page mentions one ticket number, so a query for it has a single correct page
+    rng = random.Random(Config.SEED)
+    return [
+        File(
+            name=f"file-{i}.txt",
+            pages=[
+                Page(number=n + 1, content=f"{synthetic_page(rng)} Ticket{i * PAGES_PER_FILE + n} is closed.")
+                for n in range(PAGES_PER_FILE)
+            ],
+        )
+        for i in range(n_files)
+    ]
+
+def _measure(hybrid: bool, files: List[File], n_queries: int, latency: float) -> dict:
+    Config.VectorDB.HYBRID_SEARCH = hybrid
+    index = FakePineconeIndex(latency=latency, metric="dotproduct" if hybrid else "cosine")
+    pinecone_data_ingestor._get_index = lambda: index
+    pinecone_data_ingestor.ingest_files(files)
+
+    # A restarted worker either rebuilds the local BM25 index from the files or only connects to the index
+    start = time.perf_counter()
+    if hybrid:
+        retriever = pinecone_data_ingestor.create_hybrid_retriever()
+    else:
+        retriever = pinecone_data_ingestor.ingest_files(files)
+    startup_seconds = time.perf_counter() - start
+
+    base_retriever = retriever.retriever.base_retriever
+    n_tickets = len(files) * PAGES_PER_FILE
+    tickets = random.Random(Config.SEED + 1).sample(range(n_tickets), min(n_queries, n_tickets))
+    hits, latencies = 0, []
+    for ticket in tickets:
+        start = time.perf_counter()
+        documents = base_retriever.invoke(f"What is the status of Ticket{ticket}?")
+        latencies.append(time.perf_counter() - start)
+        hits += any(f"Ticket{ticket} " in document.page_content for document in documents)
+    return {
+        "mode": "server_side_hybrid" if hybrid else "dense_plus_local_bm25",
+        "worker_startup_seconds": round(startup_seconds, 3),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+        "candidate_hit_rate": round(hits / len(tickets), 3),      # Correct page among the candidates sent to the reranker
+        "index_requests": index.requests,
+    }
+
+def run(n_files: int, n_queries: int, latency: float) -> dict:
+    Config.Cache.ENABLED = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+    use_fake_models(pinecone_data_ingestor)
+    files = _files(n_files)
+    return {
+        "files": n_files,
+        "pages": n_files * PAGES_PER_FILE,
+        "latency_ms": latency * 1000,
+        "alpha": Config.VectorDB.HYBRID_ALPHA,
+        "modes": [_measure(hybrid, files, n_queries, latency) for hybrid in (False, True)],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local BM25 fusion against server-side sparse-dense search on the Pinecone stand-in")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    args = parser.parse_args()
+    print(json.dumps(run(args.files, args.queries, args.latency_ms / 1000), indent=2))
@@ -0,0 +1,81 @@
+import argparse
+import json
+import random
+import time
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_pinecone import PineconeVectorStore
+
+from benchmarks.corpus import synthetic_page
+from benchmarks.fake_models import create_fake_embeddings
+from benchmarks.fake_pinecone import FakePineconeIndex
+from config.config import Config
+from data_ingestor import pinecone_data_ingestor
+
+N_FILES = 10
+
+
+def _chunks(n: int) -> List[Document]:
+    rng = random.Random(42)
+    return [
+        Document(page_content=synthetic_page(rng, 120), metadata={"source": f"file-{i % N_FILES}.pdf", "page": i // N_FILES + 1})
+        for i in range(n)
+    ]
+
+def _file_names() -> List[str]:
+    return [f"file-{i}.pdf" for i in range(N_FILES)]
+
+def _serial(index: FakePineconeIndex, chunks: List[Document]) -> float:
+    # The previous path: random IDs and one add_documents call that upserts batch after batch
+    vectorstore = PineconeVectorStore(index=index, embedding=create_fake_embeddings(), text_key=pinecone_data_ingestor.TEXT_KEY)
+    start = time.perf_counter()
+    vectorstore.add_documents(chunks)
+    return time.perf_counter() - start
+
+def _parallel(index: FakePineconeIndex, chunks: List[Document]) -> float:
+    pinecone_data_ingestor._get_index = lambda: index
+    start = time.perf_counter()
+    pinecone_data_ingestor._upsert_chunks(
+        pinecone_data_ingestor._with_ids(chunks), create_fake_embeddings(), _file_names()
+    )
+    return time.perf_counter() - start
+
+def _vector_count(index: FakePineconeIndex) -> int:
+    return index.describe_index_stats()["total_vector_count"]
+
+def run(n_chunks: int, latency: float) -> dict:
+    serial_index = FakePineconeIndex(latency=latency)
+    serial_seconds = _serial(serial_index, _chunks(n_chunks))
+    _serial(serial_index, _chunks(n_chunks))
+
+    index = FakePineconeIndex(latency=latency)
+    parallel_seconds = _parallel(index, _chunks(n_chunks))
+    first_count, first_upserts = _vector_count(index), index.upserted_vectors
+    reingest_seconds = _parallel(index, _chunks(n_chunks))
+    return {
+        "chunks": n_chunks,
+        "latency_ms": latency * 1000,
+        "batch_size": Config.VectorDB.UPSERT_BATCH_SIZE,
+        "concurrency": Config.VectorDB.UPSERT_CONCURRENCY,
+        "serial": {
+            "seconds": round(serial_seconds, 3),
+            "vectors_per_second": round(n_chunks / serial_seconds, 1),
+            "vectors_after_reingest": _vector_count(serial_index),
+        },
+        "parallel": {
+            "seconds": round(parallel_seconds, 3),
+            "vectors_per_second": round(n_chunks / parallel_seconds, 1),
+            "vectors": first_count,
+            "reingest_seconds": round(reingest_seconds, 3),
+            "reingest_upserted_vectors": index.upserted_vectors - first_upserts,
+            "vectors_after_reingest": _vector_count(index),
+        },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pinecone upsert throughput and idempotency against the in-process stand-in")
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=40)
+    args = parser.parse_args()
+    print(json.dumps(run(args.chunks, args.latency_ms / 1000), indent=2))
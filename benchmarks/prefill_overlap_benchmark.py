@@ -0,0 +1,111 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from benchmarks.corpus import create_corpus, synthetic_queries
+from benchmarks.fake_ollama import FakeOllamaServer
+
+
+def _run_conversation(
+    warmup: bool,
+    turns: int,
+    prompt_tokens_per_second: float,
+    response_tokens: int,
+    rerank_seconds_per_pair: float,
+    other_sessions: int,
+    results: "multiprocessing.Queue",
+):
+    # Runs in a fresh process, since chat model clients are shared per process and bound to one Ollama URL
+    ollama = FakeOllamaServer(
+        prompt_tokens_per_second=prompt_tokens_per_second,
+        response_tokens=response_tokens,
+        num_parallel=2,
+        prefix_cache=True,
+    ).start()
+    os.environ["OLLAMA_HOST"] = ollama.url
+    from benchmarks.fake_models import FakeRanker, use_fake_models
+    from chatbot.chatbot import Chatbot, ChunkEvent, FinalAnswerEvent, answer_messages
+    from config.config import Config
+    from data_ingestor.backends import create_backend
+    from data_ingestor.reranker import get_reranker_service
+    from file_loader.file_loader import load_file
+
+    Config.Cache.ENABLED = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+    Config.Models.WARMUP = False
+    Config.Chatbot.PREFILL_WARMUP = warmup
+    backend = create_backend("InMemory")
+    use_fake_models(backend.module)
+    get_reranker_service()._ranker = FakeRanker(rerank_seconds_per_pair)
+    with tempfile.TemporaryDirectory() as directory:
+        bot = Chatbot([load_file(path) for path in create_corpus(Path(directory), "small")], backend)
+    history = []
+    per_turn = []
+    others = iter(synthetic_queries(turns * (other_sessions + 1))[turns:])
+    for question in synthetic_queries(turns):
+        # Questions of other sessions in between take over the Ollama slots, as on a shared server
+        for _ in range(other_sessions):
+            for _ in bot.ask(next(others), []):
+                pass
+        prompt_tokens, cached_tokens = ollama.stats.prompt_tokens, ollama.stats.cached_prompt_tokens
+        start = time.perf_counter()
+        time_to_first_token = None
+        for event in bot.ask(question, history):
+            if isinstance(event, ChunkEvent) and event.content and time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            if isinstance(event, FinalAnswerEvent):
+                history.extend(answer_messages(question, event))
+        per_turn.append(
+            {
+                "time_to_first_token_ms": round(time_to_first_token * 1000, 1),
+                "prefilled_tokens": ollama.stats.prompt_tokens - prompt_tokens,
+                "cached_tokens": ollama.stats.cached_prompt_tokens - cached_tokens,
+            }
+        )
+    ollama.stop()
+    results.put(per_turn)
+
+def _in_process(*args) -> List[dict]:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_conversation, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def run(turns: int, prompt_tokens_per_second: float, response_tokens: int, rerank_seconds_per_pair: float, other_sessions: int) -> dict:
+    report = {
+        "turns": turns,
+        "other_sessions_between_turns": other_sessions,
+        "prompt_tokens_per_second": prompt_tokens_per_second,
+        "response_tokens": response_tokens,
+        "rerank_seconds_per_pair": rerank_seconds_per_pair,
+    }
+    for name, warmup in [("sequential", False), ("overlapped", True)]:
+        report[name] = _in_process(warmup, turns, prompt_tokens_per_second, response_tokens, rerank_seconds_per_pair, other_sessions)
+    report["per_turn_ttft_ms"] = [
+        {"turn": turn, "sequential": sequential["time_to_first_token_ms"], "overlapped": overlapped["time_to_first_token_ms"]}
+        for turn, (sequential, overlapped) in enumerate(zip(report["sequential"], report["overlapped"]), start=1)
+    ]
+    for name in ["sequential", "overlapped"]:
+        later_turns = report[name][1:]
+        report[f"{name}_mean_ttft_ms_after_first_turn"] = round(
+            sum(turn["time_to_first_token_ms"] for turn in later_turns) / max(1, len(later_turns)), 1
+        )
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time to first token per turn with and without prefilling the history during retrieval")
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=400, help="Prefill speed of the fake Ollama, CPU-like by default")
+    parser.add_argument("--response-tokens", type=int, default=80)
+    parser.add_argument("--rerank-seconds-per-pair", type=float, default=0.03)
+    parser.add_argument("--other-sessions", type=int, default=0, help="Questions of other sessions between two turns")
+    args = parser.parse_args()
+    print(json.dumps(run(args.turns, args.prompt_tokens_per_second, args.response_tokens, args.rerank_seconds_per_pair, args.other_sessions), indent=2))
@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from benchmarks.corpus import create_corpus, synthetic_queries
+from benchmarks.fake_ollama import FakeOllamaServer
+from config.config import Config
+
+UNLIMITED_TOKENS = 10**9
+
+
+def _conversation(chatbot_module, bot, turns: int) -> List[dict]:
+    history = chatbot_module.create_history(chatbot_module.Message(chatbot_module.Role.ASSISTANT, "Hello"))
+    results = []
+    for question in synthetic_queries(turns):
+        start = time.perf_counter()
+        time_to_first_token = None
+        for event in bot.ask(question, history):
+            if time_to_first_token is None and isinstance(event, chatbot_module.ChunkEvent) and event.content:
+                time_to_first_token = time.perf_counter() - start
+            if isinstance(event, chatbot_module.FinalAnswerEvent):
+                history.extend(chatbot_module.answer_messages(question, event))
+            if isinstance(event, chatbot_module.InstrumentationEvent):
+                generate = next(span for span in event.spans if span.name == "generate")
+        results.append(
+            {
+                "time_to_first_token_ms": round(time_to_first_token * 1000, 1),
+                "prompt_tokens": generate.attributes["prompt_tokens"],
+            }
+        )
+        # Leaves time for the background summary, as a user reading the answer would
+        time.sleep(0.5)
+    return results
+
+def run(turns: int, prompt_tokens_per_second: float, response_tokens: int) -> dict:
+    from benchmarks.fake_models import use_fake_models
+    from file_loader.file_loader import load_file
+
+    Config.Cache.ENABLED = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+    server = FakeOllamaServer(
+        prompt_tokens_per_second=prompt_tokens_per_second,
+        tokens_per_second=2000,
+        response_tokens=response_tokens,
+    ).start()
+    os.environ["OLLAMA_HOST"] = server.url
+    import chatbot.chatbot as chatbot_module
+    from data_ingestor.backends import create_backend
+
+    backend = create_backend("InMemory")
+    use_fake_models(backend.module)
+    with tempfile.TemporaryDirectory() as directory:
+        files = [load_file(path) for path in create_corpus(Path(directory), "small")]
+    report = {"turns": turns, "prompt_tokens_per_second": prompt_tokens_per_second, "response_tokens": response_tokens}
+    for name, max_tokens, max_history_tokens in [
+        ("unbounded", UNLIMITED_TOKENS, UNLIMITED_TOKENS),
+        ("budgeted", Config.Prompt.MAX_TOKENS, Config.Prompt.MAX_HISTORY_TOKENS),
+    ]:
+        Config.Prompt.MAX_TOKENS = max_tokens
+        Config.Prompt.MAX_HISTORY_TOKENS = max_history_tokens
+        bot = chatbot_module.Chatbot(files, backend)
+        report[name] = _conversation(chatbot_module, bot, turns)
+    server.stop()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time to first token per turn of a growing conversation, with and without the prompt budget")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--llm-prompt-tokens-per-second", type=float, default=2000)
+    parser.add_argument("--llm-response-tokens", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.turns, args.llm_prompt_tokens_per_second, args.llm_response_tokens), indent=2))
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from benchmarks.fake_pinecone import FakePineconeIndex
+from config.config import Config
+
+DIMENSION = 384                 # BAAI/bge-small-en-v1.5
+WORDS = [f"term{i}" for i in range(2_000)]
+
+
+class LatencyReranker(BaseDocumentCompressor):
+    # FlashRank stand-in that costs a fixed time per query and keeps the fused order
+    latency: float
+    top_n: int
+
+    def compress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None
+    ) -> Sequence[Document]:
+        time.sleep(self.latency)
+        return list(documents)[: self.top_n]
+
+
+def _create_files(n_files: int, words_per_file: int):
+    from file_loader.file_loader import File
+
+    rng = random.Random(Config.SEED)
+    return [
+        File.from_text(f"document-{i}.txt", " ".join(rng.choices(WORDS, k=words_per_file)))
+        for i in range(n_files)
+    ]
+
+def _create_queries(n_queries: int) -> List[str]:
+    rng = random.Random(Config.SEED + 1)
+    return [" ".join(rng.choices(WORDS, k=6)) for _ in range(n_queries)]
+
+def _percentiles(latencies: List[float]) -> dict:
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+    }
+
+def _measure(retrieve: Callable[[str], List[Document]], queries: List[str]) -> dict:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        retrieve(query)
+        latencies.append(time.perf_counter() - start)
+    return _percentiles(latencies)
+
+async def _measure_async(retriever, queries: List[str], concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def retrieve(query: str):
+        async with semaphore:
+            start = time.perf_counter()
+            await retriever.ainvoke(query)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(retrieve(query) for query in queries))
+    return {**_percentiles(latencies), "queries_per_second": round(len(queries) / (time.perf_counter() - start), 1)}
+
+def run(n_files: int, words_per_file: int, n_queries: int, pinecone_latency: float, rerank_latency: float, concurrency: int) -> dict:
+    from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
+
+    import data_ingestor.pinecone_data_ingestor as pinecone_data_ingestor
+
+    Config.Cache.ENABLED = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+    index = FakePineconeIndex()
+    pinecone_data_ingestor._get_index = lambda: index
+    pinecone_data_ingestor.create_embeddings = lambda: DeterministicFakeEmbedding(size=DIMENSION)
+    pinecone_data_ingestor.create_reranker = lambda: LatencyReranker(
+        latency=rerank_latency, top_n=Config.Chatbot.N_CONTEXT_RESULTS
+    )
+    # The results cache would turn every repeated query into a hit, so the uncached retriever is measured
+    retriever = pinecone_data_ingestor.ingest_files(_create_files(n_files, words_per_file)).retriever
+    index.latency = pinecone_latency
+
+    hybrid_retriever = retriever.base_retriever
+    sequential_retriever = ContextualCompressionRetriever(
+        base_compressor=retriever.base_compressor,
+        base_retriever=EnsembleRetriever(retrievers=hybrid_retriever.retrievers, weights=hybrid_retriever.weights),
+    )
+    queries = _create_queries(n_queries)
+    for query in queries:       # Warm the query embedding cache so both sides pay the same embedding cost
+        sequential_retriever.invoke(query)
+
+    return {
+        "chunks": len(hybrid_retriever.retrievers[1].docs),
+        "queries": n_queries,
+        "pinecone_latency_ms": pinecone_latency * 1000,
+        "rerank_latency_ms": rerank_latency * 1000,
+        "sequential_ensemble": _measure(sequential_retriever.invoke, queries),
+        "parallel_hybrid": _measure(retriever.invoke, queries),
+        "parallel_hybrid_async": asyncio.run(_measure_async(retriever, queries, 1)),
+        f"parallel_hybrid_async_x{concurrency}": asyncio.run(_measure_async(retriever, queries, concurrency)),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hybrid retrieval latency against a Pinecone stand-in with injected latency")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--words-per-file", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=40)
+    parser.add_argument("--rerank-latency-ms", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=8, help="Queries in flight for the concurrent async run")
+    args = parser.parse_args()
+    results = run(
+        args.files,
+        args.words_per_file,
+        args.queries,
+        args.pinecone_latency_ms / 1000,
+        args.rerank_latency_ms / 1000,
+        args.concurrency,
+    )
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import aiohttp
+
+from benchmarks.corpus import create_corpus, synthetic_queries
+from benchmarks.fake_ollama import FakeOllamaServer
+from config.config import Config
+
+UNLIMITED = 10**6
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    return round(sorted(values)[min(len(values) - 1, int(q * len(values)))] * 1000, 1)
+
+async def _ask(client: aiohttp.ClientSession, url: str, session_id: str, question: str) -> dict:
+    start = time.perf_counter()
+    async with client.post(f"{url}/sessions/{session_id}/ask", json={"question": question}) as response:
+        if response.status != 200:
+            await response.read()
+            return {"status": response.status, "seconds": time.perf_counter() - start}
+        time_to_first_token = None
+        event = None
+        async for line in response.content:
+            line = line.decode("utf-8").strip()
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "chunk" and time_to_first_token is None:
+                if json.loads(line[len("data: "):])["content"]:
+                    time_to_first_token = time.perf_counter() - start
+        return {"status": 200, "seconds": time.perf_counter() - start, "time_to_first_token": time_to_first_token}
+
+async def _client(client: aiohttp.ClientSession, url: str, session_id: str, questions: List[str]) -> List[dict]:
+    # One user: asks the next question once the previous answer is complete
+    results = []
+    for question in questions:
+        results.append({"question": question, **await _ask(client, url, session_id, question)})
+    return results
+
+async def _check_isolation(client: aiohttp.ClientSession, url: str, session_id: str, results: List[dict]) -> bool:
+    # A session's history holds exactly its own answered questions, in order
+    async with client.get(f"{url}/sessions/{session_id}") as response:
+        history = await response.json() if response.status == 200 else []
+    answered = [result["question"] for result in results if result["status"] == 200]
+    return [message["content"] for message in history if message["role"] == "user"] == answered
+
+async def _run_scenario(url: str, users: int, turns: int) -> dict:
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as client:
+        start = time.perf_counter()
+        sessions = [f"user-{users}-{i}" for i in range(users)]
+        questions = synthetic_queries(turns * users)
+        per_user = await asyncio.gather(
+            *(_client(client, url, session_id, questions[i::users]) for i, session_id in enumerate(sessions))
+        )
+        seconds = time.perf_counter() - start
+        isolated = all(await asyncio.gather(*(_check_isolation(client, url, s, r) for s, r in zip(sessions, per_user))))
+        for session_id in sessions:
+            await client.post(f"{url}/sessions/{session_id}/reset")
+    results = [result for user_results in per_user for result in user_results]
+    answered = [result for result in results if result["status"] == 200]
+    rejected = [result for result in results if result["status"] == 503]
+    return {
+        "users": users,
+        "questions": len(results),
+        "answered": len(answered),
+        "rejected": len(rejected),
+        "answers_per_second": round(len(answered) / seconds, 2),
+        "time_to_first_token": {
+            "p50_ms": _percentile([result["time_to_first_token"] for result in answered], 0.5),
+            "p95_ms": _percentile([result["time_to_first_token"] for result in answered], 0.95),
+        },
+        "answer": {
+            "p50_ms": _percentile([result["seconds"] for result in answered], 0.5),
+            "p95_ms": _percentile([result["seconds"] for result in answered], 0.95),
+        },
+        "rejection_p95_ms": _percentile([result["seconds"] for result in rejected], 0.95),
+        "histories_isolated": isolated,
+    }
+
+async def _run(users_levels: List[int], turns: int, limited: bool, ollama: FakeOllamaServer, paths: List[Path]) -> List[dict]:
+    from aiohttp import web
+
+    from benchmarks.fake_models import use_fake_models
+    from data_ingestor.backends import create_backend
+    from server.server import create_app
+
+    if not limited:
+        Config.Server.MAX_CONCURRENT_ASKS = UNLIMITED
+        Config.Server.MAX_QUEUED_ASKS = UNLIMITED
+    backend = create_backend("InMemory")
+    use_fake_models(backend.module)
+    runner = web.AppRunner(create_app(backend))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    url = f"http://{host}:{port}"
+    async with aiohttp.ClientSession() as client:
+        form = aiohttp.FormData()
+        for path in paths:
+            form.add_field("files", path.read_bytes(), filename=path.name)
+        async with client.post(f"{url}/files", data=form) as response:
+            response.raise_for_status()
+    scenarios = []
+    for users in users_levels:
+        requests = ollama.stats.requests
+        scenario = await _run_scenario(url, users, turns)
+        scenario["llm_requests"] = ollama.stats.requests - requests
+        scenarios.append(scenario)
+    await runner.cleanup()
+    return scenarios
+
+def run(users_levels: List[int], turns: int, llm_tokens_per_second: float, llm_response_tokens: int, num_parallel: int) -> dict:
+    Config.Cache.ENABLED = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+    Config.Models.WARMUP = False
+    Config.Server.MAX_CONCURRENT_ASKS = num_parallel
+    ollama = FakeOllamaServer(
+        tokens_per_second=llm_tokens_per_second,
+        response_tokens=llm_response_tokens,
+        num_parallel=num_parallel,
+    ).start()
+    os.environ["OLLAMA_HOST"] = ollama.url
+    report = {
+        "turns": turns,
+        "ollama_num_parallel": num_parallel,
+        "max_concurrent_asks": Config.Server.MAX_CONCURRENT_ASKS,
+        "max_queued_asks": Config.Server.MAX_QUEUED_ASKS,
+        "queue_timeout_seconds": Config.Server.QUEUE_TIMEOUT_SECONDS,
+    }
+
+    async def run_both():
+        # One event loop for both servers, since the shared Ollama client is bound to the loop it first ran on
+        report["limited"] = await _run(users_levels, turns, True, ollama, paths)
+        report["unlimited"] = await _run(users_levels, turns, False, ollama, paths)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = create_corpus(Path(directory), "small")
+        asyncio.run(run_both())
+    ollama.stop()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent users asking questions over SSE against the HTTP server and a fake Ollama")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200)
+    parser.add_argument("--llm-response-tokens", type=int, default=40)
+    parser.add_argument("--ollama-num-parallel", type=int, default=4)
+    args = parser.parse_args()
+    print(json.dumps(run(args.users, args.turns, args.llm_tokens_per_second, args.llm_response_tokens, args.ollama_num_parallel), indent=2))
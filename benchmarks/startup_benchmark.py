@@ -0,0 +1,111 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Each probe runs in a fresh interpreter, so nothing is imported before the clock starts
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+try:
+    import data_ingestor.backends
+except ImportError:
+    # Older trees read the vector store choice from Streamlit's session state at import time
+    import streamlit as st
+    st.session_state["db_option"] = "InMemory"
+import chatbot.chatbot
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": len(sys.modules)}))
+"""
+
+FIRST_TOKEN_PROBE = """
+import json, os, sys, time
+from benchmarks.fake_ollama import FakeOllamaServer
+server = FakeOllamaServer(response_tokens=5).start()
+os.environ["OLLAMA_HOST"] = server.url
+start = time.perf_counter()
+from config.config import Config
+Config.Cache.ENABLED = False
+Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+from benchmarks.fake_models import use_fake_models
+from chatbot.chatbot import Chatbot, ChunkEvent, Message, Role, create_history
+from data_ingestor.backends import create_backend
+from file_loader.file_loader import File
+imported = time.perf_counter()
+backend = create_backend("InMemory")
+use_fake_models(backend.module)
+bot = Chatbot([File.from_text("notes.txt", "The quarterly report lists revenue by region. " * 200)], backend)
+ready = time.perf_counter()
+history = create_history(Message(Role.ASSISTANT, "Hello"))
+for event in bot.ask("Which regions does the report cover?", history):
+    if isinstance(event, ChunkEvent) and event.content:
+        break
+first_token = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "ready_seconds": ready - start,
+    "first_token_seconds": first_token - start,
+    "modules": len(sys.modules),
+}))
+server.stop()
+os._exit(0)
+"""
+
+
+def _run_probe(tree: Path, code: str) -> dict:
+    with tempfile.TemporaryDirectory() as app_home:
+        env = dict(os.environ, PYTHONPATH=str(tree), APP_HOME=app_home, PYTHONDONTWRITEBYTECODE="1")
+        result = subprocess.run([sys.executable, "-c", code], cwd=tree, env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def _median(runs: list, key: str) -> float:
+    return round(statistics.median(run[key] for run in runs) * 1000, 1)
+
+def _measure_import(tree: Path, repeats: int) -> dict:
+    runs = [_run_probe(tree, IMPORT_PROBE) for _ in range(repeats)]
+    return {"import_ms": _median(runs, "seconds"), "modules": runs[-1]["modules"]}
+
+def _measure_first_token(tree: Path, repeats: int) -> dict:
+    runs = [_run_probe(tree, FIRST_TOKEN_PROBE) for _ in range(repeats)]
+    return {
+        "import_ms": _median(runs, "import_seconds"),
+        "ready_ms": _median(runs, "ready_seconds"),
+        "first_token_ms": _median(runs, "first_token_seconds"),
+        "modules": runs[-1]["modules"],
+    }
+
+def _export_tree(ref: str, directory: Path) -> Path:
+    archive = subprocess.run(["git", "archive", ref], cwd=REPO_DIR, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+    return directory
+
+def run(repeats: int, baseline: Optional[str]) -> dict:
+    # Byte-code is compiled once per tree, so the first probe does not pay for it
+    subprocess.run([sys.executable, "-m", "compileall", "-q", "-x", r"app\.py", str(REPO_DIR)], check=True)
+    report = {
+        "repeats": repeats,
+        "import": _measure_import(REPO_DIR, repeats),
+        "first_answer": _measure_first_token(REPO_DIR, repeats),
+    }
+    if baseline:
+        with tempfile.TemporaryDirectory() as directory:
+            tree = _export_tree(baseline, Path(directory))
+            subprocess.run([sys.executable, "-m", "compileall", "-q", "-x", r"app\.py", str(tree)], check=True)
+            report["baseline"] = {"ref": baseline, "import": _measure_import(tree, repeats)}
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold import time of the chatbot and time to the first answer token in a fresh process")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baseline", help="Git ref whose chatbot import time is measured for comparison")
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeats, args.baseline), indent=2))
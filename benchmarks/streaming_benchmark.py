@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from benchmarks.corpus import create_corpus, synthetic_queries
+from benchmarks.fake_ollama import FakeOllamaServer
+from config.config import Config
+
+
+class _Placeholder:
+    # Does what st.empty().markdown() does on the server for every call: serialize the whole text into a
+    # delta message for the browser, which then parses and lays out the markdown again
+    def __init__(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        self._message = ForwardMsg()
+        self.calls = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.text = ""
+
+    def markdown(self, text: str):
+        start = time.perf_counter()
+        self._message.delta.new_element.markdown.body = text
+        self.bytes += len(self._message.SerializeToString())
+        self.seconds += time.perf_counter() - start
+        self.calls += 1
+        self.text = text
+
+def _render_answer(bot, question: str, coalesce: bool) -> dict:
+    # The chat loop of app.py
+    from chatbot.chatbot import ChunkEvent, FinalAnswerEvent
+
+    placeholder = _Placeholder()
+    full_response = ""
+    first_render = None
+    start = time.perf_counter()
+    for event in bot.ask(question, [], coalesce=coalesce):
+        if isinstance(event, ChunkEvent):
+            full_response += event.content
+            placeholder.markdown(full_response)
+            # The fake answer starts with "token0", after the thinking
+            if first_render is None and "token0" in full_response:
+                first_render = time.perf_counter() - start
+        if isinstance(event, FinalAnswerEvent):
+            if event.content != full_response.strip():
+                placeholder.markdown(event.content)
+            answer = event.content
+            final_render = time.perf_counter() - start
+    return {
+        "render_calls": placeholder.calls,
+        "rendered_kb": placeholder.bytes / 1024,
+        "render_ms": placeholder.seconds * 1000,
+        "first_answer_render_ms": first_render * 1000,
+        "final_render_ms": final_render * 1000,
+        "thinking_shown": "thought" in full_response,
+        "final_text_matches": placeholder.text.strip() == answer,
+    }
+
+def _mean(results: List[dict], key: str) -> float:
+    return round(sum(result[key] for result in results) / len(results), 1)
+
+def run(answer_tokens: int, thinking_tokens: int, tokens_per_second: float, n_questions: int) -> dict:
+    Config.Cache.ENABLED = False
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = False
+    Config.Models.WARMUP = False
+    from benchmarks.fake_models import use_fake_models
+    from chatbot.chatbot import Chatbot
+    from data_ingestor.backends import create_backend
+    from file_loader.file_loader import load_file
+
+    ollama = FakeOllamaServer(response_tokens=answer_tokens, thinking_tokens=thinking_tokens, tokens_per_second=tokens_per_second).start()
+    os.environ["OLLAMA_HOST"] = ollama.url
+    backend = create_backend("InMemory")
+    use_fake_models(backend.module)
+    with tempfile.TemporaryDirectory() as directory:
+        bot = Chatbot([load_file(path) for path in create_corpus(Path(directory), "small")], backend)
+    questions = synthetic_queries(n_questions)
+    report = {
+        "answer_tokens": answer_tokens,
+        "thinking_tokens": thinking_tokens,
+        "tokens_per_second": tokens_per_second,
+        "flush_ms": Config.Chatbot.STREAM_FLUSH_MS,
+        "flush_chars": Config.Chatbot.STREAM_FLUSH_CHARS,
+    }
+    for name, coalesce in [("per_token", False), ("coalesced", True)]:
+        results = [_render_answer(bot, question, coalesce) for question in questions]
+        report[name] = {
+            **{key: _mean(results, key) for key in ["render_calls", "rendered_kb", "render_ms", "first_answer_render_ms", "final_render_ms"]},
+            "thinking_shown": any(result["thinking_shown"] for result in results),
+            "final_text_matches": all(result["final_text_matches"] for result in results),
+        }
+    ollama.stop()
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render calls and latency of streaming long answers into a Streamlit placeholder")
+    parser.add_argument("--answer-tokens", type=int, default=2000)
+    parser.add_argument("--thinking-tokens", type=int, default=300)
+    parser.add_argument("--tokens-per-second", type=float, default=400)
+    parser.add_argument("--questions", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.answer_tokens, args.thinking_tokens, args.tokens_per_second, args.questions), indent=2))
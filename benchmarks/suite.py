@@ -0,0 +1,193 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+
+from benchmarks.corpus import CORPUS_SIZES, create_corpus, synthetic_queries
+from benchmarks.fake_ollama import FakeOllamaServer
+from benchmarks.fake_pinecone import FakePineconeIndex
+
+BACKENDS = ["InMemory", "Pinecone"]
+
+
+@dataclass
+class Settings:
+    queries: int = 20
+    asks: int = 5
+    contextualize: bool = False
+    fake_models: bool = False
+    pinecone_latency_ms: float = 40
+    llm_request_latency_ms: float = 20
+    llm_prompt_tokens_per_second: float = 20_000
+    llm_tokens_per_second: float = 200
+    llm_response_tokens: int = 40
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _latencies(measure: Callable[[str], float], queries: List[str]) -> dict:
+    latencies = [measure(query) for query in queries]
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+    }
+
+def _timed(function: Callable, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def _time_to_first_token(bot, chatbot_module, query: str) -> float:
+    history = chatbot_module.create_history(chatbot_module.Message(chatbot_module.Role.ASSISTANT, "Hello"))
+    start = time.perf_counter()
+    for event in bot.ask(query, history):
+        if isinstance(event, chatbot_module.ChunkEvent) and event.content:
+            return time.perf_counter() - start
+    return time.perf_counter() - start
+
+def _run_scenario(backend: str, size: str, paths: List[Path], settings: Settings, results: "multiprocessing.Queue"):
+    # Runs in a fresh process, so peak RSS belongs to this scenario only
+    from config.config import Config
+    from data_ingestor.backends import create_backend
+    from file_loader.file_loader import load_file
+
+    Config.Cache.ENABLED = False            # Every run measures a cold ingest
+    Config.Preprocessing.CONTEXUALIZE_CHUNKS = settings.contextualize
+    server = FakeOllamaServer(
+        request_latency=settings.llm_request_latency_ms / 1000,
+        prompt_tokens_per_second=settings.llm_prompt_tokens_per_second,
+        tokens_per_second=settings.llm_tokens_per_second,
+        response_tokens=settings.llm_response_tokens,
+    ).start()
+    os.environ["OLLAMA_HOST"] = server.url
+    import chatbot.chatbot as chatbot_module
+
+    vector_store = create_backend(backend)
+    ingestor = vector_store.module
+    if backend == "Pinecone":
+        index = FakePineconeIndex(latency=settings.pinecone_latency_ms / 1000)
+        ingestor._get_index = lambda: index
+    if settings.fake_models:
+        from benchmarks.fake_models import use_fake_models
+
+        use_fake_models(ingestor)
+
+    start = time.perf_counter()
+    files = [load_file(path) for path in paths]
+    load_seconds = time.perf_counter() - start
+    n_pages = sum(len(file.pages) for file in files)
+
+    start = time.perf_counter()
+    bot = chatbot_module.Chatbot(files, vector_store)
+    ingest_seconds = time.perf_counter() - start
+    compression_retriever = bot.retriever.retriever
+    hybrid_retriever = compression_retriever.base_retriever
+    n_chunks = len(hybrid_retriever.retrievers[1].docs)
+
+    queries = synthetic_queries(settings.queries)
+    fused = {query: hybrid_retriever.invoke(query) for query in queries}        # Warms the query embedding cache
+    results.put(
+        {
+            "backend": backend,
+            "corpus": size,
+            "files": len(files),
+            "pages": n_pages,
+            "chunks": n_chunks,
+            "load_seconds": round(load_seconds, 3),
+            "load_pages_per_second": round(n_pages / load_seconds, 1),
+            "ingest_seconds": round(ingest_seconds, 3),
+            "ingest_chunks_per_second": round(n_chunks / ingest_seconds, 1),
+            "retrieval": _latencies(lambda query: _timed(hybrid_retriever.invoke, query), queries),
+            "rerank": _latencies(
+                lambda query: _timed(compression_retriever.base_compressor.compress_documents, fused[query], query),
+                queries,
+            ),
+            "time_to_first_token": _latencies(
+                lambda query: _time_to_first_token(bot, chatbot_module, query),
+                queries[: settings.asks],
+            ),
+            "llm_requests": server.stats.requests,
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+        }
+    )
+    server.stop()
+
+def _run_isolated(backend: str, size: str, paths: List[Path], settings: Settings) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_scenario, args=(backend, size, paths, settings, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def run(sizes: List[str], backends: List[str], settings: Settings) -> dict:
+    scenarios = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            paths = create_corpus(Path(directory) / size, size)
+            for backend in backends:
+                scenarios.append(_run_isolated(backend, size, paths, settings))
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": asdict(settings),
+        "scenarios": scenarios,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ingestion and query benchmarks with Ollama and Pinecone stand-ins")
+    parser.add_argument("--sizes", nargs="+", choices=list(CORPUS_SIZES), default=list(CORPUS_SIZES))
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--queries", type=int, default=Settings.queries)
+    parser.add_argument("--asks", type=int, default=Settings.asks, help="Questions asked end to end for time to first token")
+    parser.add_argument("--contextualize", action="store_true", help="Contextualize chunks with the fake LLM during ingestion")
+    parser.add_argument("--fake-models", action="store_true", help="Use stand-ins for the FastEmbed and FlashRank models")
+    parser.add_argument("--pinecone-latency-ms", type=float, default=Settings.pinecone_latency_ms)
+    parser.add_argument("--llm-request-latency-ms", type=float, default=Settings.llm_request_latency_ms)
+    parser.add_argument("--llm-prompt-tokens-per-second", type=float, default=Settings.llm_prompt_tokens_per_second)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=Settings.llm_tokens_per_second)
+    parser.add_argument("--llm-response-tokens", type=int, default=Settings.llm_response_tokens)
+    parser.add_argument("--output", type=Path, help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    settings = Settings(
+        queries=args.queries,
+        asks=args.asks,
+        contextualize=args.contextualize,
+        fake_models=args.fake_models,
+        pinecone_latency_ms=args.pinecone_latency_ms,
+        llm_request_latency_ms=args.llm_request_latency_ms,
+        llm_prompt_tokens_per_second=args.llm_prompt_tokens_per_second,
+        llm_tokens_per_second=args.llm_tokens_per_second,
+        llm_response_tokens=args.llm_response_tokens,
+    )
+    report = json.dumps(run(args.sizes, args.backends, settings), indent=2)
+    if args.output:
+        args.output.write_text(report)
+    else:
+        print(report)
@@ -0,0 +1,130 @@
+import argparse
+import json
+import multiprocessing
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+DIMENSION = 384                 # BAAI/bge-small-en-v1.5
+N_QUERIES = 50
+K = 5
+GENERATE_BATCH_ROWS = 100_000
+
+
+class PrecomputedEmbeddings(Embeddings):
+    # Maps the synthetic text "chunk-{i}" to row i of a random matrix, so no model is needed
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectors[int(text.split("-")[1])].tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vectors[int(text.split("-")[1])].tolist()
+
+
+def _random_vectors(n: int) -> np.ndarray:
+    rng = np.random.default_rng(42)
+    vectors = np.empty((n, DIMENSION), dtype=np.float32)
+    for start in range(0, n, GENERATE_BATCH_ROWS):
+        end = min(start + GENERATE_BATCH_ROWS, n)
+        vectors[start:end] = rng.standard_normal((end - start, DIMENSION), dtype=np.float32)
+    return vectors
+
+def _documents(n: int) -> List[Document]:
+    return [Document(page_content=f"chunk-{i}", metadata={"source": "benchmark"}) for i in range(n)]
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _build(store_name: str, n: int, dtype: str, index_path: str):
+    from data_ingestor.numpy_vector_store import NumpyVectorStore
+
+    if store_name == "mmap":
+        return NumpyVectorStore.load(Path(index_path), PrecomputedEmbeddings(np.empty((0, DIMENSION))))
+    vectors = _random_vectors(n)
+    if store_name == "in_memory":
+        from langchain_core.vectorstores import InMemoryVectorStore
+
+        store = InMemoryVectorStore(PrecomputedEmbeddings(vectors))
+        store.add_documents(_documents(n))
+    else:
+        store = NumpyVectorStore(PrecomputedEmbeddings(vectors), dtype=dtype)
+        store.add_embeddings(_documents(n), vectors)
+    del vectors
+    return store
+
+def _measure(store_name: str, n: int, dtype: str, index_path: str, results: "multiprocessing.Queue"):
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    store = _build(store_name, n, dtype, index_path)
+    build_seconds = time.perf_counter() - start
+    queries = np.random.default_rng(7).standard_normal((N_QUERIES, DIMENSION), dtype=np.float32)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.similarity_search_by_vector(query.tolist(), k=K)
+        latencies.append(time.perf_counter() - start)
+    results.put(
+        {
+            "store": store_name,
+            "chunks": n,
+            "dtype": dtype,
+            "build_seconds": round(build_seconds, 3),
+            "query_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+            "query_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "peak_rss_delta_mb": round(_peak_rss_mb() - rss_before, 1),
+        }
+    )
+
+def _run_isolated(store_name: str, n: int, dtype: str, index_path: str = "") -> dict:
+    # Every configuration runs in a fresh process so peak RSS is not polluted by the previous one
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(store_name, n, dtype, index_path, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def _save_index(n: int, dtype: str, path: str):
+    from data_ingestor.numpy_vector_store import NumpyVectorStore
+
+    vectors = _random_vectors(n)
+    store = NumpyVectorStore(PrecomputedEmbeddings(vectors), dtype=dtype)
+    store.add_embeddings(_documents(n), vectors)
+    store.save(Path(path))
+
+def run(sizes: List[int], dtypes: List[str], baseline_max: int) -> List[dict]:
+    results = []
+    for n in sizes:
+        if n <= baseline_max:
+            results.append(_run_isolated("in_memory", n, "float64"))
+        for dtype in dtypes:
+            results.append(_run_isolated("numpy", n, dtype))
+            with tempfile.TemporaryDirectory() as path:
+                process = multiprocessing.get_context("spawn").Process(target=_save_index, args=(n, dtype, path))
+                process.start()
+                process.join()
+                results.append(_run_isolated("mmap", n, dtype, path))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and RSS of InMemoryVectorStore against NumpyVectorStore")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dtypes", nargs="+", default=["float32", "float16", "int8"])
+    parser.add_argument(
+        "--baseline-max",
+        type=int,
+        default=100_000,
+        help="Largest corpus to run InMemoryVectorStore on (it needs ~30 GB at 1M chunks)",
+    )
+    args = parser.parse_args()
+    print(json.dumps(run(args.sizes, args.dtypes, args.baseline_max), indent=2))
@@ -0,0 +1,103 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+
+@dataclass
+class CachedAnswer:
+    corpus: str
+    question: str
+    embedding: np.ndarray
+    events: List[Any]
+    created: float
+    conversation: str = ""          # Fingerprint of the history the question was asked after
+
+
+class AnswerCache:
+    # Answers keyed by corpus fingerprint, conversation fingerprint and question embedding. A lookup hits
+    # when a cached question for the same corpus, asked after the same history, has cosine similarity
+    # above `threshold`. Entries expire after `ttl_seconds`
+    # and the least recently used entry is evicted above `max_entries`.
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float,
+        ttl_seconds: float,
+        max_entries: int,
+        path: Optional[Path] = None,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None and path.exists():
+            self._load()
+
+    def embed(self, question: str) -> np.ndarray:
+        embedding = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), np.finfo(np.float32).tiny)
+
+    def get(self, corpus: str, conversation: str, embedding: np.ndarray) -> Optional[CachedAnswer]:
+        with self._lock:
+            self._expire()
+            keys = [
+                key
+                for key, entry in self._entries.items()
+                if entry.corpus == corpus and entry.conversation == conversation
+            ]
+            if not keys:
+                return None
+            similarities = np.stack([self._entries[key].embedding for key in keys]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            self._entries.move_to_end(keys[best])
+            logger.info(f"Answer cache hit with similarity {similarities[best]:.3f}")
+            return self._entries[keys[best]]
+
+    def put(self, corpus: str, conversation: str, question: str, embedding: np.ndarray, events: List[Any]):
+        with self._lock:
+            self._entries[uuid.uuid4().hex] = CachedAnswer(
+                corpus=corpus,
+                conversation=conversation,
+                question=question,
+                embedding=embedding,
+                events=events,
+                created=time.time(),
+            )
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path is not None:
+                self._save()
+
+    def _expire(self):
+        deadline = time.time() - self.ttl_seconds
+        for key in [key for key, entry in self._entries.items() if entry.created < deadline]:
+            del self._entries[key]
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                self._entries = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable answer cache {self.path}: {e}")
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
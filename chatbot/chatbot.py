@@ -1,34 +1,54 @@
+import asyncio
+import contextvars
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 from enum import Enum
 from dataclasses import dataclass
-from typing import List, TypedDict, Iterable
+from functools import lru_cache
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, List, Optional, Sequence, Set, Tuple, TypedDict, Iterable
 
-from langchain.prompts import ChatPromptTemplate
-from langchain.prompts import MessagesPlaceholder
 from langchain_core.documents import Document
-from langchain_core.messages import BaseMessage
-from langchain_ollama import ChatOllama
-from langgraph.graph import StateGraph
-from langchain_core.messages import AIMessage, HumanMessage
-from langgraph.constants import START
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from loguru import logger
 
+from chatbot.stream_coalescer import CoalescedStream
 from config.config import Config
-from file_loader.file_loader import File
+from data_ingestor.backends import Backend, create_backend
+from instrumentation.instrumentation import (
+    Span,
+    collect_spans,
+    configure_instrumentation,
+    count_llm_tokens,
+    export_metrics,
+    record,
+    span,
+)
+from model_registry.model_registry import get_chat_model
+
+# LangGraph, LangChain, Ollama and the vector store backends are imported when a Chatbot is built,
+# so importing this module stays cheap and works outside Streamlit
+if TYPE_CHECKING:
+    import numpy as np
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_ollama import ChatOllama
 
-# from data_ingestor.data_ingestor import ingest_files        # InMemory
-# from data_ingestor.pinecone_data_ingestor import ingest_files        # Pinecone
+    from chatbot.answer_cache import AnswerCache, CachedAnswer
+    from chatbot.prompt_assembler import PromptAssembler
+    from file_loader.file_loader import File
 
-import importlib
-import streamlit as st
-if "db_option" not in st.session_state:
-    st.session_state["db_option"] = "InMemory"  
-if(st.session_state["db_option"] == "Pinecone"):
-    module = importlib.import_module("data_ingestor.pinecone_data_ingestor")
-else:
-    module = importlib.import_module("data_ingestor.data_ingestor")
 
-importlib.reload(module)        # Reload the module to get the latest changes
-ingest_files = getattr(module, "ingest_files")
+ANSWER_CACHE_FILE_NAME = "answer_cache.pkl"
 
+# One prefill warm-up per Ollama slot at most, shared by ask and aask. A warm-up that finds every slot
+# taken is skipped rather than queued, since it is worthless once the answer has started.
+_warmup_slots = threading.BoundedSemaphore(Config.Server.MAX_CONCURRENT_ASKS)
+_warmup_executor = ThreadPoolExecutor(max_workers=Config.Server.MAX_CONCURRENT_ASKS, thread_name_prefix="prefill")
+
+def _release_warmup_slot(_):
+    _warmup_slots.release()
 
 SYSTEM_PROMPT = """
 You're having a conversation with an user about excerpts of their files. Try to be helpful and answer their questions.
@@ -60,16 +80,21 @@ FILE_TEMPLATE = """
 </file>
 """.strip()
 
-PROMPT_TEMPLATE = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            SYSTEM_PROMPT
-        ),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", PROMPT),
-    ]
-)
+@lru_cache(maxsize=1)
+def get_prompt_template() -> "ChatPromptTemplate":
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    return ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                SYSTEM_PROMPT
+            ),
+            MessagesPlaceholder(variable_name="history_summary", optional=True),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", PROMPT),
+        ]
+    )
 
 
 class Role(Enum):
@@ -91,8 +116,14 @@ class SourcesEvent:
 
 @dataclass
 class FinalAnswerEvent:
+    # The answer without the model's thinking, as it is added to the chat history
     content: str
 
+@dataclass
+class InstrumentationEvent:
+    # Timings of every stage of one answer, yielded after the FinalAnswerEvent
+    spans: List[Span]
+
 @dataclass
 class State(TypedDict):
     question: str
@@ -101,88 +132,380 @@ class State(TypedDict):
     answer: str
 
 
-def _remove_thinking_from_message(message: str) -> str:
-    close_tag = "</think>"
-    tag_length = len(close_tag)
-    return message[message.find(close_tag) + tag_length :].strip()
+def remove_thinking(message: str) -> str:
+    return message.split("</think>")[-1].strip()
+
+def _create_stream() -> CoalescedStream:
+    return CoalescedStream(
+        flush_seconds=Config.Chatbot.STREAM_FLUSH_MS / 1000,
+        flush_chars=Config.Chatbot.STREAM_FLUSH_CHARS,
+    )
+
+def _coalesce(
+    stream: CoalescedStream, event: SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent
+) -> Iterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent]:
+    # Chunks are merged and filtered; held back text goes out before any other event
+    if isinstance(event, ChunkEvent):
+        text = stream.push(event.content)
+    else:
+        text = stream.flush(final=isinstance(event, (FinalAnswerEvent, InstrumentationEvent)))
+    if text:
+        yield ChunkEvent(text)
+    if not isinstance(event, ChunkEvent):
+        yield event
+
+def coalesce_events(
+    events: Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent],
+) -> Iterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent]:
+    stream = _create_stream()
+    for event in events:
+        yield from _coalesce(stream, event)
+
+async def acoalesce_events(
+    events: AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent],
+) -> AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent]:
+    # Closing the coalesced stream closes the answer stream too, so an abandoned answer stops generating
+    stream = _create_stream()
+    async with aclosing(events):
+        async for event in events:
+            for coalesced in _coalesce(stream, event):
+                yield coalesced
+
+async def _replay(events: List[SourcesEvent | ChunkEvent | FinalAnswerEvent]) -> AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
+    for event in events:
+        yield event
 
 def create_history(Welcome_message: Message) -> List[Message]:
     return [Welcome_message]
 
+def answer_messages(prompt: str, event: FinalAnswerEvent) -> List[Message]:
+    # The turn a caller appends to its own history once the answer is complete
+    return [Message(role=Role.USER, content=prompt), Message(role=Role.ASSISTANT, content=event.content)]
+
+def create_answer_cache(backend: Backend) -> Optional["AnswerCache"]:
+    if not Config.Chatbot.ANSWER_CACHE_ENABLED:
+        return None
+    from chatbot.answer_cache import AnswerCache
+    from data_ingestor.retrieval_cache import query_cached_embeddings
+
+    return AnswerCache(
+        query_cached_embeddings(backend.create_embeddings()),
+        threshold=Config.Chatbot.ANSWER_CACHE_THRESHOLD,
+        ttl_seconds=Config.Chatbot.ANSWER_CACHE_TTL_SECONDS,
+        max_entries=Config.Chatbot.ANSWER_CACHE_MAX_ENTRIES,
+        path=Config.Path.CACHE_DIR / ANSWER_CACHE_FILE_NAME if Config.Chatbot.ANSWER_CACHE_PERSIST else None,
+    )
+
+def create_prompt_assembler(llm: "ChatOllama") -> "PromptAssembler":
+    from chatbot.prompt_assembler import PromptAssembler, TokenCounter
+
+    return PromptAssembler(
+        llm,
+        get_prompt_template(),
+        FILE_TEMPLATE,
+        max_tokens=Config.Prompt.MAX_TOKENS,
+        max_history_tokens=Config.Prompt.MAX_HISTORY_TOKENS,
+        recent_messages=Config.Prompt.RECENT_MESSAGES,
+        summary_tokens=Config.Prompt.SUMMARY_TOKENS,
+        min_chunk_tokens=Config.Prompt.MIN_CHUNK_TOKENS,
+        token_counter=TokenCounter(Config.Prompt.CHARS_PER_TOKEN),
+    )
+
+def corpus_fingerprint(files: List["File"]) -> str:
+    # Cached answers are only valid for the same model over the same set of files
+    from data_ingestor.ingest_cache import file_hash
+
+    digest = hashlib.sha256(Config.Model.NAME.encode("utf-8"))
+    for name, content_hash in sorted((file.name, file_hash(file)) for file in files):
+        digest.update(f"\0{name}\0{content_hash}".encode("utf-8"))
+    return digest.hexdigest()
+
+def conversation_fingerprint(chat_history: Sequence[Message]) -> str:
+    # A follow-up like "tell me more" means something else in every conversation, so an answer is only
+    # reused after the same history
+    digest = hashlib.sha256()
+    for message in chat_history:
+        digest.update(f"\0{message.role.value}\0{message.content}".encode("utf-8"))
+    return digest.hexdigest()
+
 
 class Chatbot:
-    def __init__(self, files: List[File]):
+    def __init__(self, files: List["File"], backend: Optional[Backend] = None):
+        configure_instrumentation()
         self.files = files
-        self.retriever = ingest_files(files)
-        self.llm = ChatOllama(
-            model=Config.Model.NAME,
+        self.backend = backend or create_backend()
+        with span("ingest", files=len(files)):
+            self.retriever = self.backend.ingest_files(files)
+        export_metrics()
+        self.llm = get_chat_model(
+            Config.Model.NAME,
             temperature=Config.Model.TEMPERATURE,
             verbose=False,
             keep_alive=-1,
+            num_ctx=Config.Model.CONTEXT_WINDOW,
         )
-        self.workflow = self._create_workflow()
-    
-    def _format_docs(self, docs: List[Document]) -> str:
-        return "\n\n".join(
-            FILE_TEMPLATE.format(name=doc.metadata["source"], content=doc.page_content) 
-            for doc in docs
+        # Same options as the answering model, or Ollama would reload it, but stops after one token
+        self.prefill_llm = get_chat_model(
+            Config.Model.NAME,
+            temperature=Config.Model.TEMPERATURE,
+            verbose=False,
+            keep_alive=-1,
+            num_ctx=Config.Model.CONTEXT_WINDOW,
+            num_predict=1,
         )
+        self.prompt_assembler = create_prompt_assembler(self.llm)
+        self._warmups: Set[asyncio.Task] = set()
+        self.workflow = self._create_workflow()
+        self.answer_cache = create_answer_cache(self.backend)
+        self.corpus_fingerprint = corpus_fingerprint(files)
+
+    def add_files(self, files: List["File"]):
+        with span("ingest.add_files", files=len(files)):
+            self.backend.add_files(self.retriever, files)
+        export_metrics()
+        names = {file.name for file in files}
+        self.files = [file for file in self.files if file.name not in names] + files
+        self.corpus_fingerprint = corpus_fingerprint(self.files)
+
+    def remove_files(self, file_names: List[str]):
+        with span("ingest.remove_files", files=len(file_names)):
+            self.backend.remove_files(self.retriever, file_names)
+        export_metrics()
+        self.files = [file for file in self.files if file.name not in file_names]
+        self.corpus_fingerprint = corpus_fingerprint(self.files)
     
     def _retrieve(self, state: State):
-        context = self.retriever.invoke(state["question"])
+        self._start_warmup(state)
+        with span("retrieve") as attributes:
+            context = self.retriever.invoke(state["question"])
+            attributes["documents"] = len(context)
+        return {"context": context}
+
+    async def _aretrieve(self, state: State):
+        self._astart_warmup(state)
+        with span("retrieve") as attributes:
+            context = await self.retriever.ainvoke(state["question"])
+            attributes["documents"] = len(context)
         return {"context": context}
     
+    def _prefix_messages(self, state: State) -> List[BaseMessage]:
+        # Only worth a request once there is history; every prompt starts with the system prompt anyway
+        if not Config.Chatbot.PREFILL_WARMUP:
+            return []
+        prefix = self.prompt_assembler.prefix(state["chat_history"])
+        return prefix if len(prefix) > 1 else []
+
+    def _record_prefill(self, response: AIMessage, attributes: dict):
+        attributes.update(count_llm_tokens(response.usage_metadata, Config.Model.NAME, "prefill_warmup"))
+
+    # The system prompt and history go through prefill on Ollama while the question is embedded, searched
+    # and reranked, so the answer only prefills the excerpts and the question. The warm-up runs in the
+    # background: nothing waits for it, and a failed one only costs the answer that prefill.
+    def _start_warmup(self, state: State):
+        prefix = self._prefix_messages(state)
+        if prefix and _warmup_slots.acquire(blocking=False):
+            future = _warmup_executor.submit(contextvars.copy_context().run, self._warm_prefix, prefix)
+            future.add_done_callback(_release_warmup_slot)
+
+    def _astart_warmup(self, state: State):
+        prefix = self._prefix_messages(state)
+        if prefix and _warmup_slots.acquire(blocking=False):
+            # The loop only keeps weak references to tasks
+            task = asyncio.create_task(self._awarm_prefix(prefix))
+            self._warmups.add(task)
+            task.add_done_callback(self._warmups.discard)
+            # Also released when the task is cancelled before it starts
+            task.add_done_callback(_release_warmup_slot)
+
+    def _warm_prefix(self, prefix: List[BaseMessage]):
+        from langgraph.constants import TAG_NOSTREAM
+
+        try:
+            with span("prefill_warmup", messages=len(prefix)) as attributes:
+                self._record_prefill(self.prefill_llm.invoke(prefix, config={"tags": [TAG_NOSTREAM]}), attributes)
+        except Exception as e:
+            logger.warning(f"Prefill warm-up failed: {e}")
+
+    async def _awarm_prefix(self, prefix: List[BaseMessage]):
+        from langgraph.constants import TAG_NOSTREAM
+
+        try:
+            with span("prefill_warmup", messages=len(prefix)) as attributes:
+                self._record_prefill(await self.prefill_llm.ainvoke(prefix, config={"tags": [TAG_NOSTREAM]}), attributes)
+        except Exception as e:
+            logger.warning(f"Prefill warm-up failed: {e}")
+
+    def _create_messages(self, state: State) -> List[BaseMessage]:
+        with span("prompt") as attributes:
+            prompt = self.prompt_assembler.assemble(state["question"], state["chat_history"], state["context"])
+            attributes.update(
+                prompt_tokens=prompt.prompt_tokens,
+                history_tokens=prompt.history_tokens,
+                context_tokens=prompt.context_tokens,
+                **prompt.attributes,
+            )
+        return prompt.messages
+
+    def _record_generation(self, messages: List[BaseMessage], answer: AIMessage, attributes: dict):
+        tokens = count_llm_tokens(answer.usage_metadata, Config.Model.NAME, "generate")
+        attributes.update(tokens)
+        if tokens["prompt_tokens"]:
+            self.prompt_assembler.token_counter.calibrate(messages, tokens["prompt_tokens"])
+
     def _generate(self, state: State):
-        messages = PROMPT_TEMPLATE.invoke(
-            {
-                "question": state["question"],
-                "context": self._format_docs(state["context"]),
-                "chat_history": state["chat_history"],
-            }
-        )
-        answer = self.llm.invoke(messages)
+        messages = self._create_messages(state)
+        with span("generate") as attributes:
+            answer = self.llm.invoke(messages)
+            self._record_generation(messages, answer, attributes)
+        return {"answer": answer}
+
+    async def _agenerate(self, state: State):
+        messages = self._create_messages(state)
+        with span("generate") as attributes:
+            answer = await self.llm.ainvoke(messages)
+            self._record_generation(messages, answer, attributes)
         return {"answer": answer}
     
     def _create_workflow(self):
-        graph_builder = StateGraph(State).add_sequence([self._retrieve, self._generate])
+        from langchain_core.runnables import RunnableLambda
+        from langgraph.constants import START
+        from langgraph.graph import StateGraph
+
+        # Each node has a sync and an async implementation, so the same graph serves stream and astream
+        graph_builder = StateGraph(State)
+        graph_builder.add_node("_retrieve", RunnableLambda(self._retrieve, afunc=self._aretrieve))
+        graph_builder.add_node("_generate", RunnableLambda(self._generate, afunc=self._agenerate))
         graph_builder.add_edge(START, "_retrieve")
+        graph_builder.add_edge("_retrieve", "_generate")
         return graph_builder.compile()
-    
-    def _ask_model(
-        self, prompt: str, chat_history: List[Message]
-    ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
-        history = [
+
+    def _to_messages(self, chat_history: Sequence[Message]) -> List[BaseMessage]:
+        return [
             AIMessage(m.content) if m.role == Role.ASSISTANT else HumanMessage(m.content)
             for m in chat_history
         ]
-        payload = {"question": prompt, "chat_history": history}
 
-        config = {
-            "configurable": {"thread_id": 42},
-        }
+    def _create_payload(self, prompt: str, chat_history: Sequence[Message]) -> dict:
+        return {"question": prompt, "chat_history": self._to_messages(chat_history)}
+
+    def _to_events(self, event_type: str, event_data) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
+        if event_type == "messages":
+            chunk, _ = event_data
+            yield ChunkEvent(chunk.content)
+        if event_type == "updates":
+            if "_retrieve" in event_data:
+                documents = event_data["_retrieve"]["context"]
+                yield SourcesEvent(documents)
+            if "_generate" in event_data:
+                answer = event_data["_generate"]["answer"]
+                yield FinalAnswerEvent(remove_thinking(answer.content))
+    
+    def _ask_model(
+        self, prompt: str, chat_history: Sequence[Message]
+    ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
+        # The graph keeps no checkpoints, so every call is independent and the history comes from the caller
         for event_type, event_data in self.workflow.stream(
-            payload, 
-            config=config,
+            self._create_payload(prompt, chat_history),
+            stream_mode=["updates", "messages"],
+        ):
+            yield from self._to_events(event_type, event_data)
+
+    async def _aask_model(
+        self, prompt: str, chat_history: Sequence[Message]
+    ) -> AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
+        async for event_type, event_data in self.workflow.astream(
+            self._create_payload(prompt, chat_history),
             stream_mode=["updates", "messages"],
         ):
-            if event_type == "messages":
-                chunk, _ = event_data
-                yield ChunkEvent(chunk.content)
-            if event_type == "updates":
-                if "_retrieve" in event_data:
-                    documents = event_data["_retrieve"]["context"]
-                    yield SourcesEvent(documents)
-                if "_generate" in event_data:
-                    answer = event_data["_generate"]["answer"]
-                    yield FinalAnswerEvent(answer.content)
+            for event in self._to_events(event_type, event_data):
+                yield event
+
+    def _lookup_answer(
+        self, prompt: str, chat_history: Sequence[Message]
+    ) -> Tuple[Optional["CachedAnswer"], Optional["np.ndarray"]]:
+        if self.answer_cache is None:
+            return None, None
+        with span("answer_cache") as attributes:
+            question_embedding = self.answer_cache.embed(prompt)
+            cached_answer = self.answer_cache.get(
+                self.corpus_fingerprint, conversation_fingerprint(chat_history), question_embedding
+            )
+            attributes["hit"] = cached_answer is not None
+        return cached_answer, question_embedding
+
+    def _record_answer(
+        self,
+        prompt: str,
+        chat_history: Sequence[Message],
+        event: FinalAnswerEvent,
+        recorded_events: List[SourcesEvent | ChunkEvent | FinalAnswerEvent],
+        cached_answer: Optional["CachedAnswer"],
+        question_embedding: Optional["np.ndarray"],
+    ):
+        self.prompt_assembler.compact(self._to_messages([*chat_history, *answer_messages(prompt, event)]))
+        if self.answer_cache is not None and cached_answer is None:
+            self.answer_cache.put(
+                self.corpus_fingerprint, conversation_fingerprint(chat_history), prompt, question_embedding, recorded_events
+            )
     
+    def _record_first_token(self, event, start: float, first_token: bool) -> bool:
+        if first_token and isinstance(event, ChunkEvent) and event.content:
+            record("time_to_first_token", time.perf_counter() - start)
+            return False
+        return first_token
+
     def ask(
-        self, prompt: str, chat_history: List[Message]
-    ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent]:
-        for event in self._ask_model(prompt, chat_history):
-            yield event
-            if isinstance(event, FinalAnswerEvent):
-                response = _remove_thinking_from_message("".join(event.content))
-                # response = "".join(event.content)
-                chat_history.append(Message(role=Role.USER, content=prompt))
-                chat_history.append(Message(role=Role.ASSISTANT, content=response))
+        self, prompt: str, chat_history: Sequence[Message], coalesce: bool = False
+    ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent]:
+        # chat_history is only read; callers append answer_messages() for the FinalAnswerEvent.
+        # With coalesce, ChunkEvents carry the text of several tokens, see Config.Chatbot.STREAM_FLUSH_MS,
+        # and never the model's thinking, for callers that redraw the answer on every chunk.
+        events = self._ask(prompt, chat_history)
+        return coalesce_events(events) if coalesce else events
+
+    def _ask(
+        self, prompt: str, chat_history: Sequence[Message]
+    ) -> Iterable[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent]:
+        chat_history = tuple(chat_history)
+        with collect_spans() as spans:
+            start = time.perf_counter()
+            cached_answer, question_embedding = self._lookup_answer(prompt, chat_history)
+            # A cache hit replays the recorded event stream, so callers render it like a live answer
+            events = cached_answer.events if cached_answer else self._ask_model(prompt, chat_history)
+            recorded_events = []
+            first_token = True
+            for event in events:
+                first_token = self._record_first_token(event, start, first_token)
+                yield event
+                recorded_events.append(event)
+                if isinstance(event, FinalAnswerEvent):
+                    self._record_answer(prompt, chat_history, event, recorded_events, cached_answer, question_embedding)
+            record("ask", time.perf_counter() - start, cached=cached_answer is not None)
+        export_metrics()
+        yield InstrumentationEvent(spans)
+
+    def aask(
+        self, prompt: str, chat_history: Sequence[Message], coalesce: bool = False
+    ) -> AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent]:
+        events = self._aask(prompt, chat_history)
+        return acoalesce_events(events) if coalesce else events
+
+    async def _aask(
+        self, prompt: str, chat_history: Sequence[Message]
+    ) -> AsyncIterator[SourcesEvent | ChunkEvent | FinalAnswerEvent | InstrumentationEvent]:
+        chat_history = tuple(chat_history)
+        with collect_spans() as spans:
+            start = time.perf_counter()
+            cached_answer, question_embedding = await asyncio.to_thread(self._lookup_answer, prompt, chat_history)
+            events = _replay(cached_answer.events) if cached_answer else self._aask_model(prompt, chat_history)
+            recorded_events = []
+            first_token = True
+            async for event in events:
+                first_token = self._record_first_token(event, start, first_token)
+                yield event
+                recorded_events.append(event)
+                if isinstance(event, FinalAnswerEvent):
+                    self._record_answer(prompt, chat_history, event, recorded_events, cached_answer, question_embedding)
+            record("ask", time.perf_counter() - start, cached=cached_answer is not None)
+        await asyncio.to_thread(export_metrics)
+        yield InstrumentationEvent(spans)
@@ -0,0 +1,269 @@
+import hashlib
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import accumulate
+from typing import Dict, List, Optional, Set, Tuple
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, SystemMessage
+from loguru import logger
+
+from data_ingestor.retrieval_cache import LRUCache
+from instrumentation.instrumentation import count_llm_tokens, span
+
+MESSAGE_OVERHEAD_TOKENS = 4         # Role markers the chat template adds around every message
+MAX_OVERLAP_CHARS = 512             # Longest chunk overlap stripped between excerpts of the same file
+MAX_SUMMARIES = 256
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+    """
+Here is a summary of the earlier part of a conversation between a user and an assistant about the user's files
+
+<summary>
+{summary}
+</summary>
+
+and the messages that followed it
+
+<messages>
+{messages}
+</messages>
+
+Write an updated summary of the whole conversation in at most {words} words. Keep file names, figures and questions that are still open.
+
+Summary:
+    """.strip()
+)
+
+
+class TokenCounter:
+    # The model's tokenizer is not available offline, so tokens are estimated from the text length.
+    # The ratio is corrected with the prompt token counts Ollama reports for every answer.
+    def __init__(self, chars_per_token: float, smoothing: float = 0.2):
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count_messages(self, messages: List[BaseMessage]) -> int:
+        return sum(self.count(message.content) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def truncate(self, text: str, tokens: int) -> str:
+        # Cuts at the last whitespace before the limit, so no word is split
+        limit = int(tokens * self.chars_per_token)
+        if len(text) <= limit:
+            return text
+        cut = text.rfind(" ", 0, limit)
+        return text[: cut if cut > 0 else limit].rstrip() + " ..."
+
+    def calibrate(self, messages: List[BaseMessage], reported_tokens: int):
+        chars = sum(len(message.content) for message in messages)
+        content_tokens = reported_tokens - MESSAGE_OVERHEAD_TOKENS * len(messages)
+        if chars and content_tokens > 0:
+            self.chars_per_token += self.smoothing * (chars / content_tokens - self.chars_per_token)
+
+
+@dataclass
+class AssembledPrompt:
+    messages: List[BaseMessage]
+    context: List[Document]
+    prompt_tokens: int
+    history_tokens: int
+    context_tokens: int
+    attributes: Dict[str, int] = field(default_factory=dict)
+
+
+def _prefix_keys(messages: List[BaseMessage]) -> List[str]:
+    # keys[n] identifies messages[:n] by content, so summaries are shared by identical histories
+    # and never confused between sessions
+    keys = [hashlib.sha256(b"").hexdigest()]
+    for message in messages:
+        keys.append(hashlib.sha256(f"{keys[-1]}\0{message.type}\0{message.content}".encode("utf-8")).hexdigest())
+    return keys
+
+def _normalize_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+def _strip_overlap(previous: str, text: str) -> str:
+    # Neighbouring chunks of a file repeat the splitter's overlap, which is sent only once
+    for length in range(min(len(previous), len(text), MAX_OVERLAP_CHARS), 0, -1):
+        if previous.endswith(text[:length]):
+            return text[length:].lstrip()
+    return text
+
+
+class PromptAssembler:
+    # Fits the prompt into a token budget: recent messages verbatim, older ones folded into a summary
+    # that is extended in the background after an answer, and the remaining budget filled with
+    # deduplicated excerpts in rerank order, the last one trimmed to fit
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        prompt_template: ChatPromptTemplate,
+        file_template: str,
+        max_tokens: int,
+        max_history_tokens: int,
+        recent_messages: int,
+        summary_tokens: int,
+        min_chunk_tokens: int,
+        token_counter: TokenCounter,
+    ):
+        self.llm = llm
+        self.prompt_template = prompt_template
+        self.file_template = file_template
+        self.max_tokens = max_tokens
+        self.max_history_tokens = max_history_tokens
+        self.recent_messages = recent_messages
+        self.summary_tokens = summary_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.token_counter = token_counter
+        self._summaries = LRUCache(MAX_SUMMARIES)
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+
+    def _latest_summary(self, older: List[BaseMessage], keys: List[str]) -> Tuple[int, Optional[str]]:
+        for n in range(len(older), 0, -1):
+            summary = self._summaries.get(keys[n])
+            if summary is not None:
+                return n, summary
+        return 0, None
+
+    def _summary_message(self, summary: Optional[str]) -> List[BaseMessage]:
+        return [SystemMessage(f"Summary of the earlier conversation:\n{summary}")] if summary else []
+
+    def _window_start(self, messages: List[BaseMessage], budget: int) -> int:
+        # The oldest message that is sent. Dropping one message per turn would change the start of the
+        # prompt every turn and with it Ollama's KV cache, so the start only moves to anchors about half
+        # a budget apart: the whole history prefix stays the same for several turns.
+        tokens = [self.token_counter.count_messages([message]) for message in messages]
+        fits = len(messages)
+        while fits > 0 and tokens[fits - 1] <= budget:
+            fits -= 1
+            budget -= tokens[fits]
+        if fits == 0:
+            return 0
+        step = max(1, self.max_history_tokens // 2)
+        before = list(accumulate(tokens, initial=0))
+        for position in range(fits, len(messages)):
+            if before[position] // step > before[position - 1] // step:
+                return position
+        return fits
+
+    def _select_history(self, chat_history: List[BaseMessage]) -> Tuple[List[BaseMessage], List[BaseMessage], int]:
+        split = max(0, len(chat_history) - self.recent_messages)
+        older = chat_history[:split]
+        covered, summary = self._latest_summary(older, _prefix_keys(older))
+        summary_messages = self._summary_message(summary)
+        budget = self.max_history_tokens - self.token_counter.count_messages(summary_messages)
+        # Whatever does not fit is left out until the summary covers it
+        messages = chat_history[covered:]
+        selected = messages[self._window_start(messages, budget) :]
+        if messages and not selected and budget > MESSAGE_OVERHEAD_TOKENS:
+            content = self.token_counter.truncate(messages[-1].content, budget - MESSAGE_OVERHEAD_TOKENS)
+            selected = [messages[-1].model_copy(update={"content": content})]
+        return summary_messages, selected, covered
+
+    def _format(self, document: Document, content: str) -> str:
+        return self.file_template.format(name=document.metadata["source"], content=content)
+
+    def _select_context(self, context: List[Document], budget: int) -> Tuple[List[Document], int]:
+        selected: List[Document] = []
+        # Whitespace is only normalized to spot an excerpt contained in another; the prompt gets the original
+        seen: List[str] = []
+        for document in context:
+            normalized = _normalize_whitespace(document.page_content)
+            if any(normalized in other for other in seen):
+                continue
+            seen.append(normalized)
+            text = document.page_content
+            for other in selected:
+                if other.metadata["source"] == document.metadata["source"]:
+                    text = _strip_overlap(other.page_content, text)
+            tokens = self.token_counter.count(self._format(document, text)) + 2
+            if tokens > budget:
+                if budget >= self.min_chunk_tokens:
+                    overhead = self.token_counter.count(self._format(document, "")) + 2
+                    text = self.token_counter.truncate(text, budget - overhead)
+                    selected.append(Document(id=document.id, page_content=text, metadata=document.metadata))
+                break
+            selected.append(Document(id=document.id, page_content=text, metadata=document.metadata))
+            budget -= tokens
+        return selected, budget
+
+    def _render(self, question: str, context: List[Document], summary: List[BaseMessage], history: List[BaseMessage]) -> List[BaseMessage]:
+        return self.prompt_template.invoke(
+            {
+                "question": question,
+                "context": "\n\n".join(self._format(document, document.page_content) for document in context),
+                "history_summary": summary,
+                "chat_history": history,
+            }
+        ).to_messages()
+
+    def prefix(self, chat_history: List[BaseMessage]) -> List[BaseMessage]:
+        # The messages in front of the excerpts and the question, the same as assemble() sends them
+        summary, history, _ = self._select_history(chat_history)
+        return self._render("", [], summary, history)[:-1]
+
+    def assemble(self, question: str, chat_history: List[BaseMessage], context: List[Document]) -> AssembledPrompt:
+        summary, history, covered = self._select_history(chat_history)
+        fixed_tokens = self.token_counter.count_messages(self._render(question, [], summary, history))
+        selected, _ = self._select_context(context, self.max_tokens - fixed_tokens)
+        messages = self._render(question, selected, summary, history)
+        prompt_tokens = self.token_counter.count_messages(messages)
+        history_tokens = self.token_counter.count_messages(summary + history)
+        return AssembledPrompt(
+            messages=messages,
+            context=selected,
+            prompt_tokens=prompt_tokens,
+            history_tokens=history_tokens,
+            context_tokens=prompt_tokens - fixed_tokens,
+            attributes={
+                "summarized_messages": covered,
+                "history_messages": len(history),
+                "omitted_messages": len(chat_history) - covered - len(history),
+                "context_chunks": len(selected),
+                "dropped_chunks": len(context) - len(selected),
+            },
+        )
+
+    def compact(self, chat_history: List[BaseMessage]):
+        # Older messages are folded into the summary once they take half of the history budget.
+        # This runs after an answer, so the next question does not wait for the summary.
+        older = chat_history[: max(0, len(chat_history) - self.recent_messages)]
+        keys = _prefix_keys(older)
+        covered, summary = self._latest_summary(older, keys)
+        if self.token_counter.count_messages(older[covered:]) <= self.max_history_tokens // 2:
+            return
+        with self._lock:
+            if keys[-1] in self._pending:
+                return
+            self._pending.add(keys[-1])
+        self._executor.submit(self._summarize, summary, older[covered:], keys[-1])
+
+    def _summarize(self, summary: Optional[str], messages: List[BaseMessage], key: str):
+        try:
+            with span("history_summary", messages=len(messages)) as attributes:
+                response = self.llm.invoke(
+                    SUMMARY_PROMPT.invoke(
+                        {
+                            "summary": summary or "The conversation just started.",
+                            "messages": "\n".join(f"{message.type}: {message.content}" for message in messages),
+                            "words": int(self.summary_tokens * 0.75),
+                        }
+                    )
+                )
+                attributes.update(count_llm_tokens(response.usage_metadata, getattr(self.llm, "model", ""), "summarize"))
+            content = response.content.split("</think>")[-1].strip()
+            self._summaries.put(key, self.token_counter.truncate(content, self.summary_tokens))
+        except Exception as error:
+            logger.warning(f"Could not summarize the chat history: {error}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
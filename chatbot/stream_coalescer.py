@@ -0,0 +1,95 @@
+import time
+from typing import Callable, List
+
+THINK_START = "<think>"
+THINK_END = "</think>"
+
+
+class ThinkingFilter:
+    # Drops a leading <think>...</think> block from a token stream as it arrives. Tags may be split
+    # across tokens, so text that could still be the start of a tag is held back until it is decided.
+    # Like remove_thinking, whitespace in front of the answer is dropped too.
+    def __init__(self):
+        self._buffer = ""
+        self._state = "start"
+
+    def feed(self, text: str) -> str:
+        if self._state == "answer":
+            return text
+        self._buffer += text
+        if self._state == "start":
+            stripped = self._buffer.lstrip()
+            if stripped.startswith(THINK_START):
+                self._buffer = stripped[len(THINK_START) :]
+                self._state = "thinking"
+            elif THINK_START.startswith(stripped):
+                return ""
+            else:
+                return self._answer(stripped)
+        if self._state == "thinking":
+            end = self._buffer.find(THINK_END)
+            if end < 0:
+                # Only a tag cut off at the end of the buffer matters
+                self._buffer = self._buffer[-(len(THINK_END) - 1) :]
+                return ""
+            self._buffer = self._buffer[end + len(THINK_END) :]
+            self._state = "after_thinking"
+        stripped = self._buffer.lstrip()
+        return self._answer(stripped) if stripped else ""
+
+    def _answer(self, text: str) -> str:
+        self._buffer = ""
+        self._state = "answer"
+        return text
+
+    def finish(self) -> str:
+        # A lone prefix of <think> was answer text after all; an unclosed thinking block is dropped
+        text = self._buffer.lstrip() if self._state == "start" else ""
+        self._buffer = ""
+        return text
+
+
+class CoalescedStream:
+    # Collects streamed text and releases it in pieces at most every flush_seconds or once flush_chars
+    # have piled up, instead of one piece per token. The first visible text is released straight away,
+    # so coalescing never delays the first token. Time is checked when text arrives, so a piece waits
+    # at most flush_seconds plus the gap to the next token.
+    def __init__(
+        self,
+        flush_seconds: float,
+        flush_chars: int,
+        filter_thinking: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.flush_seconds = flush_seconds
+        self.flush_chars = flush_chars
+        self.clock = clock
+        self._filter = ThinkingFilter() if filter_thinking else None
+        self._parts: List[str] = []
+        self._size = 0
+        self._flushed = False
+        self._last_flush = clock()
+
+    def push(self, text: str) -> str:
+        # Returns the text to show now, empty while it is being held back
+        if self._filter is not None:
+            text = self._filter.feed(text)
+        if text:
+            self._parts.append(text)
+            self._size += len(text)
+        if not self._size:
+            return ""
+        if not self._flushed or self._size >= self.flush_chars or self.clock() - self._last_flush >= self.flush_seconds:
+            return self.flush()
+        return ""
+
+    def flush(self, final: bool = False) -> str:
+        if final and self._filter is not None:
+            self._parts.append(self._filter.finish())
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        if text:
+            self._flushed = True
+            self._last_flush = self.clock()
+        return text
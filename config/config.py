@@ -11,6 +11,7 @@ class Config:
         # NAME = "deepseek-r1:1.5b"
         NAME = "gemma3:1b"
         TEMPERATURE = 0.6
+        CONTEXT_WINDOW = 4096           # num_ctx Ollama loads the model with; the prompt budget leaves room for the answer
 
     class Preprocessing:
         CHUNK_SIZE = 2048
@@ -18,13 +19,100 @@ class Config:
         # EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"      
         EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"      
         RERANKER = "ms-marco-MiniLM-L-12-v2"       
+        VECTOR_DTYPE = "float32"        # float32, float16 or int8 storage for the local vector store
+        EMBEDDING_BATCH_SIZE = 256      # Chunks per batch of the streaming embedding stage; bounds the vectors held at once
+        EMBEDDING_WORKERS = min(4, os.cpu_count() or 1)     # Processes embedding large corpora, each with its own copy of the model
+        EMBEDDING_THREADS = max(1, (os.cpu_count() or 1) // EMBEDDING_WORKERS)      # ONNX threads per worker, so workers do not oversubscribe the cores
+        EMBEDDING_PARALLEL_MIN_CHUNKS = 2048    # Fewer chunks are embedded in-process, where the model is loaded already
         LLM = "llama3.2"
         CONTEXUALIZE_CHUNKS = True
+        CONTEXT_CONCURRENCY = 8         # Parallel contextualization requests; Ollama serves OLLAMA_NUM_PARALLEL at a time
+        CONTEXT_MAX_RETRIES = 3
+        CONTEXT_STRATEGY = "full_document"      # full_document, summary_window or prefix_cached, see data_ingestor/contextualizer.py
+        CONTEXT_NEIGHBOR_CHARS = 1000           # Text on each side of the chunk sent with the document summary by summary_window
+        CONTEXT_CACHE_SLOTS = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))     # Ollama KV cache slots, prefix_cached keeps one document in each
+        CONTEXT_SUMMARY_WORDS = 150
+        CONTEXT_SECTION_CHARS = 12_000          # Longest text summary_window and prefix_cached send at once, about 3k tokens for a 4k context
+        DEDUPLICATE = True              # Near-duplicate chunks are contextualized and indexed once, see data_ingestor/deduplicator.py
+        DEDUP_THRESHOLD = 0.85          # Estimated Jaccard similarity of the chunks' word shingles above which they count as one
+        DEDUP_NUM_PERM = 128            # MinHash signature length; longer is more precise and slower
+        DEDUP_SHINGLE_WORDS = 5
         N_SEMENTIC_RESULTS = 5
         N_BM25_RESULTS = 5
 
+    class ANN:
+        # IVF-PQ index of the "IVF-PQ" backend, see data_ingestor/ivfpq_vector_store.py
+        LISTS = 1024                    # IVF cells; around 4 * sqrt(chunks) suits most corpora
+        SUBVECTORS = 48                 # PQ bytes per vector; rounded down to a divisor of the embedding dimension
+        PROBES = 16                     # Cells scanned per query; more finds more of the true neighbours, slower
+        REFINE_FACTOR = 16              # Candidates per requested result re-scored exactly from the stored vectors
+        MIN_TRAIN_ROWS = 20_000         # Smaller stores are searched exhaustively
+        TRAIN_SAMPLE_ROWS = 50_000      # Vectors the cell centroids are trained on
+        PQ_TRAIN_ROWS = 20_000          # Vectors the PQ codebooks are trained on
+        KMEANS_ITERATIONS = 10
+        RETRAIN_GROWTH = 4              # Retrain once the store has grown this many times since training
+
     class Chatbot:
         N_CONTEXT_RESULTS = 3
+        RETRIEVAL_THREADS = 8           # Shared pool the hybrid retriever fans its backends out on
+        ANSWER_CACHE_ENABLED = False
+        ANSWER_CACHE_THRESHOLD = 0.95           # Cosine similarity between questions for a cache hit
+        ANSWER_CACHE_TTL_SECONDS = 24 * 60 * 60
+        ANSWER_CACHE_MAX_ENTRIES = 1000
+        ANSWER_CACHE_PERSIST = False            # Keep cached answers on disk across restarts
+        PREFILL_WARMUP = True           # Prefill the system prompt and history on Ollama while retrieval runs
+        STREAM_FLUSH_MS = 100           # Coalesced streams release text at most this often...
+        STREAM_FLUSH_CHARS = 400        # ...or once this much has piled up
+
+    class Prompt:
+        MAX_TOKENS = 3072               # Budget for the whole prompt: instructions, history summary, history, excerpts and question
+        MAX_HISTORY_TOKENS = 1024
+        RECENT_MESSAGES = 4             # Latest messages always sent verbatim, budget permitting
+        SUMMARY_TOKENS = 256            # Length of the running summary of older messages
+        MIN_CHUNK_TOKENS = 64           # A trimmed excerpt shorter than this is dropped instead
+        CHARS_PER_TOKEN = 4.0           # Initial estimate, corrected with the token counts Ollama reports
+
+    class Reranker:
+        MAX_TOKENS = 256                # Query and passage pairs are truncated to this many tokens
+        MAX_BATCH_PAIRS = 64            # Pairs scored together across concurrent requests
+        BATCH_WAIT_MS = 5               # Time the first request waits for others to join its batch
+        MAX_CANDIDATES = 8              # Cap on passages scored per query, after each retriever's top hits are pooled
+
+    class Models:
+        WARMUP = True                   # Load the embedding model and reranker at startup and run one dummy inference
+
+    class Server:
+        HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+        PORT = int(os.getenv("SERVER_PORT", "8080"))
+        BACKEND = os.getenv("SERVER_BACKEND", "InMemory")     # InMemory, IVF-PQ or Pinecone, shared by every session
+        MAX_CONCURRENT_ASKS = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))     # Answers generated at once, one per Ollama slot
+        MAX_QUEUED_ASKS = 32            # Questions waiting for a slot; further ones are rejected with 503
+        QUEUE_TIMEOUT_SECONDS = 30      # A question still waiting after this is rejected with 503
+        MAX_SESSIONS = 1000             # Least recently used sessions are dropped above this
+        SESSION_TTL_SECONDS = 60 * 60   # Idle sessions are dropped after this
+        MAX_UPLOAD_MB = 100             # Per /files request; larger uploads are rejected with 413
+
+    class BatchQA:
+        BATCH_SIZE = 256                # Questions embedded, searched and reranked together
+        CONCURRENCY = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))     # Answers generated at once
+        RETRIEVAL_CONCURRENCY = 8       # Parallel queries for backends that cannot search a batch, e.g. Pinecone
+
+    class FileLoader:
+        PDF_WORKERS = min(4, os.cpu_count() or 1)
+        PDF_PARALLEL_MIN_PAGES = 64         # Smaller PDFs are extracted in-process
+        PDF_PAGES_PER_TASK = 32
+
+    class Cache:
+        ENABLED = True
+        MAX_SIZE_MB = 1024          # Least recently used entries are evicted above this size
+        MAX_INDEXES = 8             # Saved local vector indexes kept on disk
+        QUERY_EMBEDDINGS_MAX_ENTRIES = 1024
+        RETRIEVAL_RESULTS_MAX_ENTRIES = 256     # Reranked results per normalized query, cleared when the corpus changes
+
+    class Instrumentation:
+        JSON_LOG_FILE = os.getenv("INSTRUMENTATION_LOG_FILE")        # Stage spans as loguru JSON lines
+        METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))          # Prometheus /metrics endpoint, 0 disables it
+        METRICS_FILE = os.getenv("METRICS_FILE")                    # Prometheus text file, e.g. for node_exporter
 
     class VectorDB:
         PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
@@ -32,10 +120,18 @@ class Config:
         PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
         PINECONE_EMBEDDING_DIMENSION = os.getenv("-PINECONE_EMBEDDING_DIMENSION")
         PINECONE_NAMESPACE = os.getenv("PINECONE_NAMESPACE")
+        UPSERT_BATCH_SIZE = 200                     # Vectors per upsert request
+        UPSERT_MAX_REQUEST_BYTES = 2_000_000        # Pinecone rejects upsert requests above 2 MB
+        UPSERT_CONCURRENCY = 8                      # Upsert requests in flight over the pooled client
+        HYBRID_SEARCH = False                       # Sparse-dense queries on the index instead of a local BM25 index; needs a dotproduct index
+        HYBRID_ALPHA = 0.6                          # Weight of the dense side, the sparse side gets 1 - alpha
+        SPARSE_AVERAGE_TOKENS = 350                 # Expected chunk length in tokens for the BM25 length normalization
 
     class Path:
         APP_HOME = Path(os.getenv("APP_HOME", Path(__file__).parent.parent))      # Path to the root of the project
         DATA_DIR = APP_HOME / "data"                                              # Path to the data directory
+        CACHE_DIR = DATA_DIR / "cache"                                            # Path to the ingestion cache
+        INDEX_DIR = DATA_DIR / "index"                                            # Path to the saved local vector indexes
 
 def configure_logging():
     config = {
@@ -0,0 +1,43 @@
+import importlib
+from dataclasses import dataclass
+from types import ModuleType
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.retrievers import BaseRetriever
+
+    from file_loader.file_loader import File
+
+# Vector store backends and the ingestor module implementing each, imported when first used
+BACKEND_MODULES = {
+    "InMemory": "data_ingestor.data_ingestor",
+    "IVF-PQ": "data_ingestor.ivfpq_data_ingestor",
+    "Pinecone": "data_ingestor.pinecone_data_ingestor",
+}
+DEFAULT_BACKEND = "InMemory"
+
+
+@dataclass
+class Backend:
+    # Functions are looked up on the module at call time, so benchmarks can swap them for stand-ins
+    name: str
+    module: ModuleType
+
+    def ingest_files(self, files: List["File"]) -> "BaseRetriever":
+        return self.module.ingest_files(files)
+
+    def add_files(self, retriever: "BaseRetriever", files: List["File"]):
+        self.module.add_files(retriever, files)
+
+    def remove_files(self, retriever: "BaseRetriever", file_names: List[str]):
+        self.module.remove_files(retriever, file_names)
+
+    def create_embeddings(self) -> "Embeddings":
+        return self.module.create_embeddings()
+
+
+def create_backend(name: str = DEFAULT_BACKEND) -> Backend:
+    if name not in BACKEND_MODULES:
+        raise ValueError(f"Invalid vector store backend: {name}")
+    return Backend(name=name, module=importlib.import_module(BACKEND_MODULES[name]))
@@ -0,0 +1,94 @@
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from langchain.retrievers import ContextualCompressionRetriever
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
+
+from data_ingestor.bm25_index import BM25IndexRetriever
+from data_ingestor.hybrid_retriever import HybridRetriever
+from data_ingestor.numpy_vector_store import NumpyVectorStore
+from data_ingestor.reranker import ServiceReranker
+from data_ingestor.retrieval_cache import CachedRetriever, embed_query_batch
+from instrumentation.instrumentation import span
+
+
+@dataclass
+class BatchRetrieval:
+    documents: List[List[Document]]
+    # Wall time of each stage for the whole batch
+    seconds: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class _LocalPipeline:
+    vectorstore: NumpyVectorStore
+    vector_k: int
+    bm25: BM25IndexRetriever
+    hybrid: HybridRetriever
+    reranker: ServiceReranker
+
+
+def _local_pipeline(retriever: BaseRetriever) -> Optional[_LocalPipeline]:
+    # Only the InMemory backend keeps its indexes in this process, so only it is searched as a matrix
+    if isinstance(retriever, CachedRetriever):
+        retriever = retriever.retriever
+    if not isinstance(retriever, ContextualCompressionRetriever):
+        return None
+    hybrid, reranker = retriever.base_retriever, retriever.base_compressor
+    if not isinstance(hybrid, HybridRetriever) or not isinstance(reranker, ServiceReranker) or len(hybrid.retrievers) != 2:
+        return None
+    semantic, bm25 = hybrid.retrievers
+    if not isinstance(semantic, VectorStoreRetriever) or not isinstance(semantic.vectorstore, NumpyVectorStore):
+        return None
+    if not isinstance(bm25, BM25IndexRetriever):
+        return None
+    return _LocalPipeline(semantic.vectorstore, semantic.search_kwargs.get("k", 4), bm25, hybrid, reranker)
+
+@contextmanager
+def _timed(seconds: Dict[str, float], stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds[stage] = time.perf_counter() - start
+
+def _embed_queries(vectorstore: NumpyVectorStore, queries: List[str]) -> List[List[float]]:
+    embeddings = vectorstore.embedding
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(queries)
+    return embed_query_batch(embeddings, queries)
+
+def _retrieve_local(pipeline: _LocalPipeline, queries: List[str]) -> BatchRetrieval:
+    seconds: Dict[str, float] = {}
+    with _timed(seconds, "embed"):
+        vectors = _embed_queries(pipeline.vectorstore, queries)
+    with _timed(seconds, "vector_search"):
+        semantic = pipeline.vectorstore.similarity_search_with_score_by_vectors(vectors, pipeline.vector_k)
+    with _timed(seconds, "bm25"):
+        keyword = pipeline.bm25.index.search_batch(queries, pipeline.bm25.k)
+    with _timed(seconds, "fuse"):
+        fused = [
+            pipeline.hybrid.fuse([[doc for doc, _ in semantic_results], [doc for doc, _ in keyword_results]])
+            for semantic_results, keyword_results in zip(semantic, keyword)
+        ]
+    with _timed(seconds, "rerank"):
+        documents = pipeline.reranker.compress_documents_batch(fused, queries)
+    return BatchRetrieval(documents, seconds)
+
+def retrieve_batch(retriever: BaseRetriever, queries: List[str], max_concurrency: int = 8) -> BatchRetrieval:
+    # Embeds the queries in one batch, scores them against the vector store and the BM25 index as
+    # matrices and queues all of them on the reranker at once. Other backends fall back to concurrent
+    # retrieval of the individual queries.
+    with span("retrieve.batch", queries=len(queries)) as attributes:
+        pipeline = _local_pipeline(retriever)
+        attributes["vectorized"] = pipeline is not None
+        if pipeline is not None:
+            return _retrieve_local(pipeline, queries)
+        seconds: Dict[str, float] = {}
+        with _timed(seconds, "retrieve"):
+            documents = retriever.batch(queries, config={"max_concurrency": max_concurrency})
+        return BatchRetrieval(documents, seconds)
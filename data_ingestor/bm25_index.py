@@ -0,0 +1,299 @@
+import json
+import math
+import re
+import threading
+import uuid
+from array import array
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+TOKEN_PATTERN = re.compile(r"\w+")
+POSTINGS_FILE_NAME = "bm25.npz"
+DOCUMENTS_FILE_NAME = "bm25.json"
+COMPACTION_RATIO = 0.5          # Postings are rebuilt once half of the indexed documents are deleted
+MAX_SCORE_CELLS = 1 << 24       # Largest queries x documents score matrix of a batch search, 64 MB of float32
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    # Okapi BM25 over an inverted index. Each term owns two int32 arrays (document slots and term
+    # frequencies). Deleted documents keep their slot, masked out, until the postings are compacted.
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[Optional[str]] = []
+        self.documents: List[Optional[Document]] = []
+        self._slots: Dict[str, int] = {}
+        self._terms: Dict[str, int] = {}
+        self._postings_docs: List[array] = []
+        self._postings_tfs: List[array] = []
+        self._document_frequencies = array("i")
+        self._lengths = array("i")
+        self._alive = bytearray()
+        self._total_length = 0
+        # NumPy views over the postings block appends while a search runs, so access is serialized
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def live_documents(self) -> List[Document]:
+        return [self.documents[slot] for slot in self._slots.values()]
+
+    def _idf(self, document_frequency: int) -> float:
+        # Lucene's variant, never negative, so per-term score upper bounds stay valid
+        n = len(self._slots)
+        return math.log(1 + (n - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def add_documents(self, documents: Iterable[Document], ids: Optional[List[str]] = None) -> List[str]:
+        with self._lock:
+            return self._add_documents(list(documents), ids)
+
+    def _add_documents(self, documents: List[Document], ids: Optional[List[str]]) -> List[str]:
+        ids = list(ids) if ids else [doc.id or str(uuid.uuid4()) for doc in documents]
+        existing = [id for id in ids if id in self._slots]
+        if existing:
+            self._delete(existing)
+        if not documents:
+            return ids
+        # Collect (term, slot, tf) triples for the whole batch, then extend each term's postings once
+        terms = self._terms
+        term_ids, tfs, unique_terms, lengths = [], [], [], []
+        for document in documents:
+            frequencies = Counter(tokenize(document.page_content))
+            term_ids.extend([terms.setdefault(term, len(terms)) for term in frequencies])
+            tfs.extend(frequencies.values())
+            unique_terms.append(len(frequencies))
+            lengths.append(sum(frequencies.values()))
+        for _ in range(len(self._postings_docs), len(terms)):
+            self._postings_docs.append(array("i"))
+            self._postings_tfs.append(array("i"))
+            self._document_frequencies.append(0)
+
+        first_slot = len(self.ids)
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")
+        sorted_terms = term_ids[order]
+        sorted_slots = np.repeat(np.arange(first_slot, first_slot + len(documents), dtype=np.int32), unique_terms)[order]
+        sorted_tfs = np.asarray(tfs, dtype=np.int32)[order]
+        batch_terms, starts, counts = np.unique(sorted_terms, return_index=True, return_counts=True)
+        for term_id, start, count in zip(batch_terms.tolist(), starts.tolist(), counts.tolist()):
+            self._postings_docs[term_id].frombytes(sorted_slots[start : start + count].tobytes())
+            self._postings_tfs[term_id].frombytes(sorted_tfs[start : start + count].tobytes())
+            self._document_frequencies[term_id] += count
+
+        for slot, (id, document, length) in enumerate(zip(ids, documents, lengths), start=first_slot):
+            self.ids.append(id)
+            self.documents.append(Document(id=id, page_content=document.page_content, metadata=document.metadata))
+            self._slots[id] = slot
+        self._lengths.extend(lengths)
+        self._alive.extend(b"\x01" * len(documents))
+        self._total_length += sum(lengths)
+        return ids
+
+    def delete(self, ids: Iterable[str]) -> bool:
+        with self._lock:
+            return self._delete(ids)
+
+    def _delete(self, ids: Iterable[str]) -> bool:
+        deleted = False
+        for id in ids:
+            slot = self._slots.pop(id, None)
+            if slot is None:
+                continue
+            for term in set(tokenize(self.documents[slot].page_content)):
+                self._document_frequencies[self._terms[term]] -= 1
+            self._total_length -= self._lengths[slot]
+            self._alive[slot] = 0
+            self.ids[slot] = None
+            self.documents[slot] = None
+            deleted = True
+        if len(self.ids) and len(self._slots) < len(self.ids) * COMPACTION_RATIO:
+            self._compact()
+        return deleted
+
+    def _compact(self):
+        documents = self.live_documents
+        lock = self._lock
+        self.__init__(self.k1, self.b)
+        self._lock = lock
+        self._add_documents(documents, None)
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        docs = np.frombuffer(self._postings_docs[term_id], dtype=np.int32)
+        tfs = np.frombuffer(self._postings_tfs[term_id], dtype=np.int32)
+        return docs, tfs
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        with self._lock:
+            return self._search(query, k)
+
+    def _search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        if not self._slots or k <= 0:
+            return []
+        query_terms = [
+            (self._terms[term], count)
+            for term, count in Counter(tokenize(query)).items()
+            if term in self._terms and self._document_frequencies[self._terms[term]] > 0
+        ]
+        if not query_terms:
+            return []
+        # Term-at-a-time over the rarest terms first. Once no unseen document can beat the current
+        # k-th score with the remaining terms, those terms only update documents already seen.
+        weights = [(term_id, count * self._idf(self._document_frequencies[term_id])) for term_id, count in query_terms]
+        weights.sort(key=lambda weight: weight[1], reverse=True)
+        upper_bounds = [weight * (self.k1 + 1) for _, weight in weights]
+        alive = np.frombuffer(self._alive, dtype=np.bool_)
+        lengths = np.frombuffer(self._lengths, dtype=np.int32)
+        average_length = self._total_length / len(self._slots)
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        seen = np.zeros(len(self.ids), dtype=np.bool_)
+        candidates_closed = False
+        for i, (term_id, weight) in enumerate(weights):
+            docs, tfs = self._postings(term_id)
+            keep = seen[docs] if candidates_closed else alive[docs]
+            docs, tfs = docs[keep], tfs[keep]
+            norms = self.k1 * (1 - self.b + self.b * lengths[docs] / average_length)
+            scores[docs] += weight * tfs * (self.k1 + 1) / (tfs + norms)
+            seen[docs] = True
+            if not candidates_closed:
+                candidates = np.flatnonzero(seen)
+                if len(candidates) >= k:
+                    kth_score = np.partition(scores[candidates], len(candidates) - k)[len(candidates) - k]
+                    candidates_closed = kth_score > sum(upper_bounds[i + 1 :])
+        candidates = np.flatnonzero(seen)
+        k = min(k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.documents[slot], float(scores[slot])) for slot in top]
+
+    def search_batch(self, queries: List[str], k: int) -> List[List[Tuple[Document, float]]]:
+        with self._lock:
+            return self._search_batch(queries, k)
+
+    def _search_batch(self, queries: List[str], k: int) -> List[List[Tuple[Document, float]]]:
+        # Each posting list is read and length-normalized once for all the queries that contain its term,
+        # then added to a queries x documents score matrix
+        if not self._slots or k <= 0:
+            return [[] for _ in queries]
+        query_weights: Dict[int, List[Tuple[int, float]]] = defaultdict(list)
+        for i, query in enumerate(queries):
+            for term, count in Counter(tokenize(query)).items():
+                term_id = self._terms.get(term)
+                if term_id is not None and self._document_frequencies[term_id] > 0:
+                    query_weights[term_id].append((i, count * self._idf(self._document_frequencies[term_id])))
+        alive = np.frombuffer(self._alive, dtype=np.bool_)
+        lengths = np.frombuffer(self._lengths, dtype=np.int32)
+        average_length = self._total_length / len(self._slots)
+        contributions = {}
+        for term_id in query_weights:
+            docs, tfs = self._postings(term_id)
+            docs, tfs = docs[alive[docs]], tfs[alive[docs]]
+            norms = self.k1 * (1 - self.b + self.b * lengths[docs] / average_length)
+            contributions[term_id] = (docs, (tfs * (self.k1 + 1) / (tfs + norms)).astype(np.float32))
+        results = []
+        block = max(1, MAX_SCORE_CELLS // len(self.ids))
+        for start in range(0, len(queries), block):
+            scores = np.zeros((min(block, len(queries) - start), len(self.ids)), dtype=np.float32)
+            for term_id, weights in query_weights.items():
+                docs, contribution = contributions[term_id]
+                for i, weight in weights:
+                    if start <= i < start + block:
+                        scores[i - start, docs] += weight * contribution
+            for row in scores:
+                # Only documents sharing a term with the query score above zero
+                candidates = np.flatnonzero(row > 0)
+                n = min(k, len(candidates))
+                top = candidates[np.argpartition(-row[candidates], n - 1)[:n]] if n else candidates
+                top = top[np.argsort(-row[top], kind="stable")]
+                results.append([(self.documents[slot], float(row[slot])) for slot in top])
+        return results
+
+    def save(self, path: Path):
+        with self._lock:
+            self._save(path)
+
+    def _save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        slots = list(self._slots.values())
+        remap = np.full(len(self.ids), -1, dtype=np.int32)
+        remap[slots] = np.arange(len(slots), dtype=np.int32)
+        terms = sorted(self._terms, key=self._terms.get)
+        offsets, postings_docs, postings_tfs = [0], [], []
+        for term in terms:
+            docs, tfs = self._postings(self._terms[term])
+            keep = remap[docs] >= 0
+            postings_docs.append(remap[docs[keep]])
+            postings_tfs.append(tfs[keep])
+            offsets.append(offsets[-1] + int(keep.sum()))
+        np.savez(
+            path / POSTINGS_FILE_NAME,
+            offsets=np.asarray(offsets, dtype=np.int64),
+            docs=np.concatenate(postings_docs) if postings_docs else np.empty(0, np.int32),
+            tfs=np.concatenate(postings_tfs) if postings_tfs else np.empty(0, np.int32),
+            lengths=np.frombuffer(self._lengths, dtype=np.int32)[slots],
+        )
+        documents = [{"id": doc.id, "content": doc.page_content, "metadata": doc.metadata} for doc in self.live_documents]
+        (path / DOCUMENTS_FILE_NAME).write_text(
+            json.dumps({"k1": self.k1, "b": self.b, "terms": terms, "documents": documents})
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        data = json.loads((path / DOCUMENTS_FILE_NAME).read_text())
+        postings = np.load(path / POSTINGS_FILE_NAME)
+        index = cls(k1=data["k1"], b=data["b"])
+        offsets, docs, tfs = postings["offsets"], postings["docs"], postings["tfs"]
+        for term_id, term in enumerate(data["terms"]):
+            start, end = offsets[term_id], offsets[term_id + 1]
+            index._terms[term] = term_id
+            index._postings_docs.append(array("i", docs[start:end].astype(np.int32).tobytes()))
+            index._postings_tfs.append(array("i", tfs[start:end].astype(np.int32).tobytes()))
+            index._document_frequencies.append(int(end - start))
+        index._lengths = array("i", postings["lengths"].astype(np.int32).tobytes())
+        index._total_length = int(postings["lengths"].sum())
+        for slot, document in enumerate(data["documents"]):
+            index.ids.append(document["id"])
+            index.documents.append(Document(id=document["id"], page_content=document["content"], metadata=document["metadata"]))
+            index._slots[document["id"]] = slot
+            index._alive.append(1)
+        return index
+
+
+class BM25IndexRetriever(BaseRetriever):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: BM25Index
+    k: int = 4
+
+    @property
+    def docs(self) -> List[Document]:
+        return self.index.live_documents
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document], **kwargs: Any) -> "BM25IndexRetriever":
+        index = BM25Index()
+        index.add_documents(documents)
+        return cls(index=index, **kwargs)
+
+    def add_documents(self, documents: List[Document]) -> List[str]:
+        return self.index.add_documents(documents)
+
+    def delete(self, ids: List[str]) -> bool:
+        return self.index.delete(ids)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [doc for doc, _ in self.index.search(query, self.k)]
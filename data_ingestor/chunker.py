@@ -0,0 +1,70 @@
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config.config import Config
+from data_ingestor.contextualizer import contextualize_chunks
+from data_ingestor.deduplicator import duplicate_chunks
+from file_loader.file_loader import File
+from instrumentation.instrumentation import count, span
+
+
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size = Config.Preprocessing.CHUNK_SIZE,
+    chunk_overlap = Config.Preprocessing.CHUNK_OVERLAP,
+)
+
+
+def split_file(file: File) -> List[Document]:
+    # Pages are fed to the splitter one at a time. The last chunk of a page is held back and split again
+    # with the next page, so chunks still cross page breaks as when the whole text was split at once.
+    # Every chunk keeps the page it starts on.
+    chunks: List[Document] = []
+    carry = ""
+    carry_pages: List[Tuple[int, int]] = []        # (offset in carry, page number) where each page starts
+    for page in file.pages:
+        text = f"{carry}\n{page.content}" if carry else page.content
+        pages = [*carry_pages, (len(text) - len(page.content), page.number)]
+        offsets = [offset for offset, _ in pages]
+        pieces = text_splitter.split_text(text)
+        if not pieces:
+            carry, carry_pages = "", []
+            continue
+        start = 0
+        for piece in pieces[:-1]:
+            start = text.find(piece, start)
+            chunks.append(Document(piece, metadata={"source": file.name, "page": pages[bisect_right(offsets, start) - 1][1]}))
+            start += 1
+        start = text.find(pieces[-1], start)
+        first = bisect_right(offsets, start) - 1
+        carry = text[start:]
+        carry_pages = [(max(0, offset - start), number) for offset, number in pages[first:]]
+    if carry:
+        chunks.append(Document(carry.strip(), metadata={"source": file.name, "page": carry_pages[0][1]}))
+    return chunks
+
+def _duplicates_within_files(chunks: List[List[Document]]) -> Dict[Tuple[int, int], Tuple[int, int]]:
+    return {
+        (i, j): (i, canonical)
+        for i, file_chunks in enumerate(chunks)
+        for (_, j), (_, canonical) in duplicate_chunks([file_chunks]).items()
+    }
+
+def create_chunks(files: List[File]) -> List[List[Document]]:
+    with span("ingest.split", files=len(files)) as attributes:
+        chunks = [split_file(file) for file in files]
+        attributes["chunks"] = sum(len(file_chunks) for file_chunks in chunks)
+    if not Config.Preprocessing.CONTEXUALIZE_CHUNKS:
+        return chunks
+    documents = [Document(file.content, metadata={"source": file.name}) for file in files]
+    # Every file keeps all of its chunks, since the chunks are cached per file, but near-duplicates
+    # within a file only cost one LLM call. Duplicates across files are contextualized on their own,
+    # so a file's cached chunks do not depend on the files ingested with it; they are dropped from
+    # the index later, see deduplicate_chunks.
+    duplicates = _duplicates_within_files(chunks) if Config.Preprocessing.DEDUPLICATE else {}
+    if duplicates:
+        count("ingest_duplicate_context_calls", len(duplicates))
+    with span("ingest.contextualize", chunks=attributes["chunks"], skipped_duplicates=len(duplicates)):
+        return contextualize_chunks(documents, chunks, duplicates=duplicates)
@@ -0,0 +1,293 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.documents import Document
+from langchain_ollama import ChatOllama
+from loguru import logger
+
+from config.config import Config
+from instrumentation.instrumentation import count_llm_tokens
+from model_registry.model_registry import get_chat_model
+
+
+CONTEXT_PROMPT = ChatPromptTemplate.from_template(
+    """
+You're an expert in document analysis. Your task is to provide brief, relevant context for a chunk of the text from the given document.
+
+Here is the document:
+<document>
+{document}
+</document>
+
+Here is the chunk:
+<chunk>
+{chunk}
+</chunk>
+
+Provide a concise context (2-3 sentences) for this chunk, considering the following guidelines:
+1. Identify the main topic or concept discussed in the chunk.
+2. mention any relevent information or comparisons from broader document context.
+3. If applicable, note how this info relates to the overall theme or purpose of the document.
+4. Include any key figures, dates or percentages that provide important context.
+5. Do not use phrases like "This chunk discisses" or "This section provides". Instead, directly state the main topic or concept.
+
+Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk.
+
+Context:
+    """.strip()
+)
+
+WINDOW_CONTEXT_PROMPT = ChatPromptTemplate.from_template(
+    """
+You're an expert in document analysis. Your task is to provide brief, relevant context for a chunk of the text from the given document.
+
+Here is a summary of the document:
+<summary>
+{summary}
+</summary>
+
+Here is the text around the chunk:
+<surrounding_text>
+{surrounding_text}
+</surrounding_text>
+
+Here is the chunk:
+<chunk>
+{chunk}
+</chunk>
+
+Provide a concise context (2-3 sentences) for this chunk, considering the following guidelines:
+1. Identify the main topic or concept discussed in the chunk.
+2. mention any relevent information or comparisons from broader document context.
+3. If applicable, note how this info relates to the overall theme or purpose of the document.
+4. Include any key figures, dates or percentages that provide important context.
+5. Do not use phrases like "This chunk discisses" or "This section provides". Instead, directly state the main topic or concept.
+
+Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk.
+
+Context:
+    """.strip()
+)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+    """
+Summarize the text below in at most {words} words. Name the main topics and keep key figures, dates and percentages.
+
+<text>
+{text}
+</text>
+
+Summary:
+    """.strip()
+)
+
+FULL_DOCUMENT = "full_document"
+SUMMARY_WINDOW = "summary_window"
+PREFIX_CACHED = "prefix_cached"
+CONTEXT_STRATEGIES = (FULL_DOCUMENT, SUMMARY_WINDOW, PREFIX_CACHED)
+CONTEXT_PROMPTS = (CONTEXT_PROMPT, WINDOW_CONTEXT_PROMPT, SUMMARY_PROMPT)
+
+CONTEXT_CHARS_KEY = "context_chars"     # Metadata field with the length of the context in front of the chunk
+PROGRESS_LOG_INTERVAL = 0.1     # Log progress every 10% of the chunks
+
+
+def create_llm() -> ChatOllama:
+    return get_chat_model(
+        Config.Preprocessing.LLM,
+        temperature=0,
+        keep_alive=-1,
+    )
+
+def _log_progress(done: int, total: int):
+    step = max(1, int(total * PROGRESS_LOG_INTERVAL))
+    if done % step == 0 or done == total:
+        logger.info(f"Contextualized {done}/{total} chunks")
+
+def _with_retry(prompt: ChatPromptTemplate, llm: ChatOllama):
+    return prompt | llm.with_retry(stop_after_attempt=Config.Preprocessing.CONTEXT_MAX_RETRIES)
+
+def _generate(
+    prompt: ChatPromptTemplate,
+    llm: ChatOllama,
+    inputs: List[dict],
+    on_done: Callable[[int, int], None] = lambda done, total: None,
+) -> List[str]:
+    # Requests go through one bounded pool in any order, so slow ones overlap with the rest
+    results = [None] * len(inputs)
+    responses = _with_retry(prompt, llm).batch_as_completed(
+        inputs,
+        config={"max_concurrency": Config.Preprocessing.CONTEXT_CONCURRENCY},
+    )
+    for done, (index, response) in enumerate(responses, start=1):
+        results[index] = response.content
+        count_llm_tokens(response.usage_metadata, Config.Preprocessing.LLM, "contextualize")
+        on_done(done, len(inputs))
+    return results
+
+def _split_sections(text: str, section_chars: int) -> List[str]:
+    sections = []
+    while len(text) > section_chars:
+        cut = text.rfind(" ", 0, section_chars)
+        cut = cut if cut > 0 else section_chars
+        sections.append(text[:cut])
+        text = text[cut:].lstrip()
+    return sections + [text]
+
+def _group_summaries(summaries: List[str], group_chars: int) -> List[List[str]]:
+    # Consecutive summaries that fit in one request together. A group takes at least two, so every
+    # round of combining at least halves the count even when the model writes long summaries.
+    groups: List[List[str]] = []
+    for summary in summaries:
+        if groups and (len(groups[-1]) < 2 or len("\n\n".join([*groups[-1], summary])) <= group_chars):
+            groups[-1].append(summary)
+        else:
+            groups.append([summary])
+    return groups
+
+def summarize_documents(documents: List[Document], llm: ChatOllama) -> List[str]:
+    # Documents longer than one section are summarized per section first, and the section summaries are
+    # combined a section's worth at a time until one is left, so no request exceeds the model context
+    # however large the file is. Each round sends the requests of all documents together.
+    words = Config.Preprocessing.CONTEXT_SUMMARY_WORDS
+    section_chars = Config.Preprocessing.CONTEXT_SECTION_CHARS
+    sections = [_split_sections(document.page_content, section_chars) for document in documents]
+    jobs = [(i, section) for i, document_sections in enumerate(sections) for section in document_sections]
+    summaries = _generate(SUMMARY_PROMPT, llm, [{"text": section, "words": words} for _, section in jobs])
+    section_summaries: List[List[str]] = [[] for _ in documents]
+    for (i, _), summary in zip(jobs, summaries):
+        section_summaries[i].append(summary)
+    while any(len(document_summaries) > 1 for document_summaries in section_summaries):
+        groups = [
+            (i, group)
+            for i, document_summaries in enumerate(section_summaries)
+            if len(document_summaries) > 1
+            for group in _group_summaries(document_summaries, section_chars)
+        ]
+        combine = [k for k, (_, group) in enumerate(groups) if len(group) > 1]
+        combined = _generate(SUMMARY_PROMPT, llm, [{"text": "\n\n".join(groups[k][1]), "words": words} for k in combine])
+        next_summaries = [group[0] for _, group in groups]
+        for k, summary in zip(combine, combined):
+            next_summaries[k] = summary
+        for i in {i for i, _ in groups}:
+            section_summaries[i] = []
+        for (i, _), summary in zip(groups, next_summaries):
+            section_summaries[i].append(summary)
+    return [document_summaries[0] for document_summaries in section_summaries]
+
+def _surrounding_text(document_chunks: List[Document], j: int) -> str:
+    # The end of the previous chunk and the start of the next one
+    n_chars = Config.Preprocessing.CONTEXT_NEIGHBOR_CHARS
+    before = document_chunks[j - 1].page_content[-n_chars:] if j > 0 else ""
+    after = document_chunks[j + 1].page_content[:n_chars] if j + 1 < len(document_chunks) else ""
+    return f"{before}\n\n[...]\n\n{after}".strip()
+
+def _summary_window_contexts(
+    documents: List[Document],
+    chunks: List[List[Document]],
+    jobs: List[Tuple[int, int]],
+    llm: ChatOllama,
+    on_progress: Callable[[int, int], None],
+) -> Dict[Tuple[int, int], str]:
+    # One summary per document plus the chunk's neighbours replace the whole document in every prompt.
+    # Documents without a chunk to contextualize are not summarized.
+    needed = sorted({i for i, _ in jobs})
+    summaries = dict(zip(needed, summarize_documents([documents[i] for i in needed], llm)))
+    contexts = _generate(
+        WINDOW_CONTEXT_PROMPT,
+        llm,
+        [
+            {"summary": summaries[i], "surrounding_text": _surrounding_text(chunks[i], j), "chunk": chunks[i][j].page_content}
+            for i, j in jobs
+        ],
+        on_progress,
+    )
+    return dict(zip(jobs, contexts))
+
+def _full_document_contexts(
+    documents: List[Document],
+    chunks: List[List[Document]],
+    jobs: List[Tuple[int, int]],
+    llm: ChatOllama,
+    on_progress: Callable[[int, int], None],
+) -> Dict[Tuple[int, int], str]:
+    contexts = _generate(
+        CONTEXT_PROMPT,
+        llm,
+        [{"document": documents[i].page_content, "chunk": chunks[i][j].page_content} for i, j in jobs],
+        on_progress,
+    )
+    return dict(zip(jobs, contexts))
+
+def _prefix_cached_contexts(
+    documents: List[Document],
+    chunks: List[List[Document]],
+    jobs: List[Tuple[int, int]],
+    llm: ChatOllama,
+    on_progress: Callable[[int, int], None],
+) -> Dict[Tuple[int, int], str]:
+    # Every prompt starts with the whole document. One worker per Ollama slot sends all chunks of a
+    # document in turn, so its slot keeps the document in the KV cache and only prefills the chunk and
+    # the instructions after it. Documents are taken largest first; the ones too large for the model
+    # context use the summary window instead.
+    pending: Dict[int, List[int]] = {}
+    for i, j in jobs:
+        pending.setdefault(i, []).append(j)
+    large = {i for i in pending if len(documents[i].page_content) > Config.Preprocessing.CONTEXT_SECTION_CHARS}
+    contexts = {}
+    if large:
+        windowed_jobs = [(i, j) for i, j in jobs if i in large]
+        contexts.update(_summary_window_contexts(documents, chunks, windowed_jobs, llm, lambda done, total: None))
+    total = len(jobs)
+    done = len(contexts)
+    lock = threading.Lock()
+    chain = _with_retry(CONTEXT_PROMPT, llm)
+
+    def contextualize_document(i: int):
+        nonlocal done
+        for j in pending[i]:
+            response = chain.invoke({"document": documents[i].page_content, "chunk": chunks[i][j].page_content})
+            count_llm_tokens(response.usage_metadata, Config.Preprocessing.LLM, "contextualize")
+            with lock:
+                contexts[(i, j)] = response.content
+                done += 1
+                on_progress(done, total)
+
+    order = sorted(set(pending) - large, key=lambda i: -len(documents[i].page_content))
+    with ThreadPoolExecutor(max_workers=Config.Preprocessing.CONTEXT_CACHE_SLOTS, thread_name_prefix="contextualize") as executor:
+        list(executor.map(contextualize_document, order))
+    return contexts
+
+def _with_context(context: str, chunk: Document) -> Document:
+    # The length of the context is kept, so the chunk text can be compared without it, see deduplicator
+    prefix = f"{context} \n\n "
+    return Document(page_content=prefix + chunk.page_content, metadata={**chunk.metadata, CONTEXT_CHARS_KEY: len(prefix)})
+
+def contextualize_chunks(
+    documents: List[Document],
+    chunks: List[List[Document]],
+    llm: Optional[ChatOllama] = None,
+    on_progress: Callable[[int, int], None] = _log_progress,
+    strategy: Optional[str] = None,
+    duplicates: Optional[Dict[Tuple[int, int], Tuple[int, int]]] = None,
+) -> List[List[Document]]:
+    # Duplicate chunks, keyed by position like the contexts, are not sent to the LLM and get the context
+    # of their canonical chunk instead
+    strategy = strategy or Config.Preprocessing.CONTEXT_STRATEGY
+    if strategy not in CONTEXT_STRATEGIES:
+        raise ValueError(f"Invalid contextualization strategy: {strategy}")
+    contextualize = {
+        FULL_DOCUMENT: _full_document_contexts,
+        SUMMARY_WINDOW: _summary_window_contexts,
+        PREFIX_CACHED: _prefix_cached_contexts,
+    }[strategy]
+    duplicates = duplicates or {}
+    jobs = [(i, j) for i, document_chunks in enumerate(chunks) for j in range(len(document_chunks)) if (i, j) not in duplicates]
+    contexts = contextualize(documents, chunks, jobs, llm or create_llm(), on_progress)
+    contexts.update({key: contexts[canonical] for key, canonical in duplicates.items()})
+
+    return [
+        [_with_context(contexts[(i, j)], chunk) for j, chunk in enumerate(document_chunks)]
+        for i, document_chunks in enumerate(chunks)
+    ]
@@ -1,107 +1,143 @@
-from typing import List
+import shutil
+import uuid
+from pathlib import Path
+from typing import List, Tuple, Type
 
-from langchain.prompts import ChatPromptTemplate
-from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
-from langchain_community.document_compressors.flashrank_rerank import FlashrankRerank
+from langchain.retrievers import ContextualCompressionRetriever
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from langchain_community.retrievers import BM25Retriever
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain_ollama import ChatOllama
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.vectorstores import VectorStoreRetriever
 
 from config.config import Config
+from data_ingestor.bm25_index import BM25Index, BM25IndexRetriever
+from data_ingestor.chunker import create_chunks
+from data_ingestor.deduplicator import deduplicate_chunks, drop_sources
+from data_ingestor.embedding_pipeline import parallel_embeddings, stream_embeddings
+from data_ingestor.hybrid_retriever import HybridRetriever
+from data_ingestor.ingest_cache import cached_embeddings, corpus_cache_key, load_chunks
+from data_ingestor.numpy_vector_store import NumpyVectorStore
+from data_ingestor.reranker import ServiceReranker
+from data_ingestor.retrieval_cache import CachedRetriever, query_cached_embeddings
 from file_loader.file_loader import File
+from model_registry.model_registry import get_embeddings
+from instrumentation.instrumentation import span
 
+BM25_DIR_NAME = "bm25"
 
-CONTEXT_PROMPT = ChatPromptTemplate.from_template(
-    """
-You're an expert in document analysis. Your task is to provide brief, relevant context for a chunk of the text from the given document.
-
-Here is the document:
-<document>
-{document}
-</document>
-
-Here is the chunk:
-<chunk>
-{chunk}
-</chunk>
-
-Provide a concise context (2-3 sentences) for this chunk, considering the following guidelines:
-1. Identify the main topic or concept discussed in the chunk.
-2. mention any relevent information or comparisons from broader document context.
-3. If applicable, note how this info relates to the overall theme or purpose of the document.
-4. Include any key figures, dates or percentages that provide important context.
-5. Do not use phrases like "This chunk discisses" or "This section provides". Instead, directly state the main topic or concept.
-
-Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk.
-
-Context:
-    """.strip()
-)
-
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size = Config.Preprocessing.CHUNK_SIZE,
-    chunk_overlap = Config.Preprocessing.CHUNK_OVERLAP,
-)
-
-
-def create_llm() -> ChatOllama:
-    return ChatOllama(
-        model=Config.Preprocessing.LLM, 
-        temperature=0, 
-        keep_alive=-1,
-    )
 
 def create_embeddings() -> FastEmbedEmbeddings:
-    return FastEmbedEmbeddings(
-        model=Config.Preprocessing.EMBEDDING_MODEL
+    # Shared by every session in the process, see model_registry
+    return get_embeddings()
+
+def create_reranker() -> ServiceReranker:
+    # The cross-encoder itself is loaded once per process by the shared reranker service
+    return ServiceReranker(
+        top_n = Config.Chatbot.N_CONTEXT_RESULTS,
+        max_candidates = Config.Reranker.MAX_CANDIDATES,
     )
 
-def create_reranker() -> FlashrankRerank:
-    return FlashrankRerank(
-        model = Config.Preprocessing.RERANKER,
-        top_n = Config.Chatbot.N_CONTEXT_RESULTS
+def _document_embeddings(n_chunks: int) -> Embeddings:
+    # Large corpora are embedded on a pool of worker processes, see embedding_pipeline
+    return query_cached_embeddings(cached_embeddings(parallel_embeddings(create_embeddings(), n_chunks)))
+
+def _add_vectors(vectorstore: NumpyVectorStore, chunks: List[Document]):
+    # Vectors go into the store batch by batch as they come in, never all of them at once as lists of floats
+    embeddings = _document_embeddings(len(chunks))
+    for batch, vectors in stream_embeddings(chunks, embeddings):
+        vectorstore.add_embeddings(batch, vectors)
+
+def _get_retrievers(retriever: CachedRetriever) -> Tuple[VectorStoreRetriever, BM25IndexRetriever]:
+    return tuple(retriever.retriever.base_retriever.retrievers)
+
+def _save_indexes(vectorstore: NumpyVectorStore, bm25_index: BM25Index, path: Path):
+    # Save under a temporary name first so concurrent workers never load a half-written index
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    vectorstore.save(tmp_path)
+    bm25_index.save(tmp_path / BM25_DIR_NAME)
+    try:
+        tmp_path.rename(path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    indexes = sorted(
+        (index for index in path.parent.iterdir() if not index.name.endswith(".tmp")),
+        key=lambda index: index.stat().st_mtime,
+        reverse=True,
     )
-
-def _generate_context(llm: ChatOllama, document: str, chunk: str) -> str:
-    messages = CONTEXT_PROMPT.format_messages(document=document, chunk=chunk)
-    response = llm.invoke(messages)
-    return response.content
-
-def _create_chunks(document: Document) -> List[Document]:
-    chunks = text_splitter.split_documents([document])
-    if not Config.Preprocessing.CONTEXUALIZE_CHUNKS:
-        return chunks
-    llm = create_llm()
-    contextual_chunks = []
+    for index in indexes[Config.Cache.MAX_INDEXES :]:
+        shutil.rmtree(index, ignore_errors=True)
+
+def _share_metadata(vectorstore: NumpyVectorStore, bm25_index: BM25Index) -> Tuple[NumpyVectorStore, BM25Index]:
+    # Freshly indexed chunks share one metadata dict between the stores. Loaded ones get the same, so
+    # the sources recorded for a duplicate or dropped with a file change in both.
+    metadata = {doc.id: doc.metadata for doc in vectorstore.documents}
+    for doc in bm25_index.live_documents:
+        doc.metadata = metadata.get(doc.id, doc.metadata)
+    return vectorstore, bm25_index
+
+def _create_indexes(files: List[File], store_class: Type[NumpyVectorStore]) -> Tuple[NumpyVectorStore, BM25Index]:
+    embeddings = query_cached_embeddings(cached_embeddings(create_embeddings()))
+    path = Config.Path.INDEX_DIR / f"{corpus_cache_key(files)}-{Config.Preprocessing.VECTOR_DTYPE}{store_class.INDEX_SUFFIX}"
+    if Config.Cache.ENABLED and path.exists():
+        with span("ingest.snapshot_load"):
+            path.touch()
+            return _share_metadata(store_class.load(path, embeddings), BM25Index.load(path / BM25_DIR_NAME))
+    chunks = _with_ids(deduplicate_chunks(load_chunks(files, create_chunks)))
+    with span("ingest.vector_index", chunks=len(chunks)):
+        vectorstore = store_class(embeddings, dtype=Config.Preprocessing.VECTOR_DTYPE)
+        _add_vectors(vectorstore, chunks)
+    with span("ingest.bm25_index", chunks=len(chunks)):
+        bm25_index = BM25Index()
+        bm25_index.add_documents(chunks)
+    if Config.Cache.ENABLED:
+        with span("ingest.snapshot_save"):
+            _save_indexes(vectorstore, bm25_index, path)
+    return vectorstore, bm25_index
+
+def _with_ids(chunks: List[Document]) -> List[Document]:
+    # The same ID identifies a chunk in both the vector store and the BM25 index
     for chunk in chunks:
-        context = _generate_context(llm, document.page_content, chunk.page_content)
-        chunk_with_context = f"{context} \n\n {chunk.page_content}"
-        contextual_chunks.append(Document(page_content=chunk_with_context, metadata=chunk.metadata))
-    return contextual_chunks
-
-def ingest_files(files: List[File]) -> BaseRetriever:
-    documents = [Document(file.content, metadata = {"source": file.name}) for file in files]
-    chunks = []
-    for document in documents:
-        chunks.extend(_create_chunks(document))
+        chunk.id = chunk.id or str(uuid.uuid4())
+    return chunks
+
+def ingest_files(files: List[File], store_class: Type[NumpyVectorStore] = NumpyVectorStore) -> BaseRetriever:
+    vectorstore, bm25_index = _create_indexes(files, store_class)
     
-    sementic_retriever = InMemoryVectorStore.from_documents(
-        chunks, create_embeddings()
-    ).as_retriever(search_kwargs = {"k": Config.Preprocessing.N_SEMENTIC_RESULTS})
+    sementic_retriever = vectorstore.as_retriever(
+        search_kwargs = {"k": Config.Preprocessing.N_SEMENTIC_RESULTS}
+    )
 
-    bm25_retriever = BM25Retriever.from_documents(chunks)
-    bm25_retriever.k = Config.Preprocessing.N_BM25_RESULTS
+    bm25_retriever = BM25IndexRetriever(index=bm25_index, k=Config.Preprocessing.N_BM25_RESULTS)
 
-    ensemble_retriever = EnsembleRetriever(
+    hybrid_retriever = HybridRetriever(
         retrievers = [sementic_retriever, bm25_retriever],
         weights = [0.6, 0.4],
     )
 
-    return ContextualCompressionRetriever(
-        base_compressor=create_reranker(), 
-        base_retriever=ensemble_retriever
+    return CachedRetriever(
+        retriever=ContextualCompressionRetriever(
+            base_compressor=create_reranker(), 
+            base_retriever=hybrid_retriever
+        )
     )
+
+def add_files(retriever: CachedRetriever, files: List[File]):
+    chunks = load_chunks(files, create_chunks)
+    remove_files(retriever, [file.name for file in files])
+    sementic_retriever, bm25_retriever = _get_retrievers(retriever)
+    # Chunks already in the index only add their file to its sources
+    chunks = _with_ids(deduplicate_chunks(chunks, existing=sementic_retriever.vectorstore.documents))
+    with span("ingest.vector_index", chunks=len(chunks)):
+        _add_vectors(sementic_retriever.vectorstore, chunks)
+    with span("ingest.bm25_index", chunks=len(chunks)):
+        bm25_retriever.add_documents(chunks)
+    retriever.invalidate()
+
+def remove_files(retriever: CachedRetriever, file_names: List[str]):
+    names = set(file_names)
+    sementic_retriever, bm25_retriever = _get_retrievers(retriever)
+    vectorstore = sementic_retriever.vectorstore
+    vectorstore.delete(drop_sources(vectorstore.documents, names))
+    bm25_retriever.delete(drop_sources(bm25_retriever.docs, names))
+    retriever.invalidate()
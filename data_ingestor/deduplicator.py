@@ -0,0 +1,148 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import mmh3
+import numpy as np
+from langchain_core.documents import Document
+from loguru import logger
+
+from config.config import Config
+from data_ingestor.bm25_index import tokenize
+from data_ingestor.contextualizer import CONTEXT_CHARS_KEY
+from instrumentation.instrumentation import count, span
+
+MINHASH_PRIME = 4_294_967_311      # Smallest prime above 2**32, so a * x + b of 32-bit values fits in uint64
+MIN_CANDIDATE_PROBABILITY = 0.99    # Chance that a pair exactly at the threshold lands in a shared LSH bucket
+
+
+def _band_rows(threshold: float, num_perm: int) -> int:
+    # The most rows per band, and so the fewest candidate pairs, that still find pairs at the threshold.
+    # Candidates are verified against the full signature, so only missed pairs cost anything.
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold**rows) ** bands >= MIN_CANDIDATE_PROBABILITY:
+            return rows
+    return 1
+
+
+class MinHashDeduplicator:
+    # MinHash signatures over word shingles estimate the Jaccard similarity of two texts. Signatures are
+    # split into LSH bands and only texts sharing a band are compared. Texts are added in order and each
+    # one is matched against the earlier canonical texts only, so a chain of small edits never merges
+    # two texts that are not similar themselves.
+    def __init__(self, threshold: float, num_perm: int, shingle_words: int):
+        self.threshold = threshold
+        self.shingle_words = shingle_words
+        rng = np.random.default_rng(Config.SEED)
+        self._a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self.rows = _band_rows(threshold, num_perm)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(num_perm // self.rows)]
+        self._signatures: List[np.ndarray] = []
+
+    def _shingles(self, text: str) -> Set[str]:
+        words = tokenize(text)
+        n = self.shingle_words
+        return {" ".join(words[start : start + n]) for start in range(max(1, len(words) - n + 1))} if words else set()
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        shingles = self._shingles(text)
+        if not shingles:
+            return None
+        hashes = np.fromiter((mmh3.hash(shingle, signed=False) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        # One random permutation (a * x + b) mod p per signature entry, applied to all shingles at once
+        return ((hashes[:, None] * self._a + self._b) % np.uint64(MINHASH_PRIME)).min(axis=0)
+
+    def add(self, text: str) -> Optional[int]:
+        # Returns the position of the earlier canonical text this one duplicates, or None if it is new
+        signature = self.signature(text)
+        position = len(self._signatures)
+        self._signatures.append(signature)
+        if signature is None:
+            return None
+        keys = [signature[band * self.rows : (band + 1) * self.rows].tobytes() for band in range(len(self._buckets))]
+        candidates = sorted({candidate for buckets, key in zip(self._buckets, keys) for candidate in buckets.get(key, ())})
+        for candidate in candidates:
+            if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                return candidate
+        for buckets, key in zip(self._buckets, keys):
+            buckets.setdefault(key, []).append(position)
+        return None
+
+
+def create_deduplicator() -> MinHashDeduplicator:
+    return MinHashDeduplicator(
+        threshold=Config.Preprocessing.DEDUP_THRESHOLD,
+        num_perm=Config.Preprocessing.DEDUP_NUM_PERM,
+        shingle_words=Config.Preprocessing.DEDUP_SHINGLE_WORDS,
+    )
+
+def find_duplicates(texts: Iterable[str]) -> List[int]:
+    # The position of the canonical text for every text, its own position if it is canonical
+    deduplicator = create_deduplicator()
+    canonical = []
+    for position, text in enumerate(texts):
+        match = deduplicator.add(text)
+        canonical.append(position if match is None else canonical[match])
+    return canonical
+
+def duplicate_chunks(chunks: List[List[Document]]) -> Dict[Tuple[int, int], Tuple[int, int]]:
+    # Maps the (file, chunk) position of every duplicate chunk to its canonical chunk
+    keys = [(i, j) for i, file_chunks in enumerate(chunks) for j in range(len(file_chunks))]
+    canonical = find_duplicates(chunks[i][j].page_content for i, j in keys)
+    return {key: keys[match] for key, match in zip(keys, canonical) if keys[match] != key}
+
+def chunk_text(document: Document) -> str:
+    # Contexts generated for copies of a chunk differ, so only the chunk itself is compared
+    return document.page_content[document.metadata.get(CONTEXT_CHARS_KEY, 0) :]
+
+def chunk_sources(document: Document) -> List[str]:
+    return document.metadata.get("sources") or [document.metadata["source"]]
+
+def _merge_sources(canonical: Document, duplicate: Document):
+    sources = chunk_sources(canonical)
+    new_sources = [source for source in chunk_sources(duplicate) if source not in sources]
+    if new_sources:
+        canonical.metadata["sources"] = [*sources, *new_sources]
+
+def deduplicate_chunks(chunks: List[Document], existing: Sequence[Document] = ()) -> List[Document]:
+    # Keeps the first of every group of near-duplicate chunks and records the files of the others in its
+    # "sources". Chunks that duplicate an already indexed one are dropped and their files added to it.
+    if not Config.Preprocessing.DEDUPLICATE:
+        return chunks
+    with span("ingest.deduplicate", chunks=len(chunks), existing=len(existing)) as attributes:
+        documents = [*existing, *chunks]
+        canonical = find_duplicates(chunk_text(document) for document in documents)
+        unique = []
+        saved_bytes = 0
+        for position, document in enumerate(documents[len(existing) :], start=len(existing)):
+            if canonical[position] == position:
+                unique.append(document)
+                continue
+            _merge_sources(documents[canonical[position]], document)
+            saved_bytes += len(document.page_content.encode("utf-8"))
+        attributes["duplicates"] = len(chunks) - len(unique)
+        attributes["saved_text_bytes"] = saved_bytes
+    if attributes["duplicates"]:
+        count("ingest_duplicate_chunks", attributes["duplicates"])
+        count("ingest_duplicate_bytes", saved_bytes)
+        logger.info(f"Dropped {attributes['duplicates']} near-duplicate chunks of {len(chunks)}, {saved_bytes / 1024:.1f} KiB of text")
+    return unique
+
+def drop_sources(documents: Iterable[Document], names: Set[str]) -> List[str]:
+    # Removes the files from the documents' sources and returns the IDs of the documents no remaining
+    # file contains. A chunk shared with other files is kept and attributed to the first of them.
+    removed = []
+    for document in documents:
+        sources = chunk_sources(document)
+        if names.isdisjoint(sources):
+            continue
+        remaining = [source for source in sources if source not in names]
+        if not remaining:
+            removed.append(document.id)
+            continue
+        document.metadata["source"] = remaining[0]
+        if len(remaining) > 1:
+            document.metadata["sources"] = remaining
+        else:
+            document.metadata.pop("sources", None)
+    return removed
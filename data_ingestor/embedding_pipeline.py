@@ -0,0 +1,110 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from config.config import Config
+
+_worker_embeddings: Optional[Embeddings] = None
+
+def _init_worker(create: Callable[[], Embeddings]):
+    global _worker_embeddings
+    _worker_embeddings = create()
+
+def _embed_in_worker(texts: List[str]) -> np.ndarray:
+    # A float32 matrix pickles to a fraction of the size of a list of lists of floats
+    return np.asarray(_worker_embeddings.embed_documents(texts), dtype=np.float32)
+
+
+_executors: Dict[str, ProcessPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+def create_worker_pool(create: Callable[[], Embeddings], workers: int) -> ProcessPoolExecutor:
+    # spawn avoids forking Streamlit's threads; create must be picklable and is called once per worker
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(create,),
+    )
+
+def _get_executor(model_name: str) -> ProcessPoolExecutor:
+    with _executors_lock:
+        if model_name not in _executors:
+            create = partial(FastEmbedEmbeddings, model_name=model_name, threads=Config.Preprocessing.EMBEDDING_THREADS)
+            _executors[model_name] = create_worker_pool(create, Config.Preprocessing.EMBEDDING_WORKERS)
+        return _executors[model_name]
+
+
+class WorkerPoolEmbeddings(Embeddings):
+    # Embeds documents on a pool of processes, each with its own copy of the model limited to a few ONNX
+    # threads, so separate batches are tokenized and run on separate cores. Queries stay in-process.
+    def __init__(self, embeddings: Embeddings, executor: ProcessPoolExecutor, batch_size: int, workers: int):
+        self.embeddings = embeddings
+        self.executor = executor
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[start : start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        return [vector for vectors in self.executor.map(_embed_in_worker, batches) for vector in vectors.tolist()]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+def parallel_embeddings(embeddings: Embeddings, n_texts: int) -> Embeddings:
+    # Workers rebuild a FastEmbed model from its name. Small ingests and other embeddings stay in-process,
+    # where the model is loaded already.
+    if (
+        Config.Preprocessing.EMBEDDING_WORKERS < 2
+        or n_texts < Config.Preprocessing.EMBEDDING_PARALLEL_MIN_CHUNKS
+        or not isinstance(embeddings, FastEmbedEmbeddings)
+    ):
+        return embeddings
+    return WorkerPoolEmbeddings(
+        embeddings,
+        _get_executor(embeddings.model_name),
+        batch_size=Config.Preprocessing.EMBEDDING_BATCH_SIZE,
+        workers=Config.Preprocessing.EMBEDDING_WORKERS,
+    )
+
+def _workers(embeddings: Embeddings) -> int:
+    # Looks through the caching wrappers for a worker pool
+    while not isinstance(embeddings, WorkerPoolEmbeddings):
+        embeddings = getattr(embeddings, "embeddings", None)
+        if embeddings is None:
+            return 1
+    return embeddings.workers
+
+def stream_embeddings(
+    documents: Iterable[Document],
+    embeddings: Embeddings,
+    batch_size: Optional[int] = None,
+) -> Iterator[Tuple[List[Document], np.ndarray]]:
+    # Pulls documents in batches and yields each batch with its vectors in input order, so they can be
+    # indexed while later batches are embedded. One batch more than there are workers is in flight, which
+    # bounds the vectors held at once whatever the size of the corpus.
+    batch_size = batch_size or Config.Preprocessing.EMBEDDING_BATCH_SIZE
+    workers = _workers(embeddings)
+    in_flight = workers + 1 if workers > 1 else 1
+    documents = iter(documents)
+    pending: Deque[Tuple[List[Document], Future]] = deque()
+    with ThreadPoolExecutor(max_workers=in_flight, thread_name_prefix="embed") as executor:
+        while True:
+            batch = list(islice(documents, batch_size))
+            if batch:
+                pending.append((batch, executor.submit(embeddings.embed_documents, [doc.page_content for doc in batch])))
+            if not pending:
+                return
+            if len(pending) >= in_flight or not batch:
+                done, vectors = pending.popleft()
+                yield done, np.asarray(vectors.result(), dtype=np.float32)
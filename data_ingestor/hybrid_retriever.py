@@ -0,0 +1,79 @@
+import asyncio
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from config.config import Config
+from data_ingestor.reranker import FUSION_RANKS_KEY, FUSION_SCORE_KEY
+from instrumentation.instrumentation import span
+
+_executor = ThreadPoolExecutor(max_workers=Config.Chatbot.RETRIEVAL_THREADS, thread_name_prefix="retrieval")
+
+
+def _retriever_name(retriever: BaseRetriever) -> str:
+    vectorstore = getattr(retriever, "vectorstore", None)
+    return type(vectorstore if vectorstore is not None else retriever).__name__
+
+
+class HybridRetriever(BaseRetriever):
+    # Queries all retrievers at once and merges their rankings with weighted reciprocal rank fusion,
+    # so a slow backend (a Pinecone round trip) overlaps with the others instead of preceding them
+    retrievers: List[BaseRetriever]
+    weights: List[float]
+    c: int = 60
+
+    def fuse(self, results: List[List[Document]]) -> List[Document]:
+        # Documents are matched on their content, as the backends do not share document IDs
+        scores: Dict[str, float] = defaultdict(float)
+        ranks: Dict[str, List[int]] = defaultdict(lambda: [0] * len(results))
+        documents: Dict[str, Document] = {}
+        for i, (retrieved, weight) in enumerate(zip(results, self.weights)):
+            for rank, document in enumerate(retrieved, start=1):
+                documents.setdefault(document.page_content, document)
+                scores[document.page_content] += weight / (rank + self.c)
+                ranks[document.page_content][i] = ranks[document.page_content][i] or rank
+        # Copies carry the fusion score and the rank from each retriever, so the reranker can keep every
+        # retriever's top hits
+        return [
+            Document(
+                id=documents[content].id,
+                page_content=content,
+                metadata={**documents[content].metadata, FUSION_SCORE_KEY: scores[content], FUSION_RANKS_KEY: ranks[content]},
+            )
+            for content in sorted(scores, key=scores.__getitem__, reverse=True)
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        # Each thread runs in a copy of this context, so its spans land in the caller's trace
+        futures = [
+            _executor.submit(contextvars.copy_context().run, self._invoke, retriever, query, config)
+            for retriever in self.retrievers
+        ]
+        return self.fuse([future.result() for future in futures])
+
+    def _invoke(self, retriever: BaseRetriever, query: str, config: dict) -> List[Document]:
+        with span(f"retrieve.{_retriever_name(retriever)}") as attributes:
+            documents = retriever.invoke(query, config)
+            attributes["documents"] = len(documents)
+            return documents
+
+    async def _ainvoke(self, retriever: BaseRetriever, query: str, config: dict) -> List[Document]:
+        with span(f"retrieve.{_retriever_name(retriever)}") as attributes:
+            documents = await retriever.ainvoke(query, config)
+            attributes["documents"] = len(documents)
+            return documents
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        results = await asyncio.gather(*(self._ainvoke(retriever, query, config) for retriever in self.retrievers))
+        return self.fuse(list(results))
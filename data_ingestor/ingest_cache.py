@@ -0,0 +1,208 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+from config.config import Config
+from data_ingestor.contextualizer import CONTEXT_PROMPTS
+from file_loader.file_loader import File
+from instrumentation.instrumentation import span
+
+CACHE_FILE_NAME = "ingest_cache.sqlite"
+CHUNKS_NAMESPACE = "chunks-v2"          # Bumped when splitting changes, so chunks split the old way are not reused
+EMBEDDINGS_NAMESPACE = "embeddings"
+SQLITE_MAX_VARIABLES = 500
+
+
+def _hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def file_hash(file: File) -> str:
+    return _hash(*(page.content for page in file.pages))
+
+def chunks_cache_key(file: File) -> str:
+    # Every setting that changes the chunks or the generated context is part of the key
+    settings = json.dumps(
+        {
+            "chunk_size": Config.Preprocessing.CHUNK_SIZE,
+            "chunk_overlap": Config.Preprocessing.CHUNK_OVERLAP,
+            "contextualize": Config.Preprocessing.CONTEXUALIZE_CHUNKS,
+            "llm": Config.Preprocessing.LLM,
+            "context_strategy": Config.Preprocessing.CONTEXT_STRATEGY,
+            "context_neighbor_chars": Config.Preprocessing.CONTEXT_NEIGHBOR_CHARS,
+            "context_summary_words": Config.Preprocessing.CONTEXT_SUMMARY_WORDS,
+            "context_section_chars": Config.Preprocessing.CONTEXT_SECTION_CHARS,
+            "deduplicate": Config.Preprocessing.DEDUPLICATE,
+            "dedup_threshold": Config.Preprocessing.DEDUP_THRESHOLD,
+            "dedup_num_perm": Config.Preprocessing.DEDUP_NUM_PERM,
+            "dedup_shingle_words": Config.Preprocessing.DEDUP_SHINGLE_WORDS,
+            "prompt": [message.prompt.template for prompt in CONTEXT_PROMPTS for message in prompt.messages],
+        },
+        sort_keys=True,
+    )
+    return _hash(CHUNKS_NAMESPACE, file_hash(file), settings)
+
+def corpus_cache_key(files: List[File]) -> str:
+    return _hash(
+        Config.Preprocessing.EMBEDDING_MODEL,
+        *sorted(f"{file.name}:{chunks_cache_key(file)}" for file in files),
+    )
+
+def embedding_cache_key(text: str) -> str:
+    return _hash(EMBEDDINGS_NAMESPACE, Config.Preprocessing.EMBEDDING_MODEL, text)
+
+
+class IngestCache:
+    def __init__(self, path: Path, max_size_bytes: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._connection.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = keys[start : start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+                self._connection.execute(
+                    f"UPDATE entries SET accessed = ? WHERE key IN ({placeholders})", [time.time(), *batch]
+                )
+            self._connection.commit()
+        return found
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[str, bytes]):
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in items.items()],
+            )
+            self._evict()
+            self._connection.commit()
+
+    def put(self, key: str, value: bytes):
+        self.put_many({key: value})
+
+    def size(self) -> int:
+        with self._lock:
+            return self._size()
+
+    def _size(self) -> int:
+        return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self):
+        excess = self._size() - self.max_size_bytes
+        if excess <= 0:
+            return
+        evicted = 0
+        for key, size in self._connection.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            if excess <= 0:
+                break
+            self._connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            excess -= size
+            evicted += 1
+        logger.debug(f"Evicted {evicted} entries from the ingestion cache")
+
+    def get_chunks(self, file: File) -> Optional[List[Document]]:
+        cached = self.get(chunks_cache_key(file))
+        if cached is None:
+            return None
+        logger.info(f"Loaded chunks of {file.name} from the ingestion cache")
+        return [
+            Document(page_content=chunk["content"], metadata={**chunk["metadata"], "source": file.name})
+            for chunk in json.loads(cached)
+        ]
+
+    def put_chunks(self, file: File, chunks: List[Document]):
+        value = json.dumps([{"content": chunk.page_content, "metadata": chunk.metadata} for chunk in chunks])
+        self.put(chunks_cache_key(file), value.encode("utf-8"))
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, cache: IngestCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(text) for text in texts]
+        cached = self.cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        if missing:
+            vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            computed = {keys[i]: np.asarray(vector, dtype=np.float32).tobytes() for i, vector in zip(missing, vectors)}
+            self.cache.put_many(computed)
+            cached.update(computed)
+        logger.info(f"Embedded {len(missing)} chunks, {len(texts) - len(missing)} loaded from the ingestion cache")
+        return [np.frombuffer(cached[key], dtype=np.float32).tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+_cache: Optional[IngestCache] = None
+_cache_lock = threading.Lock()
+
+def get_ingest_cache() -> Optional[IngestCache]:
+    global _cache
+    if not Config.Cache.ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = IngestCache(
+                Config.Path.CACHE_DIR / CACHE_FILE_NAME,
+                max_size_bytes=Config.Cache.MAX_SIZE_MB * 1024 * 1024,
+            )
+        return _cache
+
+def load_chunks(
+    files: List[File],
+    create_chunks: Callable[[List[File]], List[List[Document]]],
+) -> List[Document]:
+    cache = get_ingest_cache()
+    with span("ingest.chunks", files=len(files)) as attributes:
+        chunks = [cache.get_chunks(file) if cache else None for file in files]
+        missing = [i for i, file_chunks in enumerate(chunks) if file_chunks is None]
+        attributes["cached_files"] = len(files) - len(missing)
+        if missing:
+            for i, file_chunks in zip(missing, create_chunks([files[i] for i in missing])):
+                chunks[i] = file_chunks
+                if cache:
+                    cache.put_chunks(files[i], file_chunks)
+        return [chunk for file_chunks in chunks for chunk in file_chunks]
+
+def cached_embeddings(embeddings: Embeddings) -> Embeddings:
+    cache = get_ingest_cache()
+    return embeddings if cache is None else CachedEmbeddings(embeddings, cache)
@@ -0,0 +1,20 @@
+from typing import List
+
+from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+from langchain_core.retrievers import BaseRetriever
+
+from data_ingestor import data_ingestor
+from data_ingestor.data_ingestor import add_files, remove_files
+from data_ingestor.ivfpq_vector_store import IVFPQVectorStore
+from file_loader.file_loader import File
+
+# The local backend with approximate semantic search. Adding and removing files goes through the same
+# functions, since IVFPQVectorStore keeps its index up to date itself.
+
+
+def ingest_files(files: List[File]) -> BaseRetriever:
+    return data_ingestor.ingest_files(files, store_class=IVFPQVectorStore)
+
+def create_embeddings() -> FastEmbedEmbeddings:
+    # Looked up at call time, so a stand-in swapped into data_ingestor applies to both backends
+    return data_ingestor.create_embeddings()
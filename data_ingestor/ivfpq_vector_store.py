@@ -0,0 +1,280 @@
+import json
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+from config.config import Config
+from data_ingestor.numpy_vector_store import NumpyVectorStore, _normalize
+from instrumentation.instrumentation import span
+
+IVFPQ_FILE_NAME = "ivfpq.npz"
+IVFPQ_SETTINGS_FILE_NAME = "ivfpq.json"
+CODEBOOK_SIZE = 256             # Centroids per subvector, so every code is one byte
+MIN_ROWS_PER_LIST = 39          # Fewer training rows per cell leave the k-means centroids poorly placed
+KMEANS_BLOCK_ROWS = 4096        # Rows assigned to centroids at once
+INDEX_BLOCK_ROWS = 32768        # Rows encoded and sorted into their cells at once
+MIN_LIST_CAPACITY = 16
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # Closest centroid by Euclidean distance, in blocks to bound the rows x centroids matrix
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), KMEANS_BLOCK_ROWS):
+        block = vectors[start : start + KMEANS_BLOCK_ROWS]
+        assignment[start : start + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return assignment
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=k)
+        filled = np.flatnonzero(counts)
+        sums = np.add.reduceat(vectors[order], np.concatenate(([0], np.cumsum(counts)[:-1]))[filled])
+        # Empty cells keep their centroid
+        centroids[filled] = sums / counts[filled, None]
+    return centroids
+
+def _subvectors(dimension: int, requested: int) -> int:
+    # The most subvectors up to the requested number that split the dimension evenly
+    return max(m for m in range(1, min(requested, dimension) + 1) if dimension % m == 0)
+
+
+class _InvertedList:
+    # The rows of one IVF cell and their PQ codes, contiguous so a probe scans them in one go
+    def __init__(self, n_subvectors: int):
+        self.rows = np.empty(0, dtype=np.int64)
+        self.codes = np.empty((0, n_subvectors), dtype=np.uint8)
+        self.size = 0
+
+    def append(self, rows: np.ndarray, codes: np.ndarray) -> int:
+        start, end = self.size, self.size + len(rows)
+        if end > len(self.rows):
+            capacity = max(MIN_LIST_CAPACITY, 2 * end)
+            self.rows = np.resize(self.rows, capacity)
+            self.codes = np.resize(self.codes, (capacity, self.codes.shape[1]))
+        self.rows[start:end] = rows
+        self.codes[start:end] = codes
+        self.size = end
+        return start
+
+
+class IVFPQVectorStore(NumpyVectorStore):
+    # Approximate search over the rows of a NumpyVectorStore. An inverted file splits the vectors into
+    # cells around k-means centroids and product quantization compresses each vector's residual to its
+    # centroid into one byte per subvector. A query scans the codes of the `probes` closest cells with
+    # per-query lookup tables, then re-scores the best `refine_factor * k` candidates exactly from the
+    # stored vectors. Until the store holds MIN_TRAIN_ROWS vectors it searches exhaustively. Vectors
+    # added later are encoded with the trained quantizers, which are retrained once the store has grown
+    # RETRAIN_GROWTH times.
+    INDEX_SUFFIX = "-ivfpq"
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        dtype: str = "float32",
+        lists: Optional[int] = None,
+        subvectors: Optional[int] = None,
+        probes: Optional[int] = None,
+        refine_factor: Optional[int] = None,
+    ):
+        super().__init__(embedding, dtype=dtype)
+        self.lists = lists or Config.ANN.LISTS
+        self.subvectors = subvectors or Config.ANN.SUBVECTORS
+        self.probes = probes or Config.ANN.PROBES
+        self.refine_factor = refine_factor or Config.ANN.REFINE_FACTOR
+        self._centroids: Optional[np.ndarray] = None
+        self._codebooks: Optional[np.ndarray] = None
+        self._inverted_lists: List[_InvertedList] = []
+        self._row_lists = np.empty(0, dtype=np.int64)
+        self._row_positions = np.empty(0, dtype=np.int64)
+        self._trained_rows = 0
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def _dequantized(self, rows: Union[slice, np.ndarray]) -> np.ndarray:
+        vectors = self._matrix[rows].astype(np.float32)
+        return vectors if self.dtype == "float32" else vectors * self._scales[rows, None]
+
+    def _encode(self, vectors: np.ndarray, lists: np.ndarray) -> np.ndarray:
+        # Residuals to the cell centroids, split into subvectors, each mapped to its nearest codebook entry
+        n_subvectors, _, width = self._codebooks.shape
+        residuals = (vectors - self._centroids[lists]).reshape(len(vectors), n_subvectors, width)
+        codes = np.empty((len(vectors), n_subvectors), dtype=np.uint8)
+        for subvector in range(n_subvectors):
+            codes[:, subvector] = _nearest(residuals[:, subvector], self._codebooks[subvector])
+        return codes
+
+    def _train(self):
+        rng = np.random.default_rng(Config.SEED)
+        sample = rng.choice(self._size, min(self._size, Config.ANN.TRAIN_SAMPLE_ROWS), replace=False)
+        vectors = self._dequantized(np.sort(sample))
+        lists = max(1, min(self.lists, len(vectors) // MIN_ROWS_PER_LIST))
+        dimension = vectors.shape[1]
+        n_subvectors = _subvectors(dimension, self.subvectors)
+        with span("ann.train", rows=len(vectors), lists=lists, subvectors=n_subvectors):
+            self._centroids = _kmeans(vectors, lists, Config.ANN.KMEANS_ITERATIONS, rng)
+            residuals = vectors - self._centroids[_nearest(vectors, self._centroids)]
+            residuals = residuals[: Config.ANN.PQ_TRAIN_ROWS].reshape(-1, n_subvectors, dimension // n_subvectors)
+            self._codebooks = np.stack(
+                [
+                    _kmeans(residuals[:, subvector], min(CODEBOOK_SIZE, len(residuals)), Config.ANN.KMEANS_ITERATIONS, rng)
+                    for subvector in range(n_subvectors)
+                ]
+            )
+        self._trained_rows = self._size
+        self._inverted_lists = [_InvertedList(n_subvectors) for _ in range(lists)]
+        self._row_lists = np.empty(0, dtype=np.int64)
+        self._row_positions = np.empty(0, dtype=np.int64)
+        self._index_rows(0, self._size)
+        logger.info(f"Trained an IVF-PQ index with {lists} cells and {n_subvectors} subvectors on {len(vectors)} vectors")
+
+    def _index_rows(self, start: int, end: int):
+        if len(self._row_lists) < end:
+            self._row_lists = np.resize(self._row_lists, max(MIN_LIST_CAPACITY, 2 * end))
+            self._row_positions = np.resize(self._row_positions, len(self._row_lists))
+        for block in range(start, end, INDEX_BLOCK_ROWS):
+            rows = np.arange(block, min(block + INDEX_BLOCK_ROWS, end))
+            vectors = self._dequantized(slice(rows[0], rows[-1] + 1))
+            lists = _nearest(vectors, self._centroids)
+            codes = self._encode(vectors, lists)
+            order = np.argsort(lists, kind="stable")
+            bounds = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=len(self._centroids)))))
+            for cell in np.flatnonzero(np.diff(bounds)):
+                members = order[bounds[cell] : bounds[cell + 1]]
+                position = self._inverted_lists[cell].append(rows[members], codes[members])
+                self._row_lists[rows[members]] = cell
+                self._row_positions[rows[members]] = np.arange(position, position + len(members))
+
+    def _update_index(self):
+        if self._size < Config.ANN.MIN_TRAIN_ROWS:
+            return
+        if not self.trained or self._size >= Config.ANN.RETRAIN_GROWTH * self._trained_rows:
+            self._train()
+            return
+        indexed = sum(inverted_list.size for inverted_list in self._inverted_lists)
+        self._index_rows(indexed, self._size)
+
+    def add_embeddings(
+        self,
+        documents: Sequence[Document],
+        embeddings: Sequence[Sequence[float]],
+        ids: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        ids = super().add_embeddings(documents, embeddings, ids=ids)
+        self._update_index()
+        return ids
+
+    def _remove_row(self, row: int, last: int):
+        # Mirrors NumpyVectorStore.delete: the row leaves its cell and the last row takes its number
+        cell, position = self._row_lists[row], self._row_positions[row]
+        inverted_list = self._inverted_lists[cell]
+        end = inverted_list.size - 1
+        if position != end:
+            moved = inverted_list.rows[end]
+            inverted_list.rows[position] = moved
+            inverted_list.codes[position] = inverted_list.codes[end]
+            self._row_positions[moved] = position
+        inverted_list.size = end
+        if row != last:
+            cell, position = self._row_lists[last], self._row_positions[last]
+            self._inverted_lists[cell].rows[position] = row
+            self._row_lists[row], self._row_positions[row] = cell, position
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if self.trained:
+            size = self._size
+            for row in sorted((self._rows[id] for id in ids or [] if id in self._rows), reverse=True):
+                size -= 1
+                self._remove_row(row, size)
+        return super().delete(ids, **kwargs)
+
+    def _candidates(self, query: np.ndarray, n: int) -> np.ndarray:
+        # Rows with the highest approximate scores in the closest cells
+        coarse_scores = self._centroids @ query
+        probes = min(self.probes, len(self._centroids))
+        cells = np.argpartition(-coarse_scores, probes - 1)[:probes]
+        n_subvectors, codebook_size, width = self._codebooks.shape
+        # Score of every codebook entry of every subvector, so a code's score is a sum of table lookups
+        table = np.einsum("md,mkd->mk", query.reshape(n_subvectors, width), self._codebooks).ravel()
+        offsets = np.arange(n_subvectors) * codebook_size
+        rows, scores = [], []
+        for cell in cells:
+            inverted_list = self._inverted_lists[cell]
+            if inverted_list.size:
+                codes = inverted_list.codes[: inverted_list.size]
+                rows.append(inverted_list.rows[: inverted_list.size])
+                scores.append(coarse_scores[cell] + table[codes + offsets].sum(axis=1))
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        if len(rows) > n:
+            rows = rows[np.argpartition(-scores, n - 1)[:n]]
+        return rows
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: Sequence[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        if not self.trained:
+            return super().similarity_search_with_score_by_vector(embedding, k, **kwargs)
+        query = _normalize(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+        rows = np.sort(self._candidates(query, k * self.refine_factor))
+        if len(rows) == 0:
+            return []
+        scores = self._matrix[rows].astype(np.float32) @ query * self._scales[rows]
+        top = np.argsort(-scores)[:k]
+        return [(self.documents[rows[i]], float(scores[i])) for i in top]
+
+    def similarity_search_with_score_by_vectors(
+        self, embeddings: Sequence[Sequence[float]], k: int = 4
+    ) -> List[List[Tuple[Document, float]]]:
+        if not self.trained:
+            return super().similarity_search_with_score_by_vectors(embeddings, k)
+        return [self.similarity_search_with_score_by_vector(embedding, k) for embedding in embeddings]
+
+    def save(self, path: Path):
+        super().save(path)
+        if not self.trained:
+            return
+        n_subvectors = self._codebooks.shape[0]
+        codes = np.empty((self._size, n_subvectors), dtype=np.uint8)
+        for inverted_list in self._inverted_lists:
+            codes[inverted_list.rows[: inverted_list.size]] = inverted_list.codes[: inverted_list.size]
+        np.savez(
+            path / IVFPQ_FILE_NAME,
+            centroids=self._centroids,
+            codebooks=self._codebooks,
+            codes=codes,
+            lists=self._row_lists[: self._size],
+        )
+        (path / IVFPQ_SETTINGS_FILE_NAME).write_text(json.dumps({"trained_rows": self._trained_rows}))
+
+    @classmethod
+    def load(cls, path: Path, embedding: Embeddings) -> "IVFPQVectorStore":
+        store = super().load(path, embedding)
+        if not (path / IVFPQ_FILE_NAME).exists():
+            store._update_index()
+            return store
+        data = np.load(path / IVFPQ_FILE_NAME)
+        settings = json.loads((path / IVFPQ_SETTINGS_FILE_NAME).read_text())
+        store._centroids, store._codebooks = data["centroids"], data["codebooks"]
+        store._trained_rows = settings["trained_rows"]
+        codes, lists = data["codes"], data["lists"]
+        store._inverted_lists = [_InvertedList(store._codebooks.shape[0]) for _ in range(len(store._centroids))]
+        store._row_lists = lists.astype(np.int64)
+        store._row_positions = np.empty(len(lists), dtype=np.int64)
+        order = np.argsort(lists, kind="stable")
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=len(store._centroids)))))
+        for cell, inverted_list in enumerate(store._inverted_lists):
+            rows = order[bounds[cell] : bounds[cell + 1]]
+            inverted_list.append(rows, codes[rows])
+            store._row_positions[rows] = np.arange(len(rows))
+        return store
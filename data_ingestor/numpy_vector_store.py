@@ -0,0 +1,227 @@
+import json
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from loguru import logger
+
+VECTORS_FILE_NAME = "vectors.npy"
+SCALES_FILE_NAME = "scales.npy"
+DOCUMENTS_FILE_NAME = "documents.json"
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+INT8_MAX = 127
+SEARCH_BLOCK_ROWS = 65536       # Quantized rows are upcast to float32 one block at a time
+MAX_SCORE_CELLS = 1 << 24       # Largest rows x queries score matrix of a batch search, 64 MB of float32
+MIN_CAPACITY = 1024
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class NumpyVectorStore(VectorStore):
+    # Cosine similarity store backed by one contiguous (optionally quantized) matrix of normalized vectors.
+    # Rows are kept densely packed: deleting a row moves the last row into its place.
+    INDEX_SUFFIX = ""               # Distinguishes saved indexes of subclasses with extra files
+    def __init__(self, embedding: Embeddings, dtype: str = "float32"):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}, expected one of {SUPPORTED_DTYPES}")
+        self.embedding = embedding
+        self.dtype = dtype
+        self.ids: List[str] = []
+        self.documents: List[Document] = []
+        self._rows = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._size = 0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[: self._size]
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / INT8_MAX
+            scales = np.maximum(scales, np.finfo(np.float32).tiny).astype(np.float32)
+            return np.rint(vectors / scales[:, None]).astype(np.int8), scales
+        return vectors.astype(self.dtype), np.ones(len(vectors), dtype=np.float32)
+
+    def _reserve(self, rows: int, dimension: int):
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        needed = self._size + rows
+        if self._matrix is not None and self._matrix.flags.writeable and needed <= capacity:
+            return
+        # Grow geometrically; a memory-mapped index is copied into private memory on the first write
+        new_capacity = max(MIN_CAPACITY, needed * 2 if needed > capacity else capacity)
+        matrix = np.empty((new_capacity, dimension), dtype=self.dtype)
+        scales = np.empty(new_capacity, dtype=np.float32)
+        if self._size:
+            matrix[: self._size] = self._matrix[: self._size]
+            scales[: self._size] = self._scales[: self._size]
+        self._matrix, self._scales = matrix, scales
+
+    def add_embeddings(
+        self,
+        documents: Sequence[Document],
+        embeddings: Sequence[Sequence[float]],
+        ids: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        ids = list(ids) if ids else [doc.id or str(uuid.uuid4()) for doc in documents]
+        existing = [id for id in ids if id in self._rows]
+        if existing:
+            self.delete(existing)
+        if len(embeddings) == 0:
+            return []
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        self._reserve(len(vectors), vectors.shape[1])
+        start, end = self._size, self._size + len(vectors)
+        self._matrix[start:end], self._scales[start:end] = self._quantize(vectors)
+        for row, (id, document) in enumerate(zip(ids, documents), start=start):
+            self._rows[id] = row
+            self.ids.append(id)
+            self.documents.append(Document(id=id, page_content=document.page_content, metadata=document.metadata))
+        self._size = end
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        return self.add_embeddings(documents, self.embedding.embed_documents(texts), ids=ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        rows = sorted((self._rows[id] for id in ids or [] if id in self._rows), reverse=True)
+        if not rows:
+            return False
+        if not self._matrix.flags.writeable:
+            self._reserve(0, self._matrix.shape[1])
+        for row in rows:
+            last = self._size - 1
+            del self._rows[self.ids[row]]
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                self._scales[row] = self._scales[last]
+                self.ids[row] = self.ids[last]
+                self.documents[row] = self.documents[last]
+                self._rows[self.ids[row]] = row
+            self.ids.pop()
+            self.documents.pop()
+            self._size = last
+        return True
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        return [self.documents[self._rows[id]] for id in ids if id in self._rows]
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        # One query vector gives a score per row, a matrix of queries gives a rows x queries matrix
+        if self.dtype == "float32":
+            return self.vectors @ queries.T
+        scores = np.empty((self._size, *queries.shape[:-1]), dtype=np.float32)
+        for start in range(0, self._size, SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, self._size)
+            scores[start:end] = self._matrix[start:end].astype(np.float32) @ queries.T
+        return scores * self._scales[: self._size].reshape(-1, *[1] * (queries.ndim - 1))
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: Sequence[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        if self._size == 0:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+        scores = self._scores(query)
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.documents[row], float(scores[row])) for row in top]
+
+    def similarity_search_with_score_by_vectors(
+        self, embeddings: Sequence[Sequence[float]], k: int = 4
+    ) -> List[List[Tuple[Document, float]]]:
+        # Scores a batch of queries with one matrix product per block of queries instead of one per query
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        if self._size == 0:
+            return [[] for _ in range(len(queries))]
+        k = min(k, self._size)
+        block = max(1, MAX_SCORE_CELLS // self._size)
+        results = []
+        for start in range(0, len(queries), block):
+            scores = self._scores(queries[start : start + block]).T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+            results.extend(
+                [(self.documents[row], float(score)) for row, score in zip(rows.tolist(), row_scores.tolist())]
+                for rows, row_scores in zip(top, top_scores)
+            )
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._cosine_relevance_score_fn
+
+    def save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / VECTORS_FILE_NAME, self.vectors)
+        np.save(path / SCALES_FILE_NAME, self._scales[: self._size] if self._size else np.empty(0, np.float32))
+        documents = [{"id": id, "content": doc.page_content, "metadata": doc.metadata} for id, doc in zip(self.ids, self.documents)]
+        (path / DOCUMENTS_FILE_NAME).write_text(json.dumps({"dtype": self.dtype, "documents": documents}))
+
+    @classmethod
+    def load(cls, path: Path, embedding: Embeddings) -> "NumpyVectorStore":
+        # The matrix stays memory-mapped read-only, so every process loading it shares the same pages
+        data = json.loads((path / DOCUMENTS_FILE_NAME).read_text())
+        store = cls(embedding, dtype=data["dtype"])
+        store._matrix = np.load(path / VECTORS_FILE_NAME, mmap_mode="r")
+        store._scales = np.load(path / SCALES_FILE_NAME, mmap_mode="r")
+        for row, document in enumerate(data["documents"]):
+            store._rows[document["id"]] = row
+            store.ids.append(document["id"])
+            store.documents.append(Document(id=document["id"], page_content=document["content"], metadata=document["metadata"]))
+        store._size = len(store.ids)
+        logger.info(f"Loaded {store._size} vectors from {path}")
+        return store
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        dtype: str = "float32",
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding, dtype=dtype)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -1,125 +1,278 @@
-from typing import List
+import hashlib
+import json
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Deque, Iterable, Iterator, List, Optional, Set, Tuple
 
-from langchain.prompts import ChatPromptTemplate
-from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
-from langchain_community.document_compressors.flashrank_rerank import FlashrankRerank
+import numpy as np
+from langchain.retrievers import ContextualCompressionRetriever
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
-from langchain_community.retrievers import BM25Retriever
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
-from langchain_ollama import ChatOllama
+from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_pinecone import PineconeVectorStore
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from pinecone import Pinecone
+from pinecone import Index, Pinecone
 
 from config.config import Config
+from data_ingestor.bm25_index import BM25IndexRetriever
+from data_ingestor.chunker import create_chunks
+from data_ingestor.deduplicator import deduplicate_chunks, drop_sources
+from data_ingestor.embedding_pipeline import parallel_embeddings, stream_embeddings
+from data_ingestor.hybrid_retriever import HybridRetriever
+from data_ingestor.ingest_cache import cached_embeddings, embedding_cache_key, load_chunks
+from data_ingestor.pinecone_hybrid_retriever import PineconeHybridRetriever
+from data_ingestor.reranker import ServiceReranker
+from data_ingestor.retrieval_cache import CachedRetriever, query_cached_embeddings
+from data_ingestor.sparse_encoder import SparseEncoder, normalize
 from file_loader.file_loader import File
+from model_registry.model_registry import get_embeddings
+from instrumentation.instrumentation import span
 
+TEXT_KEY = "text"               # Metadata field PineconeVectorStore reads the chunk text from
+MAX_DELETE_IDS = 1000
+MAX_FETCH_IDS = 100             # IDs go into the query string of a fetch request
+MAX_QUEUED_UPSERTS_PER_THREAD = 2       # Upsert requests waiting for a free thread before embedding pauses
 
-CONTEXT_PROMPT = ChatPromptTemplate.from_template(
-    """
-You're an expert in document analysis. Your task is to provide brief, relevant context for a chunk of the text from the given document.
 
-Here is the document:
-<document>
-{document}
-</document>
+def create_embeddings() -> FastEmbedEmbeddings:
+    # Shared by every session in the process, see model_registry
+    return get_embeddings()
 
-Here is the chunk:
-<chunk>
-{chunk}
-</chunk>
+def create_reranker() -> ServiceReranker:
+    # The cross-encoder itself is loaded once per process by the shared reranker service
+    return ServiceReranker(
+        top_n = Config.Chatbot.N_CONTEXT_RESULTS,
+        max_candidates = Config.Reranker.MAX_CANDIDATES,
+    )
 
-Provide a concise context (2-3 sentences) for this chunk, considering the following guidelines:
-1. Identify the main topic or concept discussed in the chunk.
-2. mention any relevent information or comparisons from broader document context.
-3. If applicable, note how this info relates to the overall theme or purpose of the document.
-4. Include any key figures, dates or percentages that provide important context.
-5. Do not use phrases like "This chunk discisses" or "This section provides". Instead, directly state the main topic or concept.
+def _get_namespace() -> str:
+    return Config.VectorDB.PINECONE_NAMESPACE if Config.VectorDB.PINECONE_NAMESPACE else ""
 
-Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk.
+@lru_cache(maxsize=1)
+def _get_index() -> Index:
+    # One client per process whose connection pool is sized for the parallel upserts
+    pc = Pinecone(api_key=Config.VectorDB.PINECONE_API_KEY, pool_threads=Config.VectorDB.UPSERT_CONCURRENCY)
+    return pc.Index(Config.VectorDB.PINECONE_INDEX_NAME, pool_threads=Config.VectorDB.UPSERT_CONCURRENCY)
 
-Context:
-    """.strip()
-)
+@lru_cache(maxsize=1)
+def _get_sparse_encoder() -> SparseEncoder:
+    return SparseEncoder(average_length=Config.VectorDB.SPARSE_AVERAGE_TOKENS)
 
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size = Config.Preprocessing.CHUNK_SIZE,
-    chunk_overlap = Config.Preprocessing.CHUNK_OVERLAP,
-)
+@lru_cache(maxsize=1)
+def _get_upsert_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=Config.VectorDB.UPSERT_CONCURRENCY, thread_name_prefix="pinecone-upsert")
 
+def _source_prefix(source: str) -> str:
+    # Vector IDs start with a hash of the file name, so a file's vectors can be listed by prefix
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16] + "#"
 
-def create_llm() -> ChatOllama:
-    return ChatOllama(
-        model=Config.Preprocessing.LLM, 
-        temperature=0, 
-        keep_alive=-1,
-    )
+def _content_id(text: str) -> str:
+    # Records with sparse values get other IDs, so switching the hybrid mode re-upserts every chunk
+    key = embedding_cache_key(text)
+    if Config.VectorDB.HYBRID_SEARCH:
+        key = hashlib.sha256(f"sparse\0{key}".encode("utf-8")).hexdigest()
+    return key[:32]
 
-def create_embeddings() -> FastEmbedEmbeddings:
-    return FastEmbedEmbeddings(
-        model=Config.Preprocessing.EMBEDDING_MODEL
-    )
+def _with_ids(chunks: List[Document]) -> List[Document]:
+    # IDs hash the chunk text and the embedding model, so re-uploading a file maps onto the same vectors.
+    # Identical chunks of one file share an ID and are indexed once.
+    unique = {}
+    for chunk in chunks:
+        chunk.id = _source_prefix(chunk.metadata["source"]) + _content_id(chunk.page_content)
+        unique.setdefault(chunk.id, chunk)
+    return list(unique.values())
+
+def _list_ids(file_names: List[str]) -> Set[str]:
+    index = _get_index()
+    namespace = _get_namespace()
+    with span("ingest.pinecone_list", files=len(file_names)):
+        return {
+            id
+            for name in file_names
+            for ids in index.list(prefix=_source_prefix(name), namespace=namespace)
+            for id in ids
+        }
+
+def _delete_ids(ids: List[str]):
+    index = _get_index()
+    namespace = _get_namespace()
+    with span("ingest.pinecone_delete", vectors=len(ids)):
+        for start in range(0, len(ids), MAX_DELETE_IDS):
+            index.delete(ids=ids[start : start + MAX_DELETE_IDS], namespace=namespace)
+
+def _record_size(record: dict) -> int:
+    # Approximate JSON size of one vector in an upsert request
+    sparse_values = record.get("sparse_values", {"indices": []})
+    return len(record["id"]) + len(json.dumps(record["metadata"])) + 12 * (len(record["values"]) + len(sparse_values["indices"]))
+
+def _batches(records: Iterable[dict]) -> Iterator[List[dict]]:
+    batch, batch_size = [], 0
+    for record in records:
+        size = _record_size(record)
+        if batch and (len(batch) >= Config.VectorDB.UPSERT_BATCH_SIZE or batch_size + size > Config.VectorDB.UPSERT_MAX_REQUEST_BYTES):
+            yield batch
+            batch, batch_size = [], 0
+        batch.append(record)
+        batch_size += size
+    if batch:
+        yield batch
+
+def _document_embeddings(n_chunks: int) -> Embeddings:
+    # Large corpora are embedded on a pool of worker processes, see embedding_pipeline
+    return query_cached_embeddings(cached_embeddings(parallel_embeddings(create_embeddings(), n_chunks)))
+
+def _records(chunks: List[Document], vectors: np.ndarray) -> List[dict]:
+    records = [
+        {"id": chunk.id, "values": vector, "metadata": {**chunk.metadata, TEXT_KEY: chunk.page_content}}
+        for chunk, vector in zip(chunks, vectors.tolist())
+    ]
+    if Config.VectorDB.HYBRID_SEARCH:
+        sparse_vectors = _get_sparse_encoder().encode_documents([chunk.page_content for chunk in chunks])
+        for record, sparse_values in zip(records, sparse_vectors):
+            record["values"] = normalize(record["values"])
+            record["sparse_values"] = sparse_values
+    return records
+
+def _upsert_chunks(chunks: List[Document], embeddings: Embeddings, file_names: List[str]):
+    # Only chunks whose ID is not in the index yet are embedded and upserted. Vectors of an earlier
+    # version of the files are deleted afterwards, so the files never disappear from search midway.
+    # Batches are upserted as soon as they are embedded, with a bounded number of requests waiting.
+    existing = _list_ids(file_names)
+    new_chunks = [chunk for chunk in chunks if chunk.id not in existing]
+    with span("ingest.pinecone_upsert", chunks=len(new_chunks), skipped=len(chunks) - len(new_chunks)):
+        index = _get_index()
+        namespace = _get_namespace()
+        upserts: Deque[Future] = deque()
+        records = (record for batch, vectors in stream_embeddings(new_chunks, embeddings) for record in _records(batch, vectors))
+        for batch in _batches(records):
+            upserts.append(_get_upsert_executor().submit(index.upsert, vectors=batch, namespace=namespace))
+            while len(upserts) > MAX_QUEUED_UPSERTS_PER_THREAD * Config.VectorDB.UPSERT_CONCURRENCY:
+                upserts.popleft().result()
+        for upsert in upserts:
+            upsert.result()
+    stale = list(existing - {chunk.id for chunk in chunks})
+    if stale:
+        if Config.Preprocessing.DEDUPLICATE:
+            _move_shared(stale, set(file_names))
+        _delete_ids(stale)
 
-def create_reranker() -> FlashrankRerank:
-    return FlashrankRerank(
-        model = Config.Preprocessing.RERANKER,
-        top_n = Config.Chatbot.N_CONTEXT_RESULTS
+def _get_retrievers(retriever: CachedRetriever) -> Tuple[VectorStoreRetriever, BM25IndexRetriever]:
+    return tuple(retriever.retriever.base_retriever.retrievers)
+
+def _is_server_side_hybrid(retriever: CachedRetriever) -> bool:
+    return isinstance(retriever.retriever.base_retriever, PineconeHybridRetriever)
+
+def _with_reranker(base_retriever: BaseRetriever) -> CachedRetriever:
+    return CachedRetriever(
+        retriever=ContextualCompressionRetriever(
+            base_compressor=create_reranker(), 
+            base_retriever=base_retriever
+        )
     )
 
-def _generate_context(llm: ChatOllama, document: str, chunk: str) -> str:
-    messages = CONTEXT_PROMPT.format_messages(document=document, chunk=chunk)
-    response = llm.invoke(messages)
-    return response.content
-
-def _create_chunks(document: Document) -> List[Document]:
-    chunks = text_splitter.split_documents([document])
-    if not Config.Preprocessing.CONTEXUALIZE_CHUNKS:
-        return chunks
-    llm = create_llm()
-    contextual_chunks = []
-    for chunk in chunks:
-        context = _generate_context(llm, document.page_content, chunk.page_content)
-        chunk_with_context = f"{context} \n\n {chunk.page_content}"
-        contextual_chunks.append(Document(page_content=chunk_with_context, metadata=chunk.metadata))
-    return contextual_chunks
+def create_hybrid_retriever(embeddings: Optional[Embeddings] = None) -> CachedRetriever:
+    # Everything a query needs lives in the index, so a worker can serve the existing corpus without ingesting
+    return _with_reranker(
+        PineconeHybridRetriever(
+            index=_get_index(),
+            embeddings=embeddings or query_cached_embeddings(cached_embeddings(create_embeddings())),
+            encoder=_get_sparse_encoder(),
+            alpha=Config.VectorDB.HYBRID_ALPHA,
+            k=Config.Preprocessing.N_SEMENTIC_RESULTS + Config.Preprocessing.N_BM25_RESULTS,
+            namespace=_get_namespace(),
+            text_key=TEXT_KEY,
+        )
+    )
 
 def ingest_files(files: List[File]) -> BaseRetriever:
-    documents = [Document(file.content, metadata={"source": file.name}) for file in files]
-    chunks = []
-    for document in documents:
-        chunks.extend(_create_chunks(document))
-    
-    # Initialize Pinecone client
-    pc = Pinecone(api_key=Config.VectorDB.PINECONE_API_KEY)
+    chunks = _with_ids(deduplicate_chunks(load_chunks(files, create_chunks)))
     
     # Create embeddings
-    embeddings = create_embeddings()
+    embeddings = query_cached_embeddings(cached_embeddings(create_embeddings()))
     
+    if Config.VectorDB.HYBRID_SEARCH:
+        with span("ingest.vector_index", chunks=len(chunks)):
+            _upsert_chunks(chunks, _document_embeddings(len(chunks)), [file.name for file in files])
+        return create_hybrid_retriever(embeddings)
+
     # Create vector store using langchain_pinecone package
-    namespace = Config.VectorDB.PINECONE_NAMESPACE if Config.VectorDB.PINECONE_NAMESPACE else ""
-    
-    # Use from_documents to add new chunks
-    vectorstore = PineconeVectorStore.from_documents(
-        documents=chunks,
+    vectorstore = PineconeVectorStore(
+        index=_get_index(),
         embedding=embeddings,
-        index_name=Config.VectorDB.PINECONE_INDEX_NAME,
-        namespace=namespace,
+        text_key=TEXT_KEY,
+        namespace=_get_namespace(),
     )
+
+    with span("ingest.vector_index", chunks=len(chunks)):
+        _upsert_chunks(chunks, _document_embeddings(len(chunks)), [file.name for file in files])
     
     semantic_retriever = vectorstore.as_retriever(
         search_kwargs={"k": Config.Preprocessing.N_SEMENTIC_RESULTS}
     )
 
-    bm25_retriever = BM25Retriever.from_documents(chunks)
-    bm25_retriever.k = Config.Preprocessing.N_BM25_RESULTS
+    with span("ingest.bm25_index", chunks=len(chunks)):
+        bm25_retriever = BM25IndexRetriever.from_documents(chunks, k=Config.Preprocessing.N_BM25_RESULTS)
 
-    ensemble_retriever = EnsembleRetriever(
+    hybrid_retriever = HybridRetriever(
         retrievers=[semantic_retriever, bm25_retriever],
         weights=[0.6, 0.4],
     )
 
-    return ContextualCompressionRetriever(
-        base_compressor=create_reranker(), 
-        base_retriever=ensemble_retriever
-    )
\ No newline at end of file
+    return _with_reranker(hybrid_retriever)
+
+def add_files(retriever: CachedRetriever, files: List[File]):
+    chunks = _with_ids(deduplicate_chunks(load_chunks(files, create_chunks)))
+    names = [file.name for file in files]
+    if _is_server_side_hybrid(retriever):
+        with span("ingest.vector_index", chunks=len(chunks)):
+            _upsert_chunks(chunks, _document_embeddings(len(chunks)), names)
+        retriever.invalidate()
+        return
+    semantic_retriever, bm25_retriever = _get_retrievers(retriever)
+    with span("ingest.vector_index", chunks=len(chunks)):
+        _upsert_chunks(chunks, _document_embeddings(len(chunks)), names)
+    with span("ingest.bm25_index", chunks=len(chunks)):
+        _remove_bm25_sources(bm25_retriever, set(names))
+        bm25_retriever.add_documents(chunks)
+    retriever.invalidate()
+
+def _remove_bm25_sources(bm25_retriever: BM25IndexRetriever, names: Set[str]):
+    bm25_retriever.delete(drop_sources(bm25_retriever.docs, names))
+
+def _move_shared(ids: List[str], names: Set[str]):
+    # Vectors are listed by the file they are indexed under, but a deduplicated chunk can also come from
+    # other files. Before its file is removed, such a chunk is copied, vector and all, to an ID under
+    # the first remaining file.
+    index = _get_index()
+    namespace = _get_namespace()
+    records = []
+    with span("ingest.pinecone_move_shared", vectors=len(ids)) as attributes:
+        for start in range(0, len(ids), MAX_FETCH_IDS):
+            fetched = index.fetch(ids=ids[start : start + MAX_FETCH_IDS], namespace=namespace)["vectors"]
+            for id, vector in fetched.items():
+                document = Document(id=id, page_content=vector["metadata"][TEXT_KEY], metadata=dict(vector["metadata"]))
+                if drop_sources([document], names):
+                    continue
+                record = {
+                    "id": _source_prefix(document.metadata["source"]) + id.split("#", 1)[1],
+                    "values": list(vector["values"]),
+                    "metadata": document.metadata,
+                }
+                if Config.VectorDB.HYBRID_SEARCH:
+                    record["sparse_values"] = _get_sparse_encoder().encode_documents([document.page_content])[0]
+                records.append(record)
+        attributes["moved"] = len(records)
+        for batch in _batches(records):
+            index.upsert(vectors=batch, namespace=namespace)
+
+def remove_files(retriever: CachedRetriever, file_names: List[str]):
+    ids = list(_list_ids(file_names))
+    if Config.Preprocessing.DEDUPLICATE:
+        _move_shared(ids, set(file_names))
+    _delete_ids(ids)
+    if not _is_server_side_hybrid(retriever):
+        _, bm25_retriever = _get_retrievers(retriever)
+        _remove_bm25_sources(bm25_retriever, set(file_names))
+    retriever.invalidate()
@@ -0,0 +1,51 @@
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from data_ingestor.reranker import FUSION_SCORE_KEY
+from data_ingestor.sparse_encoder import SparseEncoder, weight_hybrid
+from instrumentation.instrumentation import span
+
+
+class PineconeHybridRetriever(BaseRetriever):
+    # One sparse-dense query against the index, in place of a dense query fused with a local BM25 index.
+    # It holds no corpus state, so a restarted worker can serve queries without ingesting anything.
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: Any
+    embeddings: Embeddings
+    encoder: SparseEncoder
+    alpha: float
+    k: int
+    namespace: str = ""
+    text_key: str = "text"
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        dense, sparse = weight_hybrid(self.embeddings.embed_query(query), self.encoder.encode_query(query), self.alpha)
+        with span("retrieve.PineconeHybrid") as attributes:
+            response = self.index.query(
+                vector=dense,
+                sparse_vector=sparse,
+                top_k=self.k,
+                include_metadata=True,
+                namespace=self.namespace,
+            )
+            attributes["documents"] = len(response["matches"])
+        documents = []
+        for match in response["matches"]:
+            metadata = dict(match["metadata"])
+            # One ranking from the server, so the reranker scores its first candidates without pooling
+            documents.append(
+                Document(
+                    id=match["id"],
+                    page_content=metadata.pop(self.text_key),
+                    metadata={**metadata, FUSION_SCORE_KEY: match["score"]},
+                )
+            )
+        return documents
@@ -0,0 +1,207 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from loguru import logger
+
+from config.config import Config
+from instrumentation.instrumentation import span
+from model_registry.model_registry import get_ranker
+
+if TYPE_CHECKING:
+    from flashrank import Ranker
+
+FUSION_SCORE_KEY = "fusion_score"
+FUSION_RANKS_KEY = "fusion_ranks"     # Rank in each fused retriever's results, 0 where it was not found
+
+
+@dataclass
+class _RerankRequest:
+    query: str
+    passages: List[str]
+    future: Future = field(default_factory=Future)
+
+
+class RerankerService:
+    # One cross-encoder per process. Requests from concurrent sessions are queued and a worker thread
+    # scores them together, so the ONNX session runs one padded batch instead of many small ones.
+    def __init__(self, model_name: str, max_tokens: int, max_batch_pairs: int, batch_wait_seconds: float):
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.max_batch_pairs = max_batch_pairs
+        self.batch_wait_seconds = batch_wait_seconds
+        self.requests = 0
+        self.batches = 0
+        self.pairs = 0
+        self._ranker: Optional["Ranker"] = None
+        self._queue: "queue.Queue[_RerankRequest]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="reranker", daemon=True)
+        self._worker.start()
+
+    def _get_ranker(self) -> "Ranker":
+        if self._ranker is None:
+            self._ranker = get_ranker(self.model_name, self.max_tokens)
+        return self._ranker
+
+    def submit(self, query: str, passages: List[str]) -> Future:
+        request = _RerankRequest(query, passages)
+        self._queue.put(request)
+        return request.future
+
+    def rerank(self, query: str, passages: List[str]) -> np.ndarray:
+        return self.submit(query, passages).result()
+
+    async def arerank(self, query: str, passages: List[str]) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(query, passages))
+
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "batches": self.batches, "pairs": self.pairs}
+
+    def _take(self, timeout: Optional[float] = None) -> Optional[_RerankRequest]:
+        # A request whose caller gave up (a cancelled arerank) is dropped; the rest can no longer be cancelled
+        while True:
+            request = self._queue.get(timeout=timeout)
+            if request.future.set_running_or_notify_cancel():
+                return request
+
+    def _next_batch(self) -> List[_RerankRequest]:
+        # Block for the first request, then collect whatever else arrives within the wait window
+        batch = [self._take()]
+        n_pairs = len(batch[0].passages)
+        while n_pairs < self.max_batch_pairs:
+            try:
+                request = self._take(timeout=self.batch_wait_seconds)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_pairs += len(request.passages)
+        return batch
+
+    def _run(self):
+        # The only worker of the process, so nothing a batch does may end the loop
+        while True:
+            batch = self._next_batch()
+            try:
+                self._process(batch)
+            except Exception:
+                logger.exception("Delivering rerank results failed")
+
+    def _process(self, batch: List[_RerankRequest]):
+        try:
+            scores = self._score([(request.query, passage) for request in batch for passage in request.passages])
+        except Exception as e:
+            logger.exception("Reranking failed")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        self.requests += len(batch)
+        self.batches += 1
+        self.pairs += len(scores)
+        start = 0
+        for request in batch:
+            request.future.set_result(scores[start : start + len(request.passages)])
+            start += len(request.passages)
+
+    def _score(self, pairs: List[tuple]) -> np.ndarray:
+        if not pairs:
+            return np.empty(0, dtype=np.float32)
+        ranker = self._get_ranker()
+        encodings = ranker.tokenizer.encode_batch(pairs)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+        }
+        token_type_ids = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        if np.any(token_type_ids):
+            inputs["token_type_ids"] = token_type_ids
+        logits = ranker.session.run(None, inputs)[0]
+        if logits.shape[1] == 1:
+            return 1 / (1 + np.exp(-logits.flatten()))
+        exp_logits = np.exp(logits)
+        return exp_logits[:, 1] / exp_logits.sum(axis=1)
+
+
+_service: Optional[RerankerService] = None
+_service_lock = threading.Lock()
+
+def get_reranker_service() -> RerankerService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = RerankerService(
+                Config.Preprocessing.RERANKER,
+                max_tokens=Config.Reranker.MAX_TOKENS,
+                max_batch_pairs=Config.Reranker.MAX_BATCH_PAIRS,
+                batch_wait_seconds=Config.Reranker.BATCH_WAIT_MS / 1000,
+            )
+        return _service
+
+
+class ServiceReranker(BaseDocumentCompressor):
+    # Reranks fused retrieval results on the shared RerankerService. Of fused results, only the top_n
+    # hits of each retriever are candidates, so a passage only BM25 found still reaches the model however
+    # low its fusion score; when the retrievers agree only top_n remain and the model is skipped.
+    top_n: int = 3
+    max_candidates: int = 8
+
+    def _candidates(self, documents: Sequence[Document]) -> List[Document]:
+        documents = list(documents)
+        if len(documents) <= self.top_n or any(FUSION_RANKS_KEY not in doc.metadata for doc in documents):
+            return documents[: self.max_candidates]
+        return [
+            doc for doc in documents if any(0 < rank <= self.top_n for rank in doc.metadata[FUSION_RANKS_KEY])
+        ][: self.max_candidates]
+
+    def _select(self, candidates: List[Document], scores: np.ndarray) -> List[Document]:
+        order = np.argsort(-scores, kind="stable")[: self.top_n]
+        return [
+            Document(
+                id=candidates[i].id,
+                page_content=candidates[i].page_content,
+                metadata={**candidates[i].metadata, "relevance_score": float(scores[i])},
+            )
+            for i in order
+        ]
+
+    def compress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None
+    ) -> Sequence[Document]:
+        with span("rerank", documents=len(documents)) as attributes:
+            candidates = self._candidates(documents)
+            attributes["candidates"] = len(candidates)
+            if len(candidates) <= self.top_n:
+                return candidates
+            scores = get_reranker_service().rerank(query, [doc.page_content for doc in candidates])
+            return self._select(candidates, scores)
+
+    async def acompress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None
+    ) -> Sequence[Document]:
+        with span("rerank", documents=len(documents)) as attributes:
+            candidates = self._candidates(documents)
+            attributes["candidates"] = len(candidates)
+            if len(candidates) <= self.top_n:
+                return candidates
+            scores = await get_reranker_service().arerank(query, [doc.page_content for doc in candidates])
+            return self._select(candidates, scores)
+
+    def compress_documents_batch(self, documents: Sequence[Sequence[Document]], queries: Sequence[str]) -> List[List[Document]]:
+        # Every query is queued before waiting on any, so the service scores them in full batches
+        with span("rerank.batch", queries=len(queries)) as attributes:
+            candidates = [self._candidates(query_documents) for query_documents in documents]
+            attributes["candidates"] = sum(len(query_candidates) for query_candidates in candidates)
+            service = get_reranker_service()
+            futures = [
+                service.submit(query, [doc.page_content for doc in query_candidates]) if len(query_candidates) > self.top_n else None
+                for query, query_candidates in zip(queries, candidates)
+            ]
+            return [
+                self._select(query_candidates, future.result()) if future else query_candidates
+                for query_candidates, future in zip(candidates, futures)
+            ]
@@ -0,0 +1,153 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from loguru import logger
+from pydantic import ConfigDict, Field
+
+from config.config import Config
+from instrumentation.instrumentation import span
+
+
+def normalize_query(query: str) -> str:
+    # The embedding model is uncased, so case and whitespace differences give the same vector
+    return " ".join(query.lower().split())
+
+
+class LRUCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class QueryCachedEmbeddings(Embeddings):
+    # Query vectors only depend on the model and the normalized text, so one cache is shared process-wide
+    def __init__(self, embeddings: Embeddings, cache: LRUCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with span("ingest.embed", texts=len(texts)):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = (Config.Preprocessing.EMBEDDING_MODEL, normalize_query(text))
+        vector = self.cache.get(key)
+        if vector is None:
+            with span("embed_query"):
+                vector = self.embeddings.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        keys = [(Config.Preprocessing.EMBEDDING_MODEL, normalize_query(text)) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with span("embed_queries", texts=len(missing)):
+                computed = embed_query_batch(self.embeddings, [texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+                self.cache.put(keys[i], vector)
+        return vectors
+
+
+def embed_query_batch(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    # The caching wrappers embed one query at a time, while FastEmbed embeds a list of queries in batches
+    inner = embeddings
+    while hasattr(inner, "embeddings"):
+        inner = inner.embeddings
+    if hasattr(getattr(inner, "model", None), "query_embed"):
+        return [vector.tolist() for vector in inner.model.query_embed(texts, batch_size=inner.batch_size, parallel=inner.parallel)]
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class CachedRetriever(BaseRetriever):
+    # Caches the reranked results of `retriever` per normalized query. The ingestors call `invalidate`
+    # whenever files are added or removed, so results never outlive the corpus they came from.
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    retriever: BaseRetriever
+    cache: LRUCache = Field(default_factory=lambda: LRUCache(Config.Cache.RETRIEVAL_RESULTS_MAX_ENTRIES))
+
+    def invalidate(self):
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"query_embeddings": _query_embedding_cache.stats(), "retrieval_results": self.cache.stats()}
+
+    def _cached(self, key: str) -> Optional[List[Document]]:
+        documents = self.cache.get(key)
+        if documents is not None:
+            logger.debug(f"Retrieval cache hit for {key!r}")
+        return documents
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        key = normalize_query(query)
+        documents = self._cached(key)
+        if documents is None:
+            documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            self.cache.put(key, documents)
+        return list(documents)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        key = normalize_query(query)
+        documents = self._cached(key)
+        if documents is None:
+            documents = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+            self.cache.put(key, documents)
+        return list(documents)
+
+
+_query_embedding_cache = LRUCache(Config.Cache.QUERY_EMBEDDINGS_MAX_ENTRIES)
+
+def query_cached_embeddings(embeddings: Embeddings) -> Embeddings:
+    return QueryCachedEmbeddings(embeddings, _query_embedding_cache)
@@ -0,0 +1,64 @@
+import math
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import mmh3
+
+from data_ingestor.bm25_index import tokenize
+
+# Without IDF, words that occur everywhere would get the same query weight as rare ones
+STOP_WORDS = frozenset(
+    "a about an and are as at be by can did do does for from has have how i in is it its me my of on or "
+    "our should that the their there these this to was we were what when where which who why will with you your".split()
+)
+
+
+class SparseEncoder:
+    # BM25 term weights as sparse vectors over hashed terms, for Pinecone's sparse-dense queries.
+    # Documents carry the saturated term frequency and queries one weight per term, so the dot product
+    # is the BM25 score without the IDF factor. Corpus statistics would have to be shared between
+    # workers, so the encoder holds none (stop words stand in for low IDF) and any worker can encode
+    # queries without ingesting.
+    def __init__(self, k1: float = 1.5, b: float = 0.75, average_length: float = 300):
+        self.k1 = k1
+        self.b = b
+        self.average_length = average_length
+
+    @staticmethod
+    def _term_index(term: str) -> int:
+        return mmh3.hash(term, signed=False)
+
+    def _to_sparse(self, weights: Dict[int, float]) -> Dict[str, List]:
+        indices = sorted(weights)
+        return {"indices": indices, "values": [weights[index] for index in indices]}
+
+    def encode_document(self, text: str) -> Dict[str, List]:
+        frequencies = Counter(tokenize(text))
+        norm = self.k1 * (1 - self.b + self.b * sum(frequencies.values()) / self.average_length)
+        weights: Dict[int, float] = defaultdict(float)
+        for term, tf in frequencies.items():
+            weights[self._term_index(term)] += tf * (self.k1 + 1) / (tf + norm)
+        return self._to_sparse(weights)
+
+    def encode_documents(self, texts: List[str]) -> List[Dict[str, List]]:
+        return [self.encode_document(text) for text in texts]
+
+    def encode_query(self, text: str) -> Dict[str, List]:
+        terms = set(tokenize(text)) - STOP_WORDS
+        weights: Dict[int, float] = defaultdict(float)
+        for term in terms:
+            weights[self._term_index(term)] += 1 / len(terms)
+        return self._to_sparse(weights)
+
+
+def normalize(dense: List[float]) -> List[float]:
+    # A dotproduct index does not normalize, so dense vectors are made unit length to stay on the sparse scale
+    norm = math.sqrt(sum(value * value for value in dense)) or 1.0
+    return [value / norm for value in dense]
+
+def weight_hybrid(dense: List[float], sparse: Dict[str, List], alpha: float):
+    # Pinecone ranks by the sum of the dense and sparse dot products, so alpha scales the two sides
+    return (
+        [value * alpha for value in normalize(dense)],
+        {"indices": sparse["indices"], "values": [value * (1 - alpha) for value in sparse["values"]]},
+    )
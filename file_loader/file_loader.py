@@ -1,33 +1,142 @@
+import multiprocessing
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import cached_property
 from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Iterator, List, Optional, Union
+
 from pypdfium2 import PdfDocument
-from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 from config.config import Config
+from instrumentation.instrumentation import span
+
+if TYPE_CHECKING:
+    from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 TEXT_FILE_EXTENSION = ".txt"
 PDF_FILE_EXTENSION = ".pdf"
 MD_FILE_EXTENSION = ".md"
 
 
+@dataclass
+class Page:
+    number: int
+    content: str
+
 @dataclass
 class File:
     name: str
-    content: str
+    pages: List[Page]
+
+    @cached_property
+    def content(self) -> str:
+        # Built once, as chunking and contextualization both read it
+        return "\n".join(page.content for page in self.pages)
+
+    @classmethod
+    def from_text(cls, name: str, content: str) -> "File":
+        return cls(name=name, pages=[Page(number=1, content=content)])
+
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    # pdfium is not thread-safe, so large PDFs are split across processes; spawn avoids forking Streamlit's threads
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(
+            max_workers=Config.FileLoader.PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_executor
+
+def _page_text(pdf: PdfDocument, index: int) -> str:
+    page = pdf[index]
+    text_page = page.get_textpage()
+    text = text_page.get_text_bounded()
+    text_page.close()
+    page.close()
+    return text
+
+def _extract_page_range(path: str, start: int, end: int) -> List[str]:
+    pdf = PdfDocument(path)
+    try:
+        return [_page_text(pdf, index) for index in range(start, end)]
+    finally:
+        pdf.close()
+
+def _extract_pages_in_parallel(path: str, n_pages: int) -> Iterator[Page]:
+    step = Config.FileLoader.PDF_PAGES_PER_TASK
+    starts = list(range(0, n_pages, step))
+    ranges = _get_pdf_executor().map(
+        _extract_page_range,
+        [path] * len(starts),
+        starts,
+        [min(start + step, n_pages) for start in starts],
+    )
+    # map() yields page ranges in order, so pages stream out while later ranges are still extracted
+    for start, texts in zip(starts, ranges):
+        for offset, text in enumerate(texts):
+            yield Page(number=start + offset + 1, content=text)
+
+def extract_pdf_pages(source: Union[str, Path, bytes, BinaryIO]) -> Iterator[Page]:
+    pdf = PdfDocument(source)
+    n_pages = len(pdf)
+    if n_pages < Config.FileLoader.PDF_PARALLEL_MIN_PAGES or Config.FileLoader.PDF_WORKERS < 2:
+        try:
+            for index in range(n_pages):
+                yield Page(number=index + 1, content=_page_text(pdf, index))
+        finally:
+            pdf.close()
+        return
+    pdf.close()
+    if isinstance(source, (str, Path)):
+        yield from _extract_pages_in_parallel(str(source), n_pages)
+        return
+    # Worker processes open the PDF by path, so in-memory sources are spooled to a temporary file once
+    with tempfile.NamedTemporaryFile(suffix=PDF_FILE_EXTENSION) as tmp_file:
+        if isinstance(source, bytes):
+            tmp_file.write(source)
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, tmp_file)
+        tmp_file.flush()
+        yield from _extract_pages_in_parallel(tmp_file.name, n_pages)
 
 def extract_pdf_content(data : bytes) -> str:
-    pdf = PdfDocument(data)
-    content = ""
-    for page in pdf:
-        text_page = page.get_textpage()
-        content += f"{text_page.get_text_bounded()}\n"
-    return content
-
-def load_uploaded_file(uploaded_file : UploadedFile) -> File:
-    file_extension = Path(uploaded_file.name).suffix
+    return "\n".join(page.content for page in extract_pdf_pages(data))
+
+def _check_extension(name: str) -> str:
+    file_extension = Path(name).suffix
     if file_extension not in Config.ALLOWED_FILE_EXTENSIONS:
-        raise ValueError(f"Invalid file extension: {file_extension} for file {uploaded_file.name}")
-    if file_extension == PDF_FILE_EXTENSION:
-        return File(name = uploaded_file.name, content = extract_pdf_content(uploaded_file.getvalue()))        
-    return File(name = uploaded_file.name, content = uploaded_file.getvalue().decode('utf-8'))
+        raise ValueError(f"Invalid file extension: {file_extension} for file {name}")
+    return file_extension
+
+def load_uploaded_file(uploaded_file : "UploadedFile") -> File:
+    with span("ingest.load_file", extension=_check_extension(uploaded_file.name)) as attributes:
+        if attributes["extension"] == PDF_FILE_EXTENSION:
+            file = File(name = uploaded_file.name, pages = list(extract_pdf_pages(uploaded_file)))
+        else:
+            file = File.from_text(name = uploaded_file.name, content = uploaded_file.getvalue().decode('utf-8'))
+        attributes["pages"] = len(file.pages)
+        return file
+
+def load_file(path: Path) -> File:
+    with span("ingest.load_file", extension=_check_extension(path.name)) as attributes:
+        if attributes["extension"] == PDF_FILE_EXTENSION:
+            file = File(name = path.name, pages = list(extract_pdf_pages(path)))
+        else:
+            file = File.from_text(name = path.name, content = path.read_text(encoding='utf-8'))
+        attributes["pages"] = len(file.pages)
+        return file
 
+def load_file_content(name: str, data: bytes) -> File:
+    with span("ingest.load_file", extension=_check_extension(name)) as attributes:
+        if attributes["extension"] == PDF_FILE_EXTENSION:
+            file = File(name = name, pages = list(extract_pdf_pages(data)))
+        else:
+            file = File.from_text(name = name, content = data.decode('utf-8'))
+        attributes["pages"] = len(file.pages)
+        return file
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from config.config import Config
+
+METRICS_PREFIX = "intellirag"
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+@dataclass
+class Span:
+    name: str
+    duration_ms: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+class MetricsRegistry:
+    # Stage duration histograms and labelled counters, rendered in the Prometheus text format
+    def __init__(self):
+        self._durations: Dict[str, List[float]] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            # One slot per bucket, then the sum and the count
+            histogram = self._durations.setdefault(stage, [0.0] * (len(DURATION_BUCKETS) + 2))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {METRICS_PREFIX}_stage_duration_seconds Time spent per pipeline stage",
+            f"# TYPE {METRICS_PREFIX}_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._durations.items()):
+                name = f"{METRICS_PREFIX}_stage_duration_seconds"
+                for bound, bucket_count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {bucket_count:g}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram[-1]:g}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram[-2]:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram[-1]:g}')
+            for counter in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {METRICS_PREFIX}_{counter}_total counter")
+                for (name, labels), value in sorted(self._counters.items()):
+                    if name == counter:
+                        label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                        lines.append(f"{METRICS_PREFIX}_{name}_total{{{label_text}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+_trace: ContextVar[Optional[List[Span]]] = ContextVar("trace", default=None)
+
+
+def record(name: str, seconds: float, **attributes: Any):
+    metrics.observe(name, seconds)
+    span = Span(name=name, duration_ms=round(seconds * 1000, 3), attributes=attributes)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append(span)
+    # TRACE is below the default level, so spans only reach the JSON sink
+    logger.bind(stage=name, duration_ms=span.duration_ms, **attributes).trace(f"{name} took {span.duration_ms:.1f} ms")
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    # Yields the span attributes, so the stage can add sizes and counts once they are known
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        record(name, time.perf_counter() - start, **attributes)
+
+def count(name: str, value: float = 1, **labels: str):
+    metrics.increment(name, value, **labels)
+
+def count_llm_tokens(usage: Optional[Dict[str, int]], model: str, stage: str) -> Dict[str, int]:
+    # Ollama reports prompt_eval_count and eval_count, which LangChain exposes as usage_metadata
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+    if usage:
+        tokens = {"prompt_tokens": usage.get("input_tokens", 0), "completion_tokens": usage.get("output_tokens", 0)}
+    count("llm_tokens", tokens["prompt_tokens"], model=model, stage=stage, kind="prompt")
+    count("llm_tokens", tokens["completion_tokens"], model=model, stage=stage, kind="completion")
+    return tokens
+
+@contextmanager
+def collect_spans() -> Iterator[List[Span]]:
+    # Spans recorded in this context, including threads and tasks started from it, are appended to the list
+    spans: List[Span] = []
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        try:
+            _trace.reset(token)
+        except ValueError:
+            # A generator closed from another context cannot reset the variable it set
+            pass
+
+
+def write_metrics_file(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(metrics.render())
+    os.replace(tmp_path, path)
+
+def export_metrics():
+    if Config.Instrumentation.METRICS_FILE:
+        write_metrics_file(Path(Config.Instrumentation.METRICS_FILE))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_metrics_server: Optional[ThreadingHTTPServer] = None
+_json_log_handler: Optional[int] = None
+_configure_lock = threading.Lock()
+
+def configure_instrumentation():
+    # Idempotent, since Streamlit reruns the app script on every interaction
+    global _metrics_server, _json_log_handler
+    with _configure_lock:
+        if Config.Instrumentation.METRICS_PORT and _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", Config.Instrumentation.METRICS_PORT), _MetricsHandler)
+            _metrics_server.daemon_threads = True
+            threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+            logger.info(f"Serving Prometheus metrics on port {Config.Instrumentation.METRICS_PORT}")
+        if Config.Instrumentation.JSON_LOG_FILE and _json_log_handler is None:
+            _json_log_handler = logger.add(
+                Config.Instrumentation.JSON_LOG_FILE,
+                level="TRACE",
+                serialize=True,
+                filter=lambda record: "stage" in record["extra"],
+            )
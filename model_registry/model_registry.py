@@ -0,0 +1,111 @@
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Hashable, Optional, Tuple
+
+from loguru import logger
+
+from config.config import Config
+from instrumentation.instrumentation import span
+
+if TYPE_CHECKING:
+    from flashrank import Ranker
+    from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+    from langchain_ollama import ChatOllama
+
+WARMUP_TEXT = "warmup"
+
+
+class ModelRegistry:
+    # Models are loaded once per process and shared by every session. Each key has its own lock, so
+    # the embedding model and the reranker load concurrently but never twice.
+    def __init__(self):
+        self._models: Dict[Hashable, Any] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, ...], load: Callable[[], Any]) -> Any:
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self._models:
+                name = ":".join(str(part) for part in key)
+                start = time.perf_counter()
+                with span("model_load", model=name):
+                    self._models[key] = load()
+                self._load_seconds[name] = round(time.perf_counter() - start, 3)
+                logger.info(f"Loaded {name} in {self._load_seconds[name]:.2f}s")
+            return self._models[key]
+
+    def load_times(self) -> Dict[str, float]:
+        return dict(self._load_seconds)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._load_seconds.clear()
+
+
+registry = ModelRegistry()
+
+
+def get_embeddings(model_name: Optional[str] = None) -> "FastEmbedEmbeddings":
+    model_name = model_name or Config.Preprocessing.EMBEDDING_MODEL
+
+    def load() -> "FastEmbedEmbeddings":
+        from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+
+        return FastEmbedEmbeddings(model_name=model_name)
+
+    return registry.get(("embeddings", model_name), load)
+
+def get_ranker(model_name: str, max_length: int) -> "Ranker":
+    def load() -> "Ranker":
+        from flashrank import Ranker
+
+        # Ranker truncates every query and passage pair to max_length tokens
+        return Ranker(model_name=model_name, max_length=max_length)
+
+    return registry.get(("reranker", model_name, max_length), load)
+
+def get_chat_model(model: str, **kwargs: Any) -> "ChatOllama":
+    # Clients with the same settings share one instance and with it one HTTP connection pool
+    def load() -> "ChatOllama":
+        from langchain_ollama import ChatOllama
+
+        return ChatOllama(model=model, **kwargs)
+
+    return registry.get(("llm", model, *sorted(f"{key}={value}" for key, value in kwargs.items())), load)
+
+def warmup_models():
+    # A dummy inference pulls the ONNX weights into memory and lets onnxruntime plan its kernels,
+    # so the first real question does not pay for it
+    from data_ingestor.reranker import get_reranker_service
+
+    with span("model_warmup"):
+        get_embeddings().embed_query(WARMUP_TEXT)
+        get_reranker_service().rerank(WARMUP_TEXT, [WARMUP_TEXT])
+    logger.info(f"Models ready, load times: {registry.load_times()}")
+
+
+_warmup_thread: Optional[threading.Thread] = None
+_warmup_lock = threading.Lock()
+
+def start_warmup():
+    # Idempotent, since Streamlit reruns the app script on every interaction
+    global _warmup_thread
+    if not Config.Models.WARMUP:
+        return
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_warmup, name="model-warmup", daemon=True)
+            _warmup_thread.start()
+
+def _warmup():
+    try:
+        warmup_models()
+    except Exception as error:
+        logger.warning(f"Model warmup failed: {error}")
@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+from aiohttp import web
+from loguru import logger
+
+from chatbot.chatbot import (
+    Chatbot,
+    ChunkEvent,
+    FinalAnswerEvent,
+    InstrumentationEvent,
+    Message,
+    SourcesEvent,
+    answer_messages,
+)
+from config.config import Config
+from data_ingestor.backends import BACKEND_MODULES, Backend, create_backend
+from file_loader.file_loader import File, load_file, load_file_content
+from instrumentation.instrumentation import count, record
+from model_registry.model_registry import start_warmup
+
+MAX_SESSION_ID_LENGTH = 128
+RETRY_AFTER_SECONDS = 1
+
+
+class Overloaded(Exception):
+    pass
+
+
+@dataclass
+class Session:
+    history: List[Message] = field(default_factory=list)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class SessionStore:
+    # Chat histories by session ID, the only state that is not shared between sessions. Sessions are
+    # kept in least recently used order, so expired and surplus ones are dropped from the front.
+    def __init__(self, max_sessions: int, ttl_seconds: float):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._sessions and next(iter(self._sessions.values())).last_used < deadline:
+            self._sessions.popitem(last=False)
+
+    def find(self, session_id: str) -> Optional[Session]:
+        self._expire()
+        return self._sessions.get(session_id)
+
+    def get(self, session_id: str) -> Session:
+        self._expire()
+        session = self._sessions.pop(session_id, None) or Session()
+        session.last_used = time.monotonic()
+        self._sessions[session_id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def reset(self, session_id: str) -> bool:
+        # A question still being answered completes into the dropped session, not into a new one
+        return self._sessions.pop(session_id, None) is not None
+
+
+class AskLimiter:
+    # At most max_active questions are answered at once, matching the slots Ollama serves in parallel.
+    # Up to max_queued wait for a slot; beyond that, or after waiting too long, a question is rejected
+    # straight away, so clients and load balancers back off instead of piling requests onto the LLM.
+    def __init__(self, max_active: int, max_queued: int, timeout_seconds: float):
+        self.max_queued = max_queued
+        self.timeout_seconds = timeout_seconds
+        self.active = 0
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(max_active)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        if self._semaphore.locked() and self.queued >= self.max_queued:
+            raise Overloaded(f"{self.queued} questions are already waiting")
+        start = time.perf_counter()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout_seconds)
+        except asyncio.TimeoutError:
+            raise Overloaded(f"No answer slot freed up within {self.timeout_seconds:g}s")
+        finally:
+            self.queued -= 1
+        record("server.ask_queue", time.perf_counter() - start)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+
+class CorpusGate:
+    # Questions read the shared retriever concurrently; an ingest waits for the questions in flight
+    # and holds new ones back until the files are indexed
+    def __init__(self):
+        self._readers = 0
+        self._writing = False
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing)
+            self._writing = True
+            try:
+                await self._condition.wait_for(lambda: self._readers == 0)
+            except BaseException:
+                self._writing = False
+                self._condition.notify_all()
+                raise
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8")
+
+def _to_sse(event) -> bytes:
+    if isinstance(event, SourcesEvent):
+        return _sse("sources", [{"source": doc.metadata.get("source"), "content": doc.page_content} for doc in event.content])
+    if isinstance(event, ChunkEvent):
+        return _sse("chunk", {"content": event.content})
+    if isinstance(event, FinalAnswerEvent):
+        return _sse("answer", {"content": event.content})
+    if isinstance(event, InstrumentationEvent):
+        return _sse("timings", [{"stage": span.name, "ms": span.duration_ms, **span.attributes} for span in event.spans])
+    raise ValueError(f"Unknown event: {event}")
+
+def _session_id(request: web.Request) -> str:
+    session_id = request.match_info["session_id"]
+    if len(session_id) > MAX_SESSION_ID_LENGTH:
+        raise web.HTTPBadRequest(text=f"Session IDs are at most {MAX_SESSION_ID_LENGTH} characters")
+    return session_id
+
+
+class ChatServer:
+    # One Chatbot, and with it one retriever and one set of models, serves every session
+    def __init__(self, backend: Backend, chatbot: Optional[Chatbot] = None):
+        self.backend = backend
+        self.chatbot = chatbot
+        self.sessions = SessionStore(Config.Server.MAX_SESSIONS, Config.Server.SESSION_TTL_SECONDS)
+        self.limiter = AskLimiter(
+            Config.Server.MAX_CONCURRENT_ASKS,
+            Config.Server.MAX_QUEUED_ASKS,
+            Config.Server.QUEUE_TIMEOUT_SECONDS,
+        )
+        self.corpus = CorpusGate()
+
+    def routes(self) -> List[web.RouteDef]:
+        return [
+            web.get("/health", self.health),
+            web.post("/files", self.ingest),
+            web.get("/sessions/{session_id}", self.history),
+            web.post("/sessions/{session_id}/ask", self.ask),
+            web.post("/sessions/{session_id}/reset", self.reset),
+        ]
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "backend": self.backend.name,
+                "files": [file.name for file in self.chatbot.files] if self.chatbot else [],
+                "sessions": len(self.sessions),
+                "active_asks": self.limiter.active,
+                "queued_asks": self.limiter.queued,
+            }
+        )
+
+    async def _read_part(self, part, max_bytes: int, read_bytes: int) -> bytearray:
+        # client_max_size does not cover multipart reads, so the upload is capped while it streams in
+        data = bytearray()
+        while chunk := await part.read_chunk():
+            data.extend(chunk)
+            if read_bytes + len(data) > max_bytes:
+                raise web.HTTPRequestEntityTooLarge(max_size=max_bytes, actual_size=read_bytes + len(data))
+        return data
+
+    async def _read_files(self, request: web.Request) -> List[File]:
+        files = []
+        max_bytes = Config.Server.MAX_UPLOAD_MB * 1024 * 1024
+        read_bytes = 0
+        reader = await request.multipart()
+        async for part in reader:
+            if not part.filename:
+                continue
+            data = await self._read_part(part, max_bytes, read_bytes)
+            read_bytes += len(data)
+            try:
+                files.append(await asyncio.to_thread(load_file_content, Path(part.filename).name, bytes(data)))
+            except (ValueError, UnicodeDecodeError) as error:
+                raise web.HTTPBadRequest(text=f"Could not load {part.filename}: {error}")
+        if not files:
+            raise web.HTTPBadRequest(text="Upload at least one file as multipart/form-data")
+        return files
+
+    async def ingest(self, request: web.Request) -> web.Response:
+        # Files with the name of an ingested file replace it
+        files = await self._read_files(request)
+        async with self.corpus.write():
+            if self.chatbot is None:
+                self.chatbot = await asyncio.to_thread(Chatbot, files, self.backend)
+            else:
+                await asyncio.to_thread(self.chatbot.add_files, files)
+        return web.json_response(
+            {"added": [file.name for file in files], "files": [file.name for file in self.chatbot.files]}
+        )
+
+    async def history(self, request: web.Request) -> web.Response:
+        session = self.sessions.find(_session_id(request))
+        if session is None:
+            raise web.HTTPNotFound(text="Unknown session")
+        return web.json_response([{"role": message.role.value, "content": message.content} for message in session.history])
+
+    async def reset(self, request: web.Request) -> web.Response:
+        return web.json_response({"reset": self.sessions.reset(_session_id(request))})
+
+    async def _question(self, request: web.Request) -> str:
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="Send the question as JSON: {\"question\": \"...\"}")
+        question = body.get("question") if isinstance(body, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            raise web.HTTPBadRequest(text="The question must be a non-empty string")
+        return question
+
+    async def ask(self, request: web.Request) -> web.StreamResponse:
+        session_id = _session_id(request)
+        question = await self._question(request)
+        if self.chatbot is None:
+            raise web.HTTPConflict(text="Upload files to /files before asking questions")
+        session = self.sessions.get(session_id)
+        if session.lock.locked():
+            raise web.HTTPConflict(text="A question is already being answered in this session")
+        async with session.lock:
+            try:
+                # Questions held back by an ingest wait outside the limiter, so they take no answer slot
+                async with self.corpus.read(), self.limiter.slot():
+                    return await self._stream_answer(request, session, question)
+            except Overloaded as error:
+                count("server_rejected_asks")
+                raise web.HTTPServiceUnavailable(text=str(error), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    async def _stream_answer(self, request: web.Request, session: Session, question: str) -> web.StreamResponse:
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+        await response.prepare(request)
+        # Answers see the history as it was when the question arrived
+        events = self.chatbot.aask(question, session.history)
+        try:
+            async for event in events:
+                if isinstance(event, FinalAnswerEvent):
+                    session.history.extend(answer_messages(question, event))
+                # write() waits while the client's socket buffer is full, so a slow reader slows down
+                # its own generation instead of buffering the answer in memory
+                await response.write(_to_sse(event))
+        except ConnectionResetError:
+            logger.info("Client disconnected before the answer was complete")
+            return response
+        except Exception as error:
+            logger.exception(f"Could not answer the question: {error}")
+            await response.write(_sse("error", {"message": str(error)}))
+        finally:
+            await events.aclose()
+        await response.write_eof()
+        return response
+
+
+def create_app(backend: Optional[Backend] = None, chatbot: Optional[Chatbot] = None) -> web.Application:
+    server = ChatServer(backend or create_backend(Config.Server.BACKEND), chatbot)
+    app = web.Application(client_max_size=Config.Server.MAX_UPLOAD_MB * 1024 * 1024)
+    app.add_routes(server.routes())
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve IntelliRAG over HTTP, answers streamed as server-sent events")
+    parser.add_argument("--host", default=Config.Server.HOST)
+    parser.add_argument("--port", type=int, default=Config.Server.PORT)
+    parser.add_argument("--backend", default=Config.Server.BACKEND, choices=list(BACKEND_MODULES))
+    parser.add_argument("files", nargs="*", type=Path, help="Files to ingest before serving")
+    args = parser.parse_args()
+    start_warmup()
+    backend = create_backend(args.backend)
+    chatbot = Chatbot([load_file(path) for path in args.files], backend) if args.files else None
+    web.run_app(create_app(backend, chatbot), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()